@@ -0,0 +1,410 @@
+##
+# @file: address_clusters.py
+# @brief: Clustering of rotating random addresses into logical devices
+
+"""Clustering of rotating random addresses into logical devices
+
+Phones, watches and trackers advertise with a random private address, which changes
+every few minutes. Without clustering, every new address is a new device in the
+registry and a new row in the database. AddressClusters links the addresses of one
+physical device to a logical device, whose id is its first address.
+
+At its first sighting, a new address cannot be told apart from a device which just
+came in range. So a new resolvable or non-resolvable private address starts as a
+provisional logical device. After settle_time seconds it is merged into an existing
+logical device when:
+
+* its address kind and advertised name are the same. This is the key of the hash
+  index, so the candidates are found in O(1),
+* the payload shape (manufacturer ids and lengths, service UUIDs and lengths, TX
+  power) does not contradict the shape of the candidate,
+* the candidate went silent when the new address appeared, at most max_gap seconds
+  before it (timing continuity), and
+* the RSSI did not jump by more than max_rssi_jump.
+
+Of the candidates, the one with the closest RSSI wins. The merges are collected for
+pop_merged(), so the owner of the registry can drop the provisional device. A
+superseded address which is seen again proves that the merge was wrong: the newer
+addresses are split off into a logical device of their own. Logical devices which
+are not seen for expire_after seconds are forgotten, so the clusters stay bounded by
+the devices in range.
+
+Public and static random addresses do not rotate, they are their own logical device
+and cost nothing here.
+"""
+
+# global imports
+import time
+from collections import deque, namedtuple
+
+# Address kind of the two most significant bits of a random address
+RANDOM_KINDS = {0b11: "static", 0b01: "resolvable", 0b00: "non-resolvable", 0b10: "reserved"}
+ROTATING_KINDS = frozenset(("resolvable", "non-resolvable"))
+
+# The payload shape of the advertisements of a device. manufacturer is a tuple of
+# (company id, data length, first data byte), service a tuple of (UUID, data length)
+AdvShape = namedtuple("AdvShape", "manufacturer service txpower")
+
+
+# -----------------------------------------------------------------------------
+def address_kind(addr, addr_type="") -> str:
+    """Return the kind of a BT address
+
+    If addr_type is not known, an address with the multicast or the locally administered
+    bit set is random, because no public address has them.
+
+    :param addr: The BT address
+    :param addr_type: "public", "random" or "" if unknown, as in the info of the device
+    :returns: "public", "static", "resolvable", "non-resolvable" or "reserved"
+
+    >>> address_kind("D8:DD:6B:81:74:8B"), address_kind("47:B6:7A:81:C4:BC"), address_kind("18:93:7F:B1:71:37", "random")
+    ('public', 'resolvable', 'non-resolvable')
+    """
+
+    first = int(addr[:2], 16)
+    if addr_type == "public" or (addr_type != "random" and not first & 0x03):
+        return "public"
+    return RANDOM_KINDS[first >> 6]
+
+
+def is_rotating(addr, addr_type="") -> bool:
+    """Test if an address is a private address, which rotates"""
+
+    return address_kind(addr, addr_type) in ROTATING_KINDS
+
+
+def clean_name(addr, name) -> str:
+    """Return the name, or "" if it is the name bluez makes of the address
+
+    >>> clean_name("47:B6:7A:81:C4:BC", "47-B6-7A-81-C4-BC"), clean_name("5A:B5:65:89:46:37", "Tile")
+    ('', 'Tile')
+    """
+
+    return "" if not name or name == addr.replace(":", "-") else name
+
+
+# -----------------------------------------------------------------------------
+def shape_of(manufacturer_data=None, service_data=None, txpower=None) -> AdvShape:
+    """Make the payload shape of an advertisement
+
+    Only the layout is kept, not the content, which may change with every rotation.
+    The first byte of manufacturer data is kept, because it is the message type of
+    e.g. Apple and Microsoft advertisements.
+
+    :param manufacturer_data: dictionary of company id and bytes
+    :param service_data: dictionary of service UUID and bytes
+    :param txpower: The TX power, or None
+    :returns: AdvShape
+
+    >>> shape_of({0x004C: bytes.fromhex("1005031c")}, None, -12)
+    AdvShape(manufacturer=((76, 4, 16),), service=None, txpower=-12)
+    """
+
+    manufacturer = tuple(sorted((company, len(data), data[0] if data else None)
+                                for company, data in manufacturer_data.items())) if manufacturer_data else None
+    service = tuple(sorted((uuid, len(data)) for uuid, data in service_data.items())) if service_data else None
+    return AdvShape(manufacturer, service, txpower)
+
+
+def shapes_compatible(shape1, shape2) -> bool:
+    """Test if two shapes can belong to the same device. Unknown fields match anything.
+
+    >>> shapes_compatible(AdvShape(((76, 4, 16),), None, None), AdvShape(((76, 4, 16),), None, -12))
+    True
+    >>> shapes_compatible(AdvShape(((76, 4, 16),), None, None), AdvShape(((76, 7, 18),), None, None))
+    False
+    """
+
+    if shape1 is None or shape2 is None:
+        return True
+    return all(a is None or b is None or a == b for a, b in zip(shape1, shape2))
+
+
+def merge_shapes(old, new) -> AdvShape:
+    """Return the fields of new, and those of old where new is unknown
+
+    >>> merge_shapes(AdvShape(((76, 4, 16),), None, None), shape_of(txpower=-12))
+    AdvShape(manufacturer=((76, 4, 16),), service=None, txpower=-12)
+    """
+
+    if old is None:
+        return new
+    return AdvShape(*(old_field if new_field is None else new_field for old_field, new_field in zip(old, new)))
+
+
+# -----------------------------------------------------------------------------
+class Cluster:
+    """A logical device, with the addresses it used"""
+
+    __slots__ = ("id", "addr", "key", "shape", "first_seen", "last_seen", "rssi", "addresses", "rotations", "provisional")
+
+    def __init__(self, addr, key, now, max_aliases):
+        self.id = addr  # the first address
+        self.addr = addr  # the current address
+        self.key = key  # hash index key, tuple of (address kind, name)
+        self.shape = None  # AdvShape, None if not known yet
+        self.first_seen = now
+        self.last_seen = now
+        self.rssi = None
+        self.addresses = deque([addr], max_aliases)  # the latest addresses, for the aliases
+        self.rotations = 0
+        self.provisional = True  # True until it is known whether it is a new address of another device
+
+
+# -----------------------------------------------------------------------------
+class AddressClusters:
+    """Map the addresses of devices to logical device ids
+
+    >>> clusters = AddressClusters(max_gap=10.0, settle_time=5.0, clock=lambda: 0.0)
+    >>> clusters.resolve("47:B6:7A:81:C4:BC", now=0.0, name="Galaxy Watch", rssi=-60)
+    '47:B6:7A:81:C4:BC'
+    >>> clusters.resolve("47:B6:7A:81:C4:BC", now=100.0, rssi=-62)
+    '47:B6:7A:81:C4:BC'
+    >>> clusters.resolve("5A:B5:65:89:46:37", now=104.0, name="Galaxy Watch", rssi=-64)
+    '5A:B5:65:89:46:37'
+    >>> clusters.resolve("5A:B5:65:89:46:37", now=110.0, rssi=-63)
+    '47:B6:7A:81:C4:BC'
+    >>> clusters.pop_merged(), clusters.current("47:B6:7A:81:C4:BC"), len(clusters)
+    ([('5A:B5:65:89:46:37', '47:B6:7A:81:C4:BC')], '5A:B5:65:89:46:37', 1)
+    >>> clusters.resolve("D8:DD:6B:81:74:8B", now=111.0, name="Hue Lamp")
+    'D8:DD:6B:81:74:8B'
+    """
+
+    def __init__(self, max_gap=10.0, max_rssi_jump=15, settle_time=10.0, expire_after=900.0, max_aliases=4,
+                 clock=time.monotonic):
+        """
+        :param max_gap: Maximum number of seconds between the last sighting of the old address and the new address
+        :param max_rssi_jump: Maximum RSSI difference between the old and the new address, in dB
+        :param settle_time: Number of seconds a new address is provisional
+        :param expire_after: Number of seconds after which an unseen logical device is forgotten
+        :param max_aliases: Number of addresses per logical device which are still recognized
+        :param clock: function returning the current time in seconds
+        """
+
+        self.max_gap = max_gap
+        self.max_rssi_jump = max_rssi_jump
+        self.settle_time = settle_time
+        self.expire_after = expire_after
+        self.max_aliases = max_aliases
+        self.clock = clock
+
+        self.clusters = {}  # key is the logical id, value is Cluster
+        self.aliases = {}  # key is an address, value is the logical id
+        self.index = {}  # key is (address kind, name), value is a set of logical ids
+        self.provisional = deque()  # ids of the provisional logical devices, oldest first
+        self.merged = []  # (provisional id, logical id) of the merges since pop_merged()
+        self.links = 0  # number of addresses linked to an existing logical device
+        self.splits = 0  # number of links which were undone
+        self.last_expire = clock()
+
+    # -------------------------------------------------------------------------
+    def _index_add(self, cluster):
+        self.index.setdefault(cluster.key, set()).add(cluster.id)
+
+    def _index_remove(self, cluster):
+        ids = self.index.get(cluster.key)
+        if ids is not None:
+            ids.discard(cluster.id)
+            if not ids:
+                del self.index[cluster.key]
+
+    def _new_cluster(self, addr, key, now) -> Cluster:
+        cluster = Cluster(addr, key, now, self.max_aliases)
+        self.clusters[addr] = cluster
+        self.aliases[addr] = addr
+        self._index_add(cluster)
+        return cluster
+
+    def _add_alias(self, cluster, addr):
+        """Make addr the current address of the cluster, and drop the oldest alias if there are too many"""
+
+        if len(cluster.addresses) == cluster.addresses.maxlen:
+            oldest = cluster.addresses[0]
+            if self.aliases.get(oldest) == cluster.id and oldest != cluster.id:
+                del self.aliases[oldest]
+        cluster.addresses.append(addr)
+        cluster.addr = addr
+        self.aliases[addr] = cluster.id
+
+    # -------------------------------------------------------------------------
+    def _match(self, new):
+        """Find the logical device which the provisional cluster new is the next address of, or None"""
+
+        best = None
+        best_jump = None
+        for cid in self.index.get(new.key, ()):
+            cluster = self.clusters[cid]
+            if cluster.provisional:
+                continue
+            # Silent since the new address appeared, but not for too long
+            if not 0.0 < new.first_seen - cluster.last_seen <= self.max_gap:
+                continue
+            if not shapes_compatible(cluster.shape, new.shape):
+                continue
+            jump = abs(new.rssi - cluster.rssi) if new.rssi is not None and cluster.rssi is not None else 0
+            if jump > self.max_rssi_jump:
+                continue
+            if best is None or jump < best_jump:
+                best, best_jump = cluster, jump
+        return best
+
+    def _settle(self, now):
+        """Decide about the provisional logical devices which are older than settle_time"""
+
+        while self.provisional and now - self.clusters[self.provisional[0]].first_seen >= self.settle_time:
+            new = self.clusters[self.provisional.popleft()]
+            new.provisional = False
+            cluster = self._match(new)
+            if cluster is None:
+                continue
+
+            # Merge: the addresses of new become aliases of cluster
+            del self.clusters[new.id]
+            self._index_remove(new)
+            for addr in new.addresses:
+                self._add_alias(cluster, addr)
+            cluster.last_seen = max(cluster.last_seen, new.last_seen)
+            cluster.rssi = new.rssi if new.rssi is not None else cluster.rssi
+            cluster.shape = merge_shapes(cluster.shape, new.shape) if new.shape is not None else cluster.shape
+            cluster.rotations += 1
+            self.links += 1
+            self.merged.append((new.id, cluster.id))
+
+    # -------------------------------------------------------------------------
+    def resolve(self, addr, now=None, name=None, rssi=None, shape=None, addr_type="") -> str:
+        """Register a sighting of an address, and return the id of its logical device
+
+        :param addr: The BT address
+        :param now: Time of the sighting, default clock()
+        :param name: The advertised name, if known
+        :param rssi: The RSSI, if known
+        :param shape: The AdvShape of the advertisement, if known
+        :param addr_type: "public", "random" or "" if unknown
+        :returns: The logical id, the address itself if it does not rotate
+        """
+
+        cid = self.aliases.get(addr)
+        if cid is None and not is_rotating(addr, addr_type):
+            return addr
+        if now is None:
+            now = self.clock()
+        self._settle(now)
+        if now - self.last_expire >= self.expire_after / 4:
+            self.expire(now)
+
+        cid = self.aliases.get(addr)
+        if cid is not None:
+            cluster = self.clusters[cid]
+            if addr != cluster.addr:
+                cluster = self._split(cluster, addr)
+        else:
+            cluster = self._new_cluster(addr, (address_kind(addr, addr_type), ""), now)
+            self.provisional.append(addr)
+
+        cluster.last_seen = now
+        if rssi is not None:
+            cluster.rssi = rssi
+        if shape is not None:
+            cluster.shape = merge_shapes(cluster.shape, shape)
+        name = clean_name(addr, name)
+        if name and name != cluster.key[1]:
+            self._index_remove(cluster)
+            cluster.key = (cluster.key[0], name)
+            self._index_add(cluster)
+        return cluster.id
+
+    def _split(self, cluster, addr) -> Cluster:
+        """A superseded address of cluster is seen again: the addresses after it belong to another device
+
+        :returns: the cluster of addr
+        """
+
+        addresses = list(cluster.addresses)
+        # The first address stays an alias after it dropped out of the latest addresses
+        position = addresses.index(addr) if addr in addresses else -1
+        newer = addresses[position + 1:]
+        self.splits += 1
+
+        other = self._new_cluster(newer[0], cluster.key, cluster.last_seen)
+        other.provisional = False
+        other.shape, other.rssi = cluster.shape, cluster.rssi
+        for newer_addr in newer[1:]:
+            self._add_alias(other, newer_addr)
+
+        cluster.addresses = deque(addresses[:position + 1] or [addr], self.max_aliases)
+        cluster.addr = addr
+        cluster.rotations -= len(newer)
+        return cluster
+
+    # -------------------------------------------------------------------------
+    def pop_merged(self) -> list:
+        """Return the merges since the previous call
+
+        :returns: list of (provisional id, logical id) tuples. The provisional id is not used anymore.
+        """
+
+        merged, self.merged = self.merged, []
+        return merged
+
+    def lookup(self, addr) -> str:
+        """Return the logical id of an address, without registering a sighting"""
+
+        return self.aliases.get(addr, addr)
+
+    def current(self, cid) -> str:
+        """Return the current address of a logical device"""
+
+        cluster = self.clusters.get(cid)
+        return cluster.addr if cluster is not None else cid
+
+    def is_current(self, addr) -> bool:
+        """Test if addr is the latest address of its logical device"""
+
+        cid = self.aliases.get(addr)
+        return cid is None or self.clusters[cid].addr == addr
+
+    # -------------------------------------------------------------------------
+    def expire(self, now=None) -> list:
+        """Forget the logical devices which were not seen for expire_after seconds
+
+        :returns: list of the forgotten logical ids
+        """
+
+        if now is None:
+            now = self.clock()
+        self.last_expire = now
+        self._settle(now)
+        expired = [cid for cid, cluster in self.clusters.items() if now - cluster.last_seen > self.expire_after]
+        for cid in expired:
+            cluster = self.clusters.pop(cid)
+            self._index_remove(cluster)
+            for addr in cluster.addresses:
+                if self.aliases.get(addr) == cid:
+                    del self.aliases[addr]
+            self.aliases.pop(cid, None)
+        return expired
+
+    def stats(self) -> dict:
+        """Number of logical devices, addresses, and links"""
+
+        return {
+            "devices": len(self.clusters),
+            "provisional": len(self.provisional),
+            "addresses": len(self.aliases),
+            "links": self.links,
+            "splits": self.splits,
+        }
+
+    def __len__(self):
+        return len(self.clusters)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,237 @@
+##
+# @file: adv_decoders.py
+# @brief: Decoders for advertisement payloads
+
+"""Decoders for advertisement payloads
+
+The ManufacturerData and ServiceData of a device are raw bytes. The decoders in
+this module interpret the common beacon formats. They are registered by company id
+or by service UUID, so finding the decoder of a payload is a single dictionary lookup:
+
+- iBeacon (Apple, company 0x004c)
+- Microsoft Connected Devices Platform beacon (Microsoft, company 0x0006)
+- Eddystone UID, URL and TLM (service 0xfeaa)
+- Exposure Notification (service 0xfd6f)
+
+Add a decoder for another format with the manufacturer_decoder() or service_decoder()
+decorator. A decoder gets a memoryview of the payload and returns a namedtuple, or
+None if the payload is not in its format.
+"""
+
+# global imports
+import struct
+from collections import namedtuple
+
+# Decoders, key is the company id (int)
+manufacturer_decoders = {}
+# Decoders, key is the 128-bit service UUID string, as shown by bluetoothctl
+service_decoders = {}
+
+IBeacon = namedtuple("IBeacon", "uuid major minor txpower")
+MicrosoftCDP = namedtuple("MicrosoftCDP", "scenario version device_type flags salt device_hash")
+EddystoneUID = namedtuple("EddystoneUID", "txpower namespace instance")
+EddystoneURL = namedtuple("EddystoneURL", "txpower url")
+EddystoneTLM = namedtuple("EddystoneTLM", "version battery_mv temperature adv_count uptime")
+ExposureNotification = namedtuple("ExposureNotification", "rpi aem")
+
+# type 0x02, length 0x15, proximity UUID, major, minor, measured power at 1 m
+IBEACON = struct.Struct(">BB16sHHb")
+# scenario type, version and device type, version and flags, reserved, salt, device hash
+MICROSOFT_CDP = struct.Struct(">BBBB4s16s")
+# frame type, tx power at 0 m, namespace, instance
+EDDYSTONE_UID = struct.Struct(">Bb10s6s")
+# frame type, tx power at 0 m, URL scheme
+EDDYSTONE_URL = struct.Struct(">BbB")
+# frame type, version, battery voltage, temperature (8.8 fixed point), advertisement count, uptime in 0.1 s
+EDDYSTONE_TLM = struct.Struct(">BBHhII")
+# rolling proximity identifier, associated encrypted metadata
+EXPOSURE_NOTIFICATION = struct.Struct(">16s4s")
+
+EDDYSTONE_URL_SCHEMES = ("http://www.", "https://www.", "http://", "https://")
+EDDYSTONE_URL_EXPANSIONS = (
+    ".com/", ".org/", ".edu/", ".net/", ".info/", ".biz/", ".gov/",
+    ".com", ".org", ".edu", ".net", ".info", ".biz", ".gov",
+)
+
+
+# -----------------------------------------------------------------------------
+def service_uuid(short) -> str:
+    """The 128-bit UUID string of a 16-bit Bluetooth SIG service UUID
+
+    >>> service_uuid(0xfd6f)
+    '0000fd6f-0000-1000-8000-00805f9b34fb'
+    """
+
+    return f"0000{short:04x}-0000-1000-8000-00805f9b34fb"
+
+
+# -----------------------------------------------------------------------------
+def manufacturer_decoder(company_id):
+    """Decorator to register the decoder of the ManufacturerData of a company id"""
+
+    def register(func):
+        manufacturer_decoders[company_id] = func
+        return func
+    return register
+
+
+def service_decoder(short):
+    """Decorator to register the decoder of the ServiceData of a 16-bit service UUID"""
+
+    def register(func):
+        service_decoders[service_uuid(short)] = func
+        return func
+    return register
+
+
+# -----------------------------------------------------------------------------
+@manufacturer_decoder(0x004C)
+def decode_ibeacon(data):
+    """Decode an iBeacon
+
+    >>> decode_ibeacon(memoryview(bytes.fromhex("0215f7826da64fa24e988024bc5b71e0893e04d2162ec5")))
+    IBeacon(uuid='f7826da6-4fa2-4e98-8024-bc5b71e0893e', major=1234, minor=5678, txpower=-59)
+    """
+
+    if len(data) < IBEACON.size:
+        return None
+    beacon_type, length, proximity_uuid, major, minor, txpower = IBEACON.unpack_from(data)
+    if beacon_type != 0x02 or length != 0x15:
+        return None
+    h = proximity_uuid.hex()
+    return IBeacon(f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}", major, minor, txpower)
+
+
+# -----------------------------------------------------------------------------
+@manufacturer_decoder(0x0006)
+def decode_microsoft_cdp(data):
+    """Decode a Microsoft Connected Devices Platform beacon
+
+    >>> decode_microsoft_cdp(memoryview(bytes.fromhex("0129010011223344" + "ab" * 16)))[:4]
+    (1, 1, 9, 1)
+    """
+
+    if len(data) < MICROSOFT_CDP.size:
+        return None
+    scenario, version_type, version_flags, _reserved, salt, device_hash = MICROSOFT_CDP.unpack_from(data)
+    return MicrosoftCDP(scenario, version_type >> 5, version_type & 0x1F, version_flags & 0x1F, salt, device_hash)
+
+
+# -----------------------------------------------------------------------------
+def decode_eddystone_url(data) -> str:
+    """Expand an encoded Eddystone URL, starting with the scheme byte
+
+    >>> decode_eddystone_url(memoryview(b"\\x03goo.gl/abc"))
+    'https://goo.gl/abc'
+    >>> decode_eddystone_url(memoryview(b"\\x01example\\x07"))
+    'https://www.example.com'
+    """
+
+    parts = [EDDYSTONE_URL_SCHEMES[data[0]]]
+    for char in data[1:]:
+        if char < len(EDDYSTONE_URL_EXPANSIONS):
+            parts.append(EDDYSTONE_URL_EXPANSIONS[char])
+        else:
+            parts.append(chr(char))
+    return "".join(parts)
+
+
+@service_decoder(0xFEAA)
+def decode_eddystone(data):
+    """Decode an Eddystone UID, URL or TLM frame
+
+    >>> decode_eddystone(memoryview(bytes.fromhex("00ee" + "11" * 10 + "22" * 6))).txpower
+    -18
+    >>> decode_eddystone(memoryview(bytes.fromhex("20000bb81900000000100000002a")))
+    EddystoneTLM(version=0, battery_mv=3000, temperature=25.0, adv_count=16, uptime=4.2)
+    """
+
+    if not data:
+        return None
+    frame_type = data[0]
+    if frame_type == 0x00 and len(data) >= EDDYSTONE_UID.size:
+        _frame, txpower, namespace, instance = EDDYSTONE_UID.unpack_from(data)
+        return EddystoneUID(txpower, namespace, instance)
+    if frame_type == 0x10 and len(data) > EDDYSTONE_URL.size:
+        _frame, txpower, scheme = EDDYSTONE_URL.unpack_from(data)
+        if scheme >= len(EDDYSTONE_URL_SCHEMES):
+            return None
+        return EddystoneURL(txpower, decode_eddystone_url(data[2:]))
+    if frame_type == 0x20 and len(data) >= EDDYSTONE_TLM.size:
+        _frame, version, battery_mv, temperature, adv_count, uptime = EDDYSTONE_TLM.unpack_from(data)
+        return EddystoneTLM(version, battery_mv, temperature / 256, adv_count, uptime / 10)
+    return None
+
+
+# -----------------------------------------------------------------------------
+@service_decoder(0xFD6F)
+def decode_exposure_notification(data):
+    """Decode an Exposure Notification (GAEN) advertisement
+
+    >>> decode_exposure_notification(memoryview(bytes(20))).aem
+    b'\\x00\\x00\\x00\\x00'
+    """
+
+    if len(data) < EXPOSURE_NOTIFICATION.size:
+        return None
+    return ExposureNotification(*EXPOSURE_NOTIFICATION.unpack_from(data))
+
+
+# -----------------------------------------------------------------------------
+def decode_manufacturer_data(company_id, data):
+    """Decode the ManufacturerData of a company
+
+    :param company_id: The company id, as int
+    :param data: The payload, bytes
+    :returns: namedtuple, or None if there is no decoder or the payload does not match
+    """
+
+    decoder = manufacturer_decoders.get(company_id)
+    return decoder(memoryview(data)) if decoder else None
+
+
+def decode_service_data(service, data):
+    """Decode the ServiceData of a service
+
+    :param service: The 128-bit service UUID string
+    :param data: The payload, bytes
+    :returns: namedtuple, or None if there is no decoder or the payload does not match
+    """
+
+    decoder = service_decoders.get(service)
+    return decoder(memoryview(data)) if decoder else None
+
+
+# -----------------------------------------------------------------------------
+def decode_advertisement(manufacturer_data=None, service_data=None) -> list:
+    """Decode all payloads of a device, like the fields of a DeviceInfo
+
+    :param manufacturer_data: dictionary of company id (int) and bytes
+    :param service_data: dictionary of service UUID and bytes
+    :returns: list of the decoded namedtuples
+
+    >>> decode_advertisement(service_data={service_uuid(0xfd6f): bytes.fromhex("d7e5ea9f94474c30aa0c44a955260dd94fb78cfd")})
+    [ExposureNotification(rpi=b'\\xd7\\xe5\\xea\\x9f\\x94GL0\\xaa\\x0cD\\xa9U&\\r\\xd9', aem=b'O\\xb7\\x8c\\xfd')]
+    """
+
+    decoded = []
+    for company_id, data in (manufacturer_data or {}).items():
+        result = decode_manufacturer_data(company_id, data)
+        if result is not None:
+            decoded.append(result)
+    for service, data in (service_data or {}).items():
+        result = decode_service_data(service, data)
+        if result is not None:
+            decoded.append(result)
+    return decoded
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
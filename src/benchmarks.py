@@ -0,0 +1,1107 @@
+##
+# @file: benchmarks.py
+# @brief: Performance benchmarks
+
+"""Performance benchmarks
+
+Run all benchmarks with 'python benchmarks.py', or only some of them with
+'python benchmarks.py ram_tier ...'
+
+'--json FILE' writes the results, with the commit and the platform, as JSON. To see
+regressions of the parsers between two versions, run 'python benchmarks.py --json
+old.json parsers' on the old version, and 'python benchmarks.py --compare old.json
+parsers' on the new one. The parser suite itself is in parser_benchmarks.py.
+"""
+
+# global imports
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+from shlex import split
+
+# local imports
+from lib.helper import print_header
+from lib.helper import int_to_addr
+from lib.helper import debug
+from device_dbase import DeviceDatabase
+from device_dbase import SightingLog
+import rssi_codec
+from device_backends import backends, open_backend
+from bluetoothctl_session import BluetoothctlSession
+from command import run_command
+import py_bluetoothctl_scan
+from info_parser import parse_info
+import adv_decoders
+from capture import CaptureWriter, replay_capture
+import rssi_filter
+from presence import PresenceTracker
+from scan_scheduler import DutyCycleScheduler
+from multi_scan import MultiAdapterScanner, list_controllers
+from info_refresh import RefreshScheduler
+import sighting_buffer
+from ndjson_output import ENCODER, NdjsonWriter, jsonable
+from address_clusters import AddressClusters
+from event_bus import EventBus
+from parser_benchmarks import bench_parsers, compare_parsers, print_comparison
+
+
+# -----------------------------------------------------------------------------
+def timed(func, *args, **kwargs):
+    """Call func once and measure the elapsed time
+
+    :returns: tuple of (elapsed seconds, return value of func)
+    """
+
+    start = time.perf_counter()
+    ret = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return elapsed, ret
+
+
+# -----------------------------------------------------------------------------
+def make_addresses(count):
+    """Create count unique, valid looking BT addresses
+
+    >>> make_addresses(2)
+    ['00:00:00:00:00:00', '00:00:00:00:00:01']
+    """
+
+    return [int_to_addr(i) for i in range(count)]
+
+
+# -----------------------------------------------------------------------------
+def bench_ram_tier(count=2000):
+    """Ingest speed of DeviceDatabase on disk versus in RAM mode.
+    Every add() commits, which is one SD card write per device on disk.
+
+    :param count: Number of devices to add
+    :returns: dict with devices per second for each mode
+    """
+
+    addresses = make_addresses(count)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        for mode, ramfile in (("disk", None), ("ram", ":memory:")):
+            db = DeviceDatabase(Path(folder) / f"{mode}.sqlite", ramfile=ramfile)
+            elapsed, _ret = timed(lambda: [db.add(addr, "bench", f"Device {addr}") for addr in addresses])
+            db.close()
+            results[mode] = count / elapsed
+
+    print_header(f"DeviceDatabase ingest, {count} devices")
+    for mode, rate in results.items():
+        print(f"{mode:6} {rate:12.0f} devices/s")
+    print(f"speed-up {results['ram'] / results['disk']:.1f}x")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def make_sightings(count, devices=500, start=1600000000.0):
+    """Create count sightings of a number of devices, 10 ms apart, seen by two adapters
+
+    >>> make_sightings(2)
+    [('00:00:00:00:00:00', 1600000000.0, -40, 0), ('00:00:00:00:00:01', 1600000000.01, -41, 1)]
+    """
+
+    addresses = make_addresses(devices)
+    return [(addresses[i % devices], start + i / 100, -40 - i % 50, i % 2) for i in range(count)]
+
+
+# -----------------------------------------------------------------------------
+def bench_sightings(count=200000, batch=1000):
+    """Ingest and time range query speed of the sightings table versus a SightingLog
+
+    :param count: Number of sightings to add
+    :param batch: Number of sightings per add_sightings() call
+    :returns: dict with sightings per second for each store
+    """
+
+    sightings = make_sightings(count)
+    batches = [sightings[i:i + batch] for i in range(0, count, batch)]
+    # The last minute of sightings
+    start, end = sightings[-6000][1], sightings[-1][1]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        stores = (
+            ("sqlite", DeviceDatabase(Path(folder) / "sightings.sqlite")),
+            ("log", DeviceDatabase(Path(folder) / "devices.sqlite", sighting_store=SightingLog(Path(folder) / "log"))),
+        )
+        for name, db in stores:
+            elapsed, _ret = timed(lambda: [db.add_sightings(b) for b in batches])
+            query_time, rows = timed(db.get_sightings, start=start, end=end)
+            db.close()
+            results[name] = count / elapsed
+            results[f"{name} query"] = len(rows) / query_time
+
+    print_header(f"Sighting ingest, {count} sightings in batches of {batch}")
+    for name, rate in results.items():
+        print(f"{name:12} {rate:12.0f} sightings/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_rssi_history(count=200000, devices=100):
+    """Storage per sample and range query speed of compressed RSSI blocks versus the sightings table
+
+    :param count: Number of samples to store
+    :param devices: Number of devices the samples are spread over
+    :returns: dict with bytes per sample and query times
+    """
+
+    sightings = make_sightings(count, devices=devices)
+    per_device = {}
+    for addr, timestamp, rssi, _adapter in sightings:
+        timestamps, rssis = per_device.setdefault(addr, ([], []))
+        timestamps.append(timestamp)
+        rssis.append(rssi)
+    addr = sightings[0][0]
+    start, end = sightings[-6000][1], sightings[-1][1]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        db = DeviceDatabase(Path(folder) / "sightings.sqlite")
+        empty_size = db.dbasefile.stat().st_size
+        db.add_sightings(sightings)
+        results["sightings bytes/sample"] = (db.dbasefile.stat().st_size - empty_size) / count
+        results["sightings query s"], _rows = timed(db.get_sightings, addr, start, end)
+        db.close()
+
+        db = DeviceDatabase(Path(folder) / "rssi.sqlite")
+        for device, (timestamps, rssis) in per_device.items():
+            db.add_rssi_history(device, timestamps, rssis)
+        results["rssi_blocks bytes/sample"] = (db.dbasefile.stat().st_size - empty_size) / count
+        results["rssi_blocks query s"], _rows = timed(db.get_rssi_history, addr, start, end)
+        if rssi_codec.np is not None:
+            results["rssi_blocks numpy query s"], _rows = timed(db.get_rssi_history, addr, start, end, as_arrays=True)
+        db.close()
+
+    print_header(f"RSSI history, {count} samples of {devices} devices")
+    for name, value in results.items():
+        print(f"{name:28} {value:10.6f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def run_backend_workload(backend, addresses) -> dict:
+    """Run the same workload against a device storage backend
+
+    :param backend: a DeviceBackend
+    :param addresses: list of BT addresses to use
+    :returns: dict with the elapsed seconds per phase
+    """
+
+    times = {}
+    times["add"], _ret = timed(lambda: [backend.add(addr, "bench", f"Device {addr}\n\tRSSI: -60") for addr in addresses])
+    times["upsert"], _ret = timed(lambda: [backend.upsert(addr, "bench", f"Device {addr}\n\tRSSI: -70") for addr in addresses])
+    times["search"], _ret = timed(lambda: [backend.search(f"{addr[:15]}*") for addr in addresses[::100]])
+    times["iterate"], _ret = timed(lambda: sum(1 for _entry in backend.iterate()))
+    times["delete"], _ret = timed(lambda: [backend.delete(addr) for addr in addresses[::2]])
+    return times
+
+
+# -----------------------------------------------------------------------------
+def bench_backends(count=2000, kinds=None):
+    """Run the same workload against each device storage backend
+
+    :param count: Number of devices
+    :param kinds: Names of the backends to run, default all
+    :returns: dict with per backend a dict of operations per second per phase
+    """
+
+    addresses = make_addresses(count)
+    ops = {"add": count, "upsert": count, "search": len(addresses[::100]), "iterate": count, "delete": len(addresses[::2])}
+    results = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        for kind in kinds or backends:
+            backend = open_backend(kind, Path(folder) / f"devices_{kind}")
+            times = run_backend_workload(backend, addresses)
+            backend.close()
+            results[kind] = {phase: ops[phase] / elapsed for phase, elapsed in times.items()}
+
+    print_header(f"Device storage backends, {count} devices, operations/s")
+    print(f"{'':8}" + "".join(f"{phase:>12}" for phase in ops))
+    for kind, rates in results.items():
+        print(f"{kind:8}" + "".join(f"{rates[phase]:12.0f}" for phase in ops))
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_info_session(rounds=20, program="bluetoothctl"):
+    """Per-device info latency: one bluetoothctl process per call versus a BluetoothctlSession
+
+    :param rounds: Number of info calls per method
+    :param program: The bluetoothctl command line
+    :returns: dict with the mean latency in ms per method, or None if bluetoothctl is not available
+    """
+
+    if not shutil.which(split(program)[0]):
+        print(f"Skipping the info latency benchmark: {program} was not found")
+        return None
+
+    addresses = py_bluetoothctl_scan.get_mac_addresses(run_command(f"{program} devices")) or ["00:00:00:00:00:00"]
+    addresses = (addresses * rounds)[:rounds]
+    results = {}
+
+    results["process"], _ret = timed(lambda: [run_command(f"{program} info {addr}") for addr in addresses])
+    with BluetoothctlSession(program) as session:
+        results["session"], _ret = timed(lambda: [session.info(addr) for addr in addresses])
+
+    results = {method: 1000 * elapsed / rounds for method, elapsed in results.items()}
+    print_header(f"bluetoothctl info latency, {rounds} calls")
+    for method, latency in results.items():
+        print(f"{method:8} {latency:8.2f} ms")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_special_data(count=5000):
+    """Throughput of the ManufacturerData/ServiceData hex dump decoder
+
+    :param count: Number of info blocks to decode
+    :returns: dict with info blocks per second, as bytes and as list of ints
+    """
+
+    blocks = [py_bluetoothctl_scan.test_info_manufdata, py_bluetoothctl_scan.test_info_servicedata] * (count // 2)
+    results = {}
+
+    def decode(func):
+        for info in blocks:
+            func(info, "ManufacturerData Key:", "ManufacturerData Value:")
+            func(info, "ServiceData Key:", "ServiceData Value:")
+
+    for func in (py_bluetoothctl_scan.get_special_bytes, py_bluetoothctl_scan.get_special_data):
+        elapsed, _ret = timed(decode, func)
+        results[func.__name__] = len(blocks) / elapsed
+
+    print_header(f"Hex dump decoding, {len(blocks)} info blocks")
+    for name, rate in results.items():
+        print(f"{name:20} {rate:10.0f} blocks/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_info_parser(count=6000):
+    """Records per second of the typed 'bluetoothctl info' parser
+
+    :param count: Number of info blocks to parse
+    :returns: dict with records per second, for parse_info() and process_device_info()
+    """
+
+    blocks = [
+        py_bluetoothctl_scan.Samsung_Q70_info,
+        py_bluetoothctl_scan.Samsung_tablet_info,
+        py_bluetoothctl_scan.test_info_servicedata,
+    ] * (count // 3)
+    results = {}
+
+    for func in (parse_info, py_bluetoothctl_scan.process_device_info):
+        elapsed, _ret = timed(lambda: [func(info) for info in blocks])
+        results[func.__name__] = len(blocks) / elapsed
+
+    print_header(f"Info parsing, {len(blocks)} records")
+    for name, rate in results.items():
+        print(f"{name:20} {rate:10.0f} records/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+class LegacyBTDevice:
+    """The BTDevice layout before it had slots: strings, hex string lists and the info text"""
+
+    def __init__(self, addr, name, timestamp):
+        self.dev = "Device"
+        self.addr = addr
+        self.name = name
+        self.timestamp = timestamp
+        self.rssi = 0
+        self.txpower = 0
+        self.manufacturerdata = {}
+        self.servicedata = {}
+        self.info = ""
+
+
+# -----------------------------------------------------------------------------
+def measure_memory(func) -> int:
+    """Bytes allocated, and still in use, by the return value of func"""
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ret = func()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del ret
+    return after - before
+
+
+# -----------------------------------------------------------------------------
+def bench_device_memory(counts=(10000, 100000)):
+    """Memory per device of the slotted BTDevice versus the legacy layout.
+    Every device has a name shared with other devices and 26 bytes of manufacturer data.
+
+    :param counts: Numbers of devices to create
+    :returns: dict with bytes per device for each layout and count
+    """
+
+    names = ["Hue Lamp", "Galaxy Tab", "[TV] Samsung Q70", "Tile"]
+    payload = bytes(range(26))
+    timestamp = "2024-01-01 12:00:00"
+
+    def legacy(count):
+        devices = {}
+        for i in range(count):
+            addr = int_to_addr(i)
+            # Names were parsed out of each line, so each device had its own copy
+            device = LegacyBTDevice(addr, names[i % len(names)].encode().decode(), timestamp)
+            device.manufacturerdata = {"0x0075": [f"{b:02x}" for b in payload]}
+            device.info = f"Device {addr} (public)\n\tName: {device.name}\n"
+            devices[addr] = device
+        return devices
+
+    def slotted(count):
+        devices = {}
+        for i in range(count):
+            addr = int_to_addr(i)
+            device = py_bluetoothctl_scan.BTDevice(addr, names[i % len(names)].encode().decode(), time.monotonic_ns())
+            device.manufacturerdata = {0x0075: bytes(bytearray(payload))}
+            devices[addr] = device
+        return devices
+
+    results = {}
+    print_header("BTDevice memory")
+    for count in counts:
+        for layout, func in (("legacy", legacy), ("slotted", slotted)):
+            per_device = measure_memory(lambda: func(count)) / count
+            results[f"{layout}_{count}"] = per_device
+            print(f"{layout:8} {count:7} devices {per_device:8.0f} bytes/device")
+        print(f"reduction {results[f'legacy_{count}'] / results[f'slotted_{count}']:.1f}x")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_adv_decoders(count=200000):
+    """Decodes per second of the advertisement payload decoders, dispatched by the registry
+
+    :param count: Number of payloads to decode
+    :returns: dict with decodes per second per format
+    """
+
+    payloads = {
+        "ibeacon": (adv_decoders.decode_manufacturer_data, 0x004C, bytes.fromhex("0215f7826da64fa24e988024bc5b71e0893e04d2162ec5")),
+        "microsoft_cdp": (adv_decoders.decode_manufacturer_data, 0x0006, bytes.fromhex("0129010011223344" + "ab" * 16)),
+        "eddystone_tlm": (adv_decoders.decode_service_data, adv_decoders.service_uuid(0xFEAA), bytes.fromhex("20000bb81900000000100000002a")),
+        "eddystone_url": (adv_decoders.decode_service_data, adv_decoders.service_uuid(0xFEAA), b"\x10\xee\x03goo.gl/abc"),
+        "exposure": (adv_decoders.decode_service_data, adv_decoders.service_uuid(0xFD6F), bytes(20)),
+        "unknown": (adv_decoders.decode_manufacturer_data, 0x0075, bytes(24)),
+    }
+    results = {}
+
+    print_header(f"Advertisement decoders, {count} payloads each")
+    for name, (decode, key, data) in payloads.items():
+        elapsed, _ret = timed(lambda: [decode(key, data) for _i in range(count)])
+        results[name] = count / elapsed
+        print(f"{name:14} {results[name]:12.0f} decodes/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def make_capture(filename, lines=50000, devices=500):
+    """Write a capture of a busy site: NEW and RSSI lines of many devices, the device list
+    and the info of every device, 10 ms apart
+    """
+
+    addresses = make_addresses(devices)
+    with CaptureWriter(filename) as writer:
+        for i, addr in enumerate(addresses):
+            writer.write("scan", f"\x1b[0;92m[NEW]\x1b[0m Device {addr} Hue Lamp\n", timestamp=i / 100)
+        for i in range(lines - devices):
+            addr = addresses[i % devices]
+            writer.write("scan", f"\x1b[0;93m[CHG]\x1b[0m Device {addr} RSSI: -{40 + i % 50}\n", timestamp=(devices + i) / 100)
+        timestamp = lines / 100
+        writer.write("devices", "\n".join(f"Device {addr} Hue Lamp" for addr in addresses), timestamp=timestamp)
+        for addr in addresses:
+            writer.write("info", py_bluetoothctl_scan.Samsung_Q70_info.replace("24:FC:E5:8F:AB:89", addr), timestamp=timestamp)
+
+
+def bench_replay(lines=50000, devices=500):
+    """Replay a capture as fast as possible through the parse pipeline:
+    scan lines into the device registry, the device list, and the info parser
+
+    :param lines: Number of scan lines in the capture
+    :param devices: Number of devices
+    :returns: dict with records per second and capture bytes per record
+    """
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filename = Path(folder) / "site.cap.gz"
+        make_capture(filename, lines, devices)
+        records = lines + 1 + devices
+
+        def pipeline():
+            for record in replay_capture(filename, speed=0):
+                if record.source == "scan":
+                    event = py_bluetoothctl_scan.parse_scan_line(record.data)
+                    if event:
+                        py_bluetoothctl_scan.apply_scan_event(event)
+                elif record.source == "devices":
+                    py_bluetoothctl_scan.process_devices(record.data)
+                else:
+                    parse_info(record.data)
+
+        elapsed, _ret = timed(pipeline)
+        results["records/s"] = records / elapsed
+        results["bytes/record"] = filename.stat().st_size / records
+
+    print_header(f"Replay of {records} records")
+    for name, value in results.items():
+        print(f"{name:14} {value:10.1f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def smooth_per_device(state, addresses, rssis, alpha=0.3, process_noise=0.5, measurement_noise=16.0):
+    """Reference implementation of RssiSmoother.update(), with a Python loop over the values"""
+
+    for addr, rssi in zip(addresses, rssis):
+        device = state.get(addr)
+        if device is None:
+            state[addr] = [rssi, rssi, measurement_noise]
+            continue
+        device[0] += alpha * (rssi - device[0])
+        variance = device[2] + process_noise
+        gain = variance / (variance + measurement_noise)
+        device[1] += gain * (rssi - device[1])
+        device[2] = (1 - gain) * variance
+
+
+def bench_rssi_filter(devices=5000, windows=20, per_device=2):
+    """Throughput of the vectorized RSSI smoothing versus a loop per value.
+    In every scan window, each device reports on average per_device RSSI values.
+
+    :param devices: Number of devices
+    :param windows: Number of scan windows
+    :param per_device: Average number of RSSI values per device in a window
+    :returns: dict with RSSI values per second of each implementation
+    """
+
+    if rssi_filter.np is None:
+        print("numpy is not installed, skipping the rssi_filter benchmark")
+        return {}
+    np = rssi_filter.np
+
+    rng = np.random.default_rng(1)
+    addresses = make_addresses(devices)
+    window_size = devices * per_device
+    batches = []
+    for _window in range(windows):
+        picks = rng.integers(0, devices, window_size)
+        batches.append(([addresses[i] for i in picks], rng.integers(-95, -40, window_size).tolist()))
+
+    smoother = rssi_filter.RssiSmoother()
+    elapsed_np, _ret = timed(lambda: [smoother.update(addrs, rssis) for addrs, rssis in batches])
+    state = {}
+    elapsed_py, _ret = timed(lambda: [smooth_per_device(state, addrs, rssis) for addrs, rssis in batches])
+
+    # Both must give the same estimates
+    slot = smoother.slots[addresses[0]]
+    assert abs(smoother.kalman[slot] - state[addresses[0]][1]) < 1e-6
+
+    results = {
+        "numpy": windows * window_size / elapsed_np,
+        "python loop": windows * window_size / elapsed_py,
+    }
+    print_header(f"RSSI smoothing, {devices} devices, {windows} windows of {window_size} values")
+    for name, rate in results.items():
+        print(f"{name:12} {rate:12.0f} values/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+class NaivePresence:
+    """Reference presence detection, which checks every device on every tick"""
+
+    def __init__(self, depart_after=30.0):
+        self.depart_after = depart_after
+        self.last_seen = {}
+
+    def sighting(self, addr, now):
+        self.last_seen[addr] = now
+
+    def tick(self, now):
+        departed = [addr for addr, seen in self.last_seen.items() if now - seen >= self.depart_after]
+        for addr in departed:
+            del self.last_seen[addr]
+        return departed
+
+
+def bench_presence(devices=50000, seconds=120, depart_after=30.0):
+    """Sightings and ticks of the timing wheel PresenceTracker versus checking every device per tick.
+    Every second, a tenth of the devices is seen, and after a minute half of the devices leave.
+
+    :param devices: Number of tracked devices
+    :param seconds: Simulated duration, one tick per second
+    :returns: dict with the total time and the time per tick of each implementation
+    """
+
+    addresses = make_addresses(devices)
+    schedule = []
+    for second in range(seconds):
+        present = addresses if second < 60 else addresses[: devices // 2]
+        schedule.append(present[second % 10::10])
+
+    results = {}
+    for name, tracker in (("timing wheel", PresenceTracker(depart_after, 1, clock=lambda: 0.0)),
+                          ("naive", NaivePresence(depart_after))):
+        sighting = tracker.sighting
+        tick_time = 0.0
+        start = time.perf_counter()
+        for second, seen in enumerate(schedule):
+            now = float(second)
+            for addr in seen:
+                sighting(addr, now)
+            tick_start = time.perf_counter()
+            tracker.tick(now)
+            tick_time += time.perf_counter() - tick_start
+        results[f"{name} total s"] = time.perf_counter() - start
+        results[f"{name} ms/tick"] = tick_time / seconds * 1000
+
+    print_header(f"Presence, {devices} devices, {seconds} ticks")
+    for name, value in results.items():
+        print(f"{name:22} {value:10.3f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+class FixedScheduler(DutyCycleScheduler):
+    """Fixed scan windows and idle gaps, like 'bluetoothctl --timeout 30 scan on' in a loop"""
+
+    def __init__(self, window, idle, transports=("le", "bredr")):
+        super().__init__(transports=transports, start_window=window, min_window=window, max_window=window,
+                         min_idle=idle, max_idle=idle)
+
+    def idle_gap(self) -> float:
+        if self.turn % len(self.transports):
+            return 0.0
+        self.idle_time += self.min_idle
+        return self.min_idle
+
+
+def simulate_scan(scheduler, duration=6 * 3600, seed=5):
+    """Simulate a site where devices arrive in bursts, and stay for two minutes.
+    A device is found by the first scan window of its transport while it is present.
+
+    :returns: tuple of (duty cycle, fraction of the devices found, mean seconds until found)
+    """
+
+    rng = random.Random(seed)
+    arrivals = []  # (arrival second, transport)
+    for hour in range(duration // 3600):
+        # A busy quarter per hour, otherwise a device every few minutes
+        for second in range(hour * 3600, (hour + 1) * 3600):
+            rate = 0.2 if second % 3600 < 900 else 0.005
+            if rng.random() < rate:
+                arrivals.append((second, rng.choice(("le", "le", "le", "bredr"))))
+    stay = 120
+
+    found = {}
+    now = 0.0
+    while now < duration:
+        transport, window = scheduler.next_window()
+        new_devices = 0
+        for i, (arrival, device_transport) in enumerate(arrivals):
+            if i in found or device_transport != transport:
+                continue
+            if arrival < now + window and arrival + stay > now:
+                found[i] = max(arrival, now) - arrival
+                new_devices += 1
+        scheduler.report(transport, window, new_devices)
+        now += window + scheduler.idle_gap()
+
+    latencies = list(found.values())
+    return scheduler.duty_cycle(), len(found) / len(arrivals), sum(latencies) / len(latencies)
+
+
+def bench_scan_scheduler():
+    """Duty cycle, coverage and discovery latency of fixed versus adaptive scan scheduling, simulated
+
+    :returns: dict with (duty cycle, fraction found, mean latency) per scheduler
+    """
+
+    schedulers = {
+        "continuous": FixedScheduler(30, 0),
+        "fixed, 30s gap": FixedScheduler(30, 30),
+        "adaptive": DutyCycleScheduler(),
+    }
+    results = {name: simulate_scan(scheduler) for name, scheduler in schedulers.items()}
+
+    print_header("Scan scheduling, simulated 6 hours")
+    print(f"{'':14} {'duty':>6} {'found':>6} {'latency s':>10}")
+    for name, (duty, found, latency) in results.items():
+        print(f"{name:14} {duty:6.0%} {found:6.0%} {latency:10.1f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_multi_adapter(duration=10, program="bluetoothctl"):
+    """Coverage and event rate of scanning with the first 1, 2, .. n adapters at the same time
+
+    :param duration: Number of seconds to scan per number of adapters
+    :param program: The bluetoothctl command line
+    :returns: dict with (devices seen, events per second) per number of adapters,
+              or None if bluetoothctl is not available
+    """
+
+    if not shutil.which(split(program)[0]):
+        print(f"Skipping the multi adapter benchmark: {program} was not found")
+        return None
+
+    controllers = list_controllers(program)
+    results = {}
+    for count in range(1, len(controllers) + 1):
+        scanner = MultiAdapterScanner(controllers[:count], program, parse=py_bluetoothctl_scan.parse_scan_line)
+        elapsed, events = timed(lambda: sum(1 for _event in scanner.scan(duration)))
+        results[count] = scanner.coverage(), events / elapsed
+
+    print_header(f"Multi adapter scanning, {duration}s per run")
+    print(f"{'adapters':>8} {'devices':>8} {'events/s':>9}")
+    for count, (devices, rate) in results.items():
+        print(f"{count:8} {devices:8} {rate:9.1f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+class RoundRobinRefresh:
+    """Reference info refresh, which queries the devices in turn"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.queue = deque()
+
+    def add(self, addr, rssi=None, now=None):
+        self.queue.append(addr)
+
+    def next_batch(self):
+        return [self.queue.popleft() for _i in range(min(self.budget, len(self.queue)))]
+
+    def done(self, addr, info, now=None):
+        self.queue.append(addr)
+
+
+def simulate_refresh(scheduler, devices=2000, cycles=500, cycle_time=10.0, seed=5):
+    """Simulate a site where the info of 10% of the devices changes often, and of the others rarely.
+    Nearby devices change more often than far ones.
+
+    :returns: tuple of (fraction of the changes found, mean delay in seconds until a change was found)
+    """
+
+    rng = random.Random(seed)
+    addresses = make_addresses(devices)
+    rssis = [rng.randint(-100, -40) for _addr in addresses]
+    rates = [(0.3 if i % 10 == 0 else 0.002) * (2 if rssi > -70 else 1) for i, rssi in enumerate(rssis)]
+    versions = [0] * devices  # current info version of each device
+    known = [0] * devices  # version of the latest query
+    changed_at = [None] * devices  # time of the oldest change which was not found yet
+    index = {addr: i for i, addr in enumerate(addresses)}
+
+    for addr, rssi in zip(addresses, rssis):
+        scheduler.add(addr, rssi, now=0.0)
+
+    found, delays = 0, []
+    for cycle in range(cycles):
+        now = cycle * cycle_time
+        for i in range(devices):
+            if rng.random() < rates[i]:
+                versions[i] += 1
+                if changed_at[i] is None:
+                    changed_at[i] = now
+        for addr in scheduler.next_batch():
+            i = index[addr]
+            if versions[i] != known[i]:
+                found += versions[i] - known[i]
+                delays.append(now - changed_at[i])
+                known[i] = versions[i]
+                changed_at[i] = None
+            scheduler.done(addr, f"Device {addr} (public)\n\tversion {versions[i]}", now=now)
+    missed = sum(versions) - sum(known)
+    return found / (found + missed), sum(delays) / len(delays)
+
+
+def bench_info_refresh(budget=100):
+    """Changes found with a fixed info query budget: round robin versus the priority heap scheduler, simulated
+
+    :param budget: Number of info queries per cycle
+    :returns: dict with (fraction found, mean delay) per scheduler
+    """
+
+    results = {
+        "round robin": simulate_refresh(RoundRobinRefresh(budget)),
+        "priority heap": simulate_refresh(RefreshScheduler(budget, base_interval=30.0, clock=lambda: 0.0)),
+    }
+
+    print_header(f"Info refresh, 2000 devices, {budget} queries per cycle")
+    print(f"{'':14} {'found':>6} {'delay s':>8}")
+    for name, (found, delay) in results.items():
+        print(f"{name:14} {found:6.0%} {delay:8.1f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def legacy_device_list(data, log=True) -> list:
+    """Reference 'bluetoothctl devices' parser, with splitlines(), split() and debug() per line
+
+    :param log: False to leave out the debug() call, to see the cost of the parsing alone
+    """
+
+    devices = []
+    for line in data.splitlines():
+        if not line:
+            continue
+        if log:
+            debug(f"line = '{line}'")
+        _dev, addr, value = line.split(" ", maxsplit=2)
+        devices.append((addr, value))
+    return devices
+
+
+def bench_device_list(lines=100_000):
+    """Parse a synthetic 'bluetoothctl devices' output: per line versus one regex over the whole buffer
+
+    :param lines: Number of device lines
+    :returns: dict with lines per second per parser
+    """
+
+    names = ["Hue Lamp", "[TV] Samsung Q70 Series (49)", "Galaxy Buds"]
+    data = "".join(f"Device {addr} {names[i % 3] if i % 4 else addr.replace(':', '-')}\n"
+                   for i, addr in enumerate(make_addresses(lines)))
+
+    results = {}
+    parsed = {}
+    parsers = {
+        "per line": legacy_device_list,
+        "no debug": lambda data: legacy_device_list(data, log=False),
+        "whole buffer": py_bluetoothctl_scan.parse_device_list,
+    }
+    for name, parse in parsers.items():
+        elapsed, parsed[name] = timed(parse, data)
+        results[name] = lines / elapsed
+    assert parsed["per line"] == parsed["no debug"] == parsed["whole buffer"]
+
+    print_header(f"Device list parsing, {lines} lines")
+    for name, rate in results.items():
+        print(f"{name:14} {rate:12,.0f} lines/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def random_private_address(rng) -> str:
+    """A resolvable private address: the two most significant bits are 01, and the locally administered bit is set"""
+
+    first = 0x40 | (rng.randrange(0x40) | 0x02)
+    return ":".join(f"{byte:02X}" for byte in [first] + [rng.randrange(256) for _i in range(5)])
+
+
+def simulate_rotations(devices=100, hours=3, step=2.0, rotate_every=900.0, seed=9):
+    """Simulate devices which rotate their address every rotate_every seconds, and are seen
+    in 70% of the steps. A third of them has no name, only a noisy RSSI.
+
+    :returns: tuple of (number of addresses, number of logical devices,
+              fraction of the links which joined addresses of the same device, sightings per second)
+    """
+
+    rng = random.Random(seed)
+    clusters = AddressClusters(max_gap=5 * step, settle_time=5 * step, expire_after=4 * rotate_every)
+    names = ["Galaxy Watch", "Tile", "Pixel Buds", ""]
+    states = []  # [current address, next rotation time, name, mean rssi]
+    for i in range(devices):
+        states.append([random_private_address(rng), rng.uniform(0, rotate_every), names[i % 3] if i % 3 else "",
+                       rng.uniform(-95, -45)])
+
+    owners = {}  # key is an address, value is the index of the physical device
+    logical = set()
+    links = correct = 0
+    sightings = 0
+    start = time.perf_counter()
+    for tick in range(int(hours * 3600 / step)):
+        now = tick * step
+        for i, state in enumerate(states):
+            if now >= state[1]:
+                state[0] = random_private_address(rng)
+                state[1] = now + rotate_every * rng.uniform(0.8, 1.2)
+            if rng.random() > 0.7:
+                continue
+            owners[state[0]] = i
+            logical.add(clusters.resolve(state[0], now=now, name=state[2], rssi=round(state[3] + rng.gauss(0, 3))))
+            for provisional, cid in clusters.pop_merged():
+                logical.discard(provisional)
+                previous = clusters.clusters[cid].addresses[-2]
+                links += 1
+                correct += owners[previous] == owners[provisional]
+            sightings += 1
+    elapsed = time.perf_counter() - start
+
+    return len(owners), len(logical), correct / links, sightings / elapsed
+
+
+def bench_address_clusters():
+    """Registry growth with and without clustering of rotating addresses, simulated
+
+    :returns: dict with the simulate_rotations() results
+    """
+
+    addresses, logical, correct, rate = simulate_rotations()
+    results = {"addresses": addresses, "logical devices": logical, "correct links": correct, "sightings/s": rate}
+
+    print_header("Rotating addresses, 100 devices, 3 hours simulated")
+    for name, value in results.items():
+        print(f"{name:16} {value:12,.2f}")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def bench_event_bus(events=5000, slow_ms=0.5):
+    """Pace of the scan loop with a slow subscriber: all subscribers called in turn versus the EventBus
+
+    :param events: Number of published events
+    :param slow_ms: Time per event of the slow subscriber, in ms
+    :returns: dict with the events per second of the scan loop, and the stats() of the subscribers
+    """
+
+    counts = {}
+
+    def count(event):
+        counts[event % 10] = counts.get(event % 10, 0) + 1
+
+    def slow(_event):
+        time.sleep(slow_ms / 1000)
+
+    results = {}
+    elapsed, _ret = timed(lambda: [(count(event), slow(event)) for event in range(events)])
+    results["in turn"] = events / elapsed
+
+    bus = EventBus()
+    bus.subscribe(count, "metrics", maxsize=events)
+    bus.subscribe(slow, "slow sink", maxsize=1000, policy="drop_oldest")
+    elapsed, _ret = timed(lambda: [bus.publish(event) for event in range(events)])
+    results["event bus"] = events / elapsed
+    bus.close()
+    results["subscribers"] = bus.stats()
+
+    print_header(f"Scan loop pace, {events} events, a subscriber of {slow_ms} ms per event")
+    print(f"in turn   {results['in turn']:12,.0f} events/s")
+    print(f"event bus {results['event bus']:12,.0f} events/s")
+    for stats in results["subscribers"]:
+        print(f"  {stats['name']:10} delivered {stats['delivered']:6} dropped {stats['dropped']:6} "
+              f"max queued {stats['max_queued']:6} max latency {stats['max_latency_ms']:8.1f} ms")
+    return results
+
+
+def bench_sighting_buffer(count=1_000_000, devices=500, seconds=300.0):
+    """Recent sightings as a list of tuples versus the chunked NumPy SightingBuffer
+
+    :param count: Number of sightings, one per 10 ms
+    :param devices: Number of devices
+    :param seconds: Window of the per-device statistics
+    :returns: dict with the memory in MB, the appends per second, and the window query time in ms
+    """
+
+    if sighting_buffer.np is None:
+        print("numpy is not installed, skipped")
+        return {}
+    np = sighting_buffer.np
+
+    addresses = [int_to_addr(0xC00000000000 + device) for device in range(devices)]
+    addr_ids = np.arange(count, dtype=np.uint32) % devices
+    timestamps = 1.7e9 + np.arange(count) * 0.01
+    rssis = (addr_ids % 70).astype(np.int16) - 100
+    sightings = list(zip([addresses[addr_id] for addr_id in addr_ids.tolist()], timestamps.tolist(), rssis.tolist(),
+                         [0] * count))
+    now = sightings[-1][1]
+    results = {}
+
+    def tuple_list():
+        store = []
+        for sighting in sightings:
+            store.append(sighting)
+        return store
+
+    tracemalloc.start()
+    elapsed, store = timed(tuple_list)
+    # The tuples and floats are shared with the input, count them as if the store made them
+    results["list memory MB"] = (tracemalloc.get_traced_memory()[0]
+                                 + sum(sys.getsizeof(s) + sys.getsizeof(s[1]) for s in store)) / 1e6
+    tracemalloc.stop()
+    results["list appends/s"] = count / elapsed
+
+    def python_group_by():
+        stats = {}
+        for addr, timestamp, rssi, _adapter in reversed(store):
+            if timestamp < now - seconds:
+                break
+            entry = stats.setdefault(addr, [0, 0, rssi, rssi])
+            entry[0] += 1
+            entry[1] += rssi
+            entry[2] = min(entry[2], rssi)
+            entry[3] = max(entry[3], rssi)
+        return stats
+
+    elapsed, _ret = timed(python_group_by)
+    results["list window ms"] = 1000 * elapsed
+    del store
+
+    buffer = sighting_buffer.SightingBuffer(retention=2 * count * 0.01)
+    elapsed, _ret = timed(lambda: buffer.add_sightings(sightings))
+    results["buffer add_sightings/s"] = count / elapsed
+
+    buffer = sighting_buffer.SightingBuffer(retention=2 * count * 0.01)
+    for addr in addresses:
+        buffer.addr_id(addr)
+    batch = 10_000
+    elapsed, _ret = timed(lambda: [buffer.append(addr_ids[first:first + batch], timestamps[first:first + batch],
+                                                 rssis[first:first + batch])
+                                   for first in range(0, count, batch)])
+    results["buffer append/s"] = count / elapsed
+    results["buffer memory MB"] = buffer.nbytes() / 1e6
+
+    elapsed, _ret = timed(lambda: buffer.group_by(seconds, now))
+    results["buffer window ms"] = 1000 * elapsed
+
+    print_header(f"{count:,} sightings of {devices} devices, statistics of the last {seconds:.0f} s")
+    print(f"list of tuples  {results['list memory MB']:8.1f} MB {results['list appends/s']:14,.0f} appends/s "
+          f"window {results['list window ms']:8.2f} ms")
+    print(f"SightingBuffer  {results['buffer memory MB']:8.1f} MB {results['buffer append/s']:14,.0f} appends/s "
+          f"window {results['buffer window ms']:8.2f} ms")
+    print(f"  add_sightings() of tuples {results['buffer add_sightings/s']:14,.0f} appends/s")
+    return results
+
+
+def bench_ndjson(events=100_000):
+    """NDJSON scan events through a pipe: json.dumps() and print() with a flush per event
+    versus the batched NdjsonWriter
+
+    :param events: Number of scan event records
+    :returns: dict with the events per second of each way
+    """
+
+    records = [{"type": "scan", "time": 1.7e9 + i * 0.001, "adapter": 0, "kind": "CHG",
+                "addr": int_to_addr(0xC00000000000 + i % 500), "device": int_to_addr(0xC00000000000 + i % 500),
+                "key": "RSSI", "value": -40 - i % 60, "change": "changed", "fields": {"rssi": -40 - i % 60}}
+               for i in range(events)]
+
+    def through_pipe(write_all):
+        """Run write_all(text stream) with a thread reading the other end of a pipe"""
+        read_fd, write_fd = os.pipe()
+        lines = [0]
+
+        def drain():
+            with os.fdopen(read_fd, "rb") as reader:
+                for chunk in iter(lambda: reader.read(1 << 16), b""):
+                    lines[0] += chunk.count(b"\n")
+
+        reader = threading.Thread(target=drain)
+        reader.start()
+        with os.fdopen(write_fd, "w") as stream:
+            elapsed, _ret = timed(write_all, stream)
+        reader.join()
+        assert lines[0] == events
+        return events / elapsed
+
+    def print_each(stream):
+        for record in records:
+            print(json.dumps(record), file=stream, flush=True)
+
+    def ndjson_writer(stream):
+        with NdjsonWriter(stream) as writer:
+            for record in records:
+                writer.write(record)
+
+    results = {"print per event": through_pipe(print_each), "NdjsonWriter": through_pipe(ndjson_writer)}
+
+    print_header(f"{events:,} NDJSON scan events through a pipe, encoder {ENCODER}")
+    for name, rate in results.items():
+        print(f"{name:16} {rate:12,.0f} events/s")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def run_info() -> dict:
+    """The version and platform of a benchmark run, for the --json file"""
+
+    commit = run_command(f"git -C {Path(__file__).parent} rev-parse --short HEAD") if sys.platform == "linux" else ""
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit if re.fullmatch(r"[0-9a-f]{4,40}", commit) else None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+# -----------------------------------------------------------------------------
+benchmarks = {
+    "ram_tier": bench_ram_tier,
+    "sightings": bench_sightings,
+    "rssi_history": bench_rssi_history,
+    "backends": bench_backends,
+    "info_session": bench_info_session,
+    "special_data": bench_special_data,
+    "info_parser": bench_info_parser,
+    "device_memory": bench_device_memory,
+    "adv_decoders": bench_adv_decoders,
+    "replay": bench_replay,
+    "rssi_filter": bench_rssi_filter,
+    "presence": bench_presence,
+    "scan_scheduler": bench_scan_scheduler,
+    "multi_adapter": bench_multi_adapter,
+    "info_refresh": bench_info_refresh,
+    "device_list": bench_device_list,
+    "address_clusters": bench_address_clusters,
+    "event_bus": bench_event_bus,
+    "sighting_buffer": bench_sighting_buffer,
+    "ndjson": bench_ndjson,
+    "parsers": bench_parsers,
+}
+
+
+# =============================================================================
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Run the performance benchmarks")
+    parser.add_argument("names", nargs="*", metavar="NAME", help=f"benchmarks to run, default all: {', '.join(benchmarks)}")
+    parser.add_argument("--json", metavar="FILE", help="write the results of the benchmarks to a JSON file")
+    parser.add_argument("--compare", metavar="FILE", help="compare the parsers results with those in an earlier JSON file")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in benchmarks]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    results = {}
+    for name in args.names or benchmarks:
+        results[name] = benchmarks[name]()
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump({"run": run_info(), "results": jsonable(results)}, fh, indent=1)
+    if args.compare and "parsers" in results:
+        with open(args.compare) as fh:
+            old = json.load(fh)["results"].get("parsers", {})
+        print_comparison(compare_parsers(old, results["parsers"]))
+
+
+# =============================================================================
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+##
+# @file: bluetoothctl_session.py
+# @brief: Long-lived interactive bluetoothctl session
+
+"""Long-lived interactive bluetoothctl session
+
+Running 'bluetoothctl info {addr}' for every device forks a new process, which then
+has to set up its D-Bus connection again. A BluetoothctlSession starts bluetoothctl
+once, drives it over a pseudo terminal and frames each response on the prompt.
+"""
+
+# global imports
+import os
+import pty
+import re
+import select
+import time
+from collections import deque
+from shlex import split
+from subprocess import Popen
+
+# local imports
+from lib.helper import debug
+
+# Terminal colors and readline markers around them
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|[\x01\x02\r]")
+# The bluetoothctl prompt, like '[bluetooth]# ' or '[Hue Lamp]# '
+PROMPT_RE = re.compile(r"^(?:\[[^\]]*\]# ?)+")
+# A prompt at the end of the received output, waiting for the next command
+WAITING_PROMPT_RE = re.compile(r"(?:^|\n)\[[^\]]*\]# ?$")
+# Asynchronous events, printed in between the command responses
+EVENT_RE = re.compile(r"^\[(NEW|CHG|DEL)\] ")
+
+
+# -----------------------------------------------------------------------------
+def strip_terminal_output(text) -> str:
+    r"""Remove colors, readline markers and carriage returns
+
+    >>> strip_terminal_output("\x01\x1b[0;94m\x02[bluetooth]\x01\x1b[0m\x02# devices\r\n")
+    '[bluetooth]# devices\n'
+    """
+    return ANSI_ESCAPE_RE.sub("", text)
+
+
+# -----------------------------------------------------------------------------
+class BluetoothctlSession:
+    """Interactive bluetoothctl session over a pseudo terminal.
+
+    Use it as a context manager:
+
+        with BluetoothctlSession() as session:
+            print(session.devices())
+            print(session.info("24:FC:E5:8F:AB:89"))
+    """
+
+    def __init__(self, program="bluetoothctl", timeout=5.0, max_events=10000):
+        """Start bluetoothctl and wait for its first prompt
+
+        :param program: The bluetoothctl command line
+        :param timeout: Default number of seconds to wait for a response
+        :param max_events: Maximum number of asynchronous event lines to keep
+        """
+
+        self.timeout = timeout
+        self.buffer = ""
+        # Asynchronous [NEW]/[CHG]/[DEL] lines, received while waiting for a response
+        self.events = deque(maxlen=max_events)
+
+        cmdlist = split(program) if isinstance(program, str) else program
+        master, slave = pty.openpty()
+        self.process = Popen(cmdlist, stdin=slave, stdout=slave, stderr=slave, close_fds=True)
+        os.close(slave)
+        self.fd = master
+
+        # False if bluetoothctl did not prompt within the timeout
+        self.ready = self._read_until_prompt(time.monotonic() + timeout)
+        self.buffer = ""
+        debug(f"Started bluetoothctl session, pid {self.process.pid}")
+
+    # -------------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # -------------------------------------------------------------------------
+    def _read(self, deadline) -> bool:
+        """Read the available output into the buffer
+
+        :param deadline: time.monotonic() value to give up waiting
+        :returns: False if there was no output before the deadline or bluetoothctl has stopped
+        """
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        ready, _w, _x = select.select([self.fd], [], [], remaining)
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            # EIO: the other side of the pseudo terminal has been closed
+            return False
+        if not data:
+            return False
+        self.buffer += strip_terminal_output(data.decode("utf8", errors="replace"))
+        return True
+
+    # -------------------------------------------------------------------------
+    def _read_until_prompt(self, deadline, start=0) -> bool:
+        """Read until the buffer, from position start, ends with a waiting prompt
+
+        :returns: True if the prompt was found, False in case of a timeout
+        """
+
+        while not WAITING_PROMPT_RE.search(self.buffer, start):
+            if not self._read(deadline):
+                return False
+        return True
+
+    # -------------------------------------------------------------------------
+    def command(self, cmd, timeout=None, expect=None) -> str:
+        """Send a command and return its response
+
+        The response ends at the first prompt after the echo of the command. If expect is
+        given, reading continues until that regular expression is found in the response.
+        Asynchronous event lines are moved to self.events.
+
+        :param cmd: The command, like 'info 24:FC:E5:8F:AB:89'
+        :param timeout: Number of seconds to wait for the response, default self.timeout
+        :param expect: Optional regular expression which has to appear in the response
+        :returns: The response lines, or what was received of them in case of a timeout
+        """
+
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+
+        # Keep events which arrived since the previous command
+        self._split_response(self.buffer)
+        self.buffer = ""
+        os.write(self.fd, f"{cmd}\n".encode("utf8"))
+
+        # Wait for the echo of the command, then for the next prompt
+        echo = None
+        while True:
+            if echo is None:
+                echo = self.buffer.find(f"{cmd}\n")
+                if echo < 0:
+                    echo = None
+            # Search from the newline of the echo, the prompt may follow it directly
+            if echo is not None and self._read_until_prompt(deadline, echo + len(cmd)):
+                if expect is None or re.search(expect, self._split_response(self.buffer[echo + len(cmd) + 1:], False), re.MULTILINE):
+                    break
+            if not self._read(deadline):
+                debug(f"Timeout on bluetoothctl command '{cmd}'")
+                break
+
+        response = self._split_response(self.buffer[echo + len(cmd) + 1:] if echo is not None else "")
+        self.buffer = ""
+        return response
+
+    # -------------------------------------------------------------------------
+    def _split_response(self, text, keep_events=True) -> str:
+        """Remove prompts from the text, move event lines to self.events and return the other lines"""
+
+        lines = []
+        for line in text.split("\n"):
+            line = PROMPT_RE.sub("", line)
+            if not line.strip():
+                continue
+            if EVENT_RE.match(line):
+                if keep_events:
+                    self.events.append(line)
+            else:
+                lines.append(line)
+        return "\n".join(lines)
+
+    # -------------------------------------------------------------------------
+    def pop_events(self) -> list:
+        """Return and forget the asynchronous event lines received so far"""
+
+        # Only complete lines, the last one may still be arriving
+        complete, _sep, self.buffer = self.buffer.rpartition("\n")
+        self._split_response(complete)
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    # -------------------------------------------------------------------------
+    def read_events(self, duration):
+        """Yield asynchronous event lines as they arrive, for duration seconds
+
+        :param duration: Number of seconds to read
+        """
+
+        deadline = time.monotonic() + duration
+        while True:
+            yield from self.pop_events()
+            if not self._read(deadline):
+                break
+        yield from self.pop_events()
+
+    # -------------------------------------------------------------------------
+    def info(self, addr, timeout=None) -> str:
+        """Same output as 'bluetoothctl info {addr}'"""
+
+        return self.command(f"info {addr}", timeout, expect=rf"^Device {addr}")
+
+    def devices(self, timeout=None) -> str:
+        """Same output as 'bluetoothctl devices'"""
+
+        return self.command("devices", timeout)
+
+    def scan(self, mode="on", timeout=None) -> str:
+        """Start or stop scanning
+
+        :param mode: "on", "off", "le" or "bredr"
+        """
+
+        return self.command(f"scan {mode}", timeout)
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """Quit bluetoothctl"""
+
+        if self.process.poll() is None:
+            try:
+                os.write(self.fd, b"quit\n")
+                self.process.wait(timeout=self.timeout)
+            except Exception as ex:
+                debug(f"Killing bluetoothctl session: {ex}")
+                self.process.kill()
+                self.process.wait()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
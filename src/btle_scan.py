@@ -6,10 +6,13 @@
 """
 
 # global imports
+import argparse
+import contextlib
 import sys
 
 # local imports
 from command import run_command
+from ndjson_output import NdjsonWriter
 
 
 # -----------------------------------------------------------------------------
@@ -73,8 +76,40 @@ def print_btle_scan_results(resolved, unknown):
         print(key, value)
 
 
+# -----------------------------------------------------------------------------
+def write_btle_scan_results(resolved, unknown, writer):
+    """Write the bt address dictionaries as NDJSON device records, with name null if unknown
+    :param resolved: dictionary with resolved names
+    :param unknown: dictionary with unknown names
+    :param writer: NdjsonWriter
+    """
+
+    for key, value in resolved.items():
+        writer.write({"type": "device", "addr": key, "name": value})
+    for key in unknown:
+        writer.write({"type": "device", "addr": key, "name": None})
+
+
 # =============================================================================
-def main():
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Scan for BTLE devices with hcitool")
+    parser.add_argument("--format", choices=("text", "ndjson"), default="text",
+                        help="text for people, or ndjson: one JSON record per line on stdout, the text goes to stderr")
+    args = parser.parse_args(argv)
+
+    if args.format == "ndjson":
+        with NdjsonWriter() as writer, contextlib.redirect_stdout(sys.stderr):
+            scan(writer)
+    else:
+        scan()
+
+
+def scan(writer=None):
+    """Scan, or use the sample output offline, and show the devices
+
+    :param writer: Optional NdjsonWriter, to write the devices as NDJSON
+    """
 
     # Determine if we are working online (on the Raspberry Pi) or offline on Windows
     online = False
@@ -93,7 +128,10 @@ def main():
         data = sample_output
 
     bt_known, bt_unknown = process_le_scan(data)
-    print_btle_scan_results(bt_known, bt_unknown)
+    if writer is None:
+        print_btle_scan_results(bt_known, bt_unknown)
+    else:
+        write_btle_scan_results(bt_known, bt_unknown, writer)
 
 
 # =============================================================================
@@ -0,0 +1,188 @@
+##
+# @file: capture.py
+# @brief: Record and replay the output of the scan tools
+
+"""Record and replay the output of the scan tools
+
+A capture file holds the raw output of bluetoothctl (scan lines, the device list and
+the info of each device) with the time it was received, so a busy site can be replayed
+offline, and the whole parse pipeline can be benchmarked reproducibly.
+
+The file is an append-only sequence of length-prefixed records, compressed with gzip
+(.gz) or, if the zstandard package is installed, zstd (.zst). Both formats allow to
+append to an existing file. Each record is:
+
+- RECORD header: the time.time() of the record (double), length of the source name and
+  length of the data
+- the source name, like "scan", "devices" or "info", in UTF-8
+- the data, in UTF-8
+
+Each CaptureWriter starts with a SESSION record, so that a replay of a file which was
+appended to several times plays each session with its own timing, one after the other.
+Older files, with seconds since the start of the capture and without SESSION records,
+replay the same way.
+"""
+
+# global imports
+import gzip
+import struct
+import time
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# time.time() of the record, source name length, data length
+RECORD = struct.Struct("<dHI")
+
+# Source name of the record which starts a recording session
+SESSION = "session"
+
+CaptureRecord = namedtuple("CaptureRecord", "timestamp source data")
+
+
+# -----------------------------------------------------------------------------
+def open_compressed(filename, mode):
+    """Open a capture file for binary reading ("rb") or appending ("ab"), compressed by its suffix"""
+
+    filename = str(filename)
+    if filename.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("Capture files with the .zst suffix need the zstandard package")
+        fh = open(filename, mode)
+        if mode == "rb":
+            return zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True, closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(fh, closefd=True)
+    return gzip.open(filename, mode)
+
+
+# -----------------------------------------------------------------------------
+class CaptureWriter:
+    """Append records to a capture file
+
+    Use it as a context manager:
+
+        with CaptureWriter("site.cap.gz") as writer:
+            writer.write("scan", line)
+    """
+
+    def __init__(self, filename, clock=time.time):
+        """
+        :param filename: The capture file. A .zst suffix selects zstd, otherwise gzip is used.
+        :param clock: function returning the current wall clock time in seconds
+        """
+
+        self.filename = filename
+        self.clock = clock
+        self.fh = open_compressed(filename, "ab")
+        self.records = 0
+        self.write(SESSION, "")
+
+    def write(self, source, data, timestamp=None):
+        """Append a record
+
+        :param source: The source of the data, like "scan"
+        :param data: The output, str or bytes
+        :param timestamp: time.time() of the record, default now
+        """
+
+        if timestamp is None:
+            timestamp = self.clock()
+        source = source.encode("utf-8")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.fh.write(RECORD.pack(timestamp, len(source), len(data)) + source + data)
+        self.records += 1
+
+    def record_lines(self, lines, source):
+        """Record each line of an iterator, while passing it on
+
+        :param lines: iterable of output lines, like stream_command()
+        :param source: The source name of the records
+        """
+
+        for line in lines:
+            self.write(source, line)
+            yield line
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+def read_capture(filename, sessions=False):
+    """Read all records of a capture file
+
+    A record, which was cut off because the recorder was stopped, ends the capture.
+
+    :param filename: The capture file
+    :param sessions: True to include the SESSION records
+    :returns: generator of CaptureRecord
+    """
+
+    with open_compressed(filename, "rb") as fh:
+        while True:
+            try:
+                header = fh.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                timestamp, source_len, data_len = RECORD.unpack(header)
+                body = fh.read(source_len + data_len)
+                if len(body) < source_len + data_len:
+                    return
+            except EOFError:
+                # The compressed stream was cut off
+                return
+            record = CaptureRecord(timestamp, body[:source_len].decode("utf-8"), body[source_len:].decode("utf-8"))
+            if sessions or record.source != SESSION:
+                yield record
+
+
+# -----------------------------------------------------------------------------
+def replay_capture(filename, speed=1.0, sleep=time.sleep, clock=time.monotonic):
+    """Yield the records of a capture file with their original timing
+
+    Each session is timed from its first record, which follows the last record of the
+    previous session without a pause.
+
+    :param filename: The capture file
+    :param speed: 1.0 for real time, 10.0 for ten times faster, 0 for as fast as possible
+    :returns: generator of CaptureRecord, without the SESSION records
+    """
+
+    start = clock()
+    offset = None  # timestamp of the current session at replay position 0
+    position = 0.0  # seconds since the start of the replay, at the original speed
+    for record in read_capture(filename, sessions=True):
+        if record.source == SESSION:
+            offset = None
+            continue
+        if offset is None:
+            offset = record.timestamp - position
+        position = record.timestamp - offset
+        if speed:
+            delay = position / speed - (clock() - start)
+            if delay > 0:
+                sleep(delay)
+        yield record
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
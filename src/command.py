@@ -1,5 +1,8 @@
 """Run a command on the Linux server"""
 
+import codecs
+import os
+import pty
 import sys
 from shlex import split
 # global imports
@@ -7,21 +10,18 @@ from subprocess import Popen, PIPE, STDOUT
 
 
 # -----------------------------------------------------------------------------
-def run_command(cmd, sudo=False, timeout=0, verbose=False) -> str:
-    """
+def build_command(cmd, sudo=False, timeout=0) -> list:
+    """Build the argument list for a command
 
     :param cmd: The command string or list of commands to use
     :param sudo: Add 'sudo' command if this is set to True
     :param timeout: A process timeout in seconds for commands which never end, like 'hcitool -i hci0 lescan'
-    :param verbose: Show intermediate (debug) results
 
     If a timeout value is given, it will prepend the command with 'sudo timeout -s SIGINT {timeout}s '
-    """
-
-    if not sys.platform == 'linux':
-        print(f"ERROR: Command \"{cmd}\" is for Linux systems only...")
-        return ""
 
+    >>> build_command("hcitool -i hci0 lescan", timeout=5)
+    ['sudo', 'timeout', '-s', 'SIGINT', '5s', 'hcitool', '-i', 'hci0', 'lescan']
+    """
 
     if isinstance(cmd, list):
         # Convert list to string
@@ -30,39 +30,114 @@ def run_command(cmd, sudo=False, timeout=0, verbose=False) -> str:
         # This was already a string
         pass
 
-    ret = ""
+    if timeout:
+        cmd = f"sudo timeout -s SIGINT {timeout}s {cmd}"
 
-    try:
+    if sudo and "sudo" not in cmd:
+        cmd = f"sudo {cmd}"
 
-        if timeout:
-            cmd = f"sudo timeout -s SIGINT {timeout}s {cmd}"
+    return split(cmd)
 
-        if sudo and "sudo" not in cmd:
-            cmd = f"sudo {cmd}"
 
-        if verbose:
-            print(f'cmd={cmd}')
+# -----------------------------------------------------------------------------
+def stream_command(cmd, sudo=False, timeout=0, verbose=False, tty=False):
+    """Run a command and yield its output line by line, as soon as each line arrives.
 
-        cmdlist = split(cmd)
-        if verbose:
-            print(f"cmdlist={cmdlist}")
+    :param cmd: The command string or list of commands to use
+    :param sudo: Add 'sudo' command if this is set to True
+    :param timeout: A process timeout in seconds for commands which never end, like 'hcitool -i hci0 lescan'
+    :param verbose: Show intermediate (debug) results
+    :param tty: Run the command on a pseudo terminal. Programs like bluetoothctl buffer their
+                output in blocks when it goes to a pipe, so their lines only arrive in bursts.
 
-        if timeout:
-            timeout_str = f"sudo timeout -s SIGINT {timeout}s"
+    The process is terminated when the generator is closed before the end of the output.
+    """
 
-        process = Popen(cmdlist, stdout=PIPE, stderr=STDOUT, encoding="utf8")
+    if not sys.platform == 'linux':
+        print(f"ERROR: Command \"{cmd}\" is for Linux systems only...")
+        return
+
+    cmdlist = build_command(cmd, sudo, timeout)
+    if verbose:
+        print(f"cmdlist={cmdlist}")
+
+    if tty:
+        yield from _stream_tty(cmdlist, verbose)
+        return
+
+    process = Popen(cmdlist, stdout=PIPE, stderr=STDOUT, encoding="utf8", bufsize=1)
+    try:
+        for output in process.stdout:
+            if verbose:
+                print(f">>> {output.strip()}")
+            yield output
+        if verbose:
+            print("=== end of output ===")
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        process.stdout.close()
+        process.wait()
+
+
+def _stream_tty(cmdlist, verbose=False):
+    """stream_command() on a pseudo terminal, so the output of the command is line buffered"""
+
+    master, slave = pty.openpty()
+    process = Popen(cmdlist, stdin=slave, stdout=slave, stderr=slave, close_fds=True)
+    os.close(slave)
+    # A read can end in the middle of a UTF-8 character, or between the \r and \n
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    try:
         while True:
-            output = process.stdout.readline()
-            if output == "" and process.poll() is not None:
-                if verbose:
-                    print("=== end of output ===")
+            try:
+                data = os.read(master, 65536)
+            except OSError:
+                # EIO: the command has exited and closed the pseudo terminal
                 break
-            if output:
+            if not data:
+                break
+            # The terminal ends the lines with \r\n
+            lines = (pending + decoder.decode(data)).replace("\r\n", "\n").split("\n")
+            pending = lines.pop()
+            for output in lines:
                 if verbose:
                     print(f">>> {output.strip()}")
-                ret += output
-        _rc = process.poll()
-        # return _rc
+                yield output + "\n"
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending
+        if verbose:
+            print("=== end of output ===")
+    finally:
+        if process.poll() is None:
+            process.terminate()
+        os.close(master)
+        process.wait()
+
+
+# -----------------------------------------------------------------------------
+def run_command(cmd, sudo=False, timeout=0, verbose=False) -> str:
+    """
+
+    :param cmd: The command string or list of commands to use
+    :param sudo: Add 'sudo' command if this is set to True
+    :param timeout: A process timeout in seconds for commands which never end, like 'hcitool -i hci0 lescan'
+    :param verbose: Show intermediate (debug) results
+
+    If a timeout value is given, it will prepend the command with 'sudo timeout -s SIGINT {timeout}s '
+    """
+
+    if not sys.platform == 'linux':
+        print(f"ERROR: Command \"{cmd}\" is for Linux systems only...")
+        return ""
+
+    ret = ""
+
+    try:
+        for output in stream_command(cmd, sudo, timeout, verbose):
+            ret += output
         return ret.strip()
     except KeyboardInterrupt:
         # process.terminate()
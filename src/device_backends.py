@@ -0,0 +1,325 @@
+##
+# @file: device_backends.py
+# @brief: Pluggable storage backends for BT devices
+
+"""Pluggable storage backends for BT devices
+
+Every backend stores (addr, name, info) entries, keyed by address, and has the
+same interface as DeviceBackend. Use open_backend() to pick one by name:
+
+- "sqlite": DeviceDatabase, including the info history
+- "memory": a dictionary, nothing is stored on disk
+- "dbm": a key-value file with the dbm module
+"""
+
+# global imports
+import dbm
+import json
+import re
+from abc import ABC, abstractmethod
+
+# local imports
+from lib.helper import debug
+from device_dbase import DeviceDatabase
+
+
+# -----------------------------------------------------------------------------
+class DeviceBackend(ABC):
+    """Interface of a device storage backend. A backend without one of the abstract
+    methods cannot be instantiated."""
+
+    # False for backends which do not store to a file
+    needs_file = True
+
+    @abstractmethod
+    def add(self, addr, name, info) -> bool:
+        """Add a new entry
+
+        :return: True in case of success, False if the address already existed
+        """
+
+    @abstractmethod
+    def upsert(self, addr, name, info) -> bool:
+        """Add a new entry, or update an existing one
+
+        :return: True if the info string was added or changed, False if it was unchanged
+        """
+
+    @abstractmethod
+    def search(self, searchfor) -> list:
+        """Search addresses with a GLOB pattern, or a list of patterns
+
+        :return: sorted list of matching addresses
+        """
+
+    @abstractmethod
+    def iterate(self):
+        """Iterate over all entries
+
+        :return: iterator of (addr, name, info) tuples
+        """
+
+    @abstractmethod
+    def delete(self, addr) -> bool:
+        """Delete an entry
+
+        :return: True in case of success, False if the entry did not exist
+        """
+
+    def close(self):
+        """Close the backend. Everything will be stored."""
+        pass
+
+    def __len__(self):
+        return sum(1 for _entry in self.iterate())
+
+
+# -----------------------------------------------------------------------------
+def glob_to_regex(pattern):
+    """Translate a pattern of the SQLite GLOB operator into a compiled regular expression
+
+    Unlike fnmatch, a set is negated with '^', not '!', a '[' without a closing ']'
+    matches nothing, and a reversed range like [F-A] only matches its first member.
+
+    >>> glob_to_regex("AA:[^0-9]?:*").pattern
+    'AA:[^0-9].:.*'
+    >>> glob_to_regex("AA:[0-9") is None
+    True
+
+    :returns: the regular expression, or None if the pattern can not match anything
+    """
+
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        i += 1
+        if char == "*":
+            parts.append(".*")
+        elif char == "?":
+            parts.append(".")
+        elif char == "[":
+            negate = pattern[i:i + 1] == "^"
+            start = i + negate
+            # A ']' right after the '[' or '[^' is a member of the set
+            end = pattern.find("]", start + 1)
+            if end < 0:
+                return None
+            members = pattern[start:end]
+            # Like SQLite: a '-' after a member which does not end a range, and before the
+            # last member, makes a range. A reversed range only matches its first member.
+            chars = []
+            prior = None if members[0] == "]" else members[0]
+            chars.append(re.escape(members[0]))
+            k = 1
+            while k < len(members):
+                if members[k] == "-" and prior is not None and k + 1 < len(members):
+                    if prior <= members[k + 1]:
+                        # Right after the escaped prior member
+                        chars.append(f"-{re.escape(members[k + 1])}")
+                    prior = None
+                    k += 2
+                else:
+                    chars.append(re.escape(members[k]))
+                    prior = members[k]
+                    k += 1
+            parts.append(f"[{'^' if negate else ''}{''.join(chars)}]")
+            i = end + 1
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def match_patterns(addresses, searchfor) -> list:
+    """Match addresses against GLOB patterns, with the same rules as the SQLite GLOB operator
+
+    >>> match_patterns(['AA:BB:CC:DD:EE:FF', '11:22:33:44:55:66'], 'AA:*')
+    ['AA:BB:CC:DD:EE:FF']
+
+    >>> match_patterns(['AA:BB:CC:DD:EE:FF', '11:22:33:44:55:66'], ['aa:*', '11:2?:*'])
+    ['11:22:33:44:55:66']
+    """
+
+    if not searchfor:
+        return []
+    if isinstance(searchfor, str):
+        searchfor = [searchfor]
+    found = []
+    for pattern in searchfor:
+        regex = glob_to_regex(pattern)
+        if regex is not None:
+            found.extend(addr for addr in addresses if regex.fullmatch(addr))
+    return sorted(found)
+
+
+# -----------------------------------------------------------------------------
+class SqliteBackend(DeviceBackend):
+    """SQLite backend, based on DeviceDatabase"""
+
+    def __init__(self, filename, **kwargs):
+        """
+        :param filename: The name of the database file
+        :param kwargs: Passed on to DeviceDatabase, e.g. ramfile=":memory:"
+        """
+        self.db = DeviceDatabase(filename, **kwargs)
+
+    def add(self, addr, name, info) -> bool:
+        return self.db.add(addr, name, info)
+
+    def upsert(self, addr, name, info) -> bool:
+        return self.db.upsert(addr, name, info)
+
+    def search(self, searchfor) -> list:
+        return self.db.search(searchfor)
+
+    def iterate(self):
+        return self.db.iterate_devices()
+
+    def delete(self, addr) -> bool:
+        return self.db.remove(addr)
+
+    def close(self):
+        self.db.close()
+
+
+# -----------------------------------------------------------------------------
+class MemoryBackend(DeviceBackend):
+    """In-memory backend. Nothing is stored on disk."""
+
+    needs_file = False
+
+    def __init__(self, filename=None):
+        """
+        :param filename: Not used
+        """
+        self.devices = {}  # key is the address, value is a tuple of (name, info)
+
+    def add(self, addr, name, info) -> bool:
+        if addr in self.devices:
+            debug(f'Cannot not add addr "{addr}" twice')
+            return False
+        self.devices[addr] = (name, info)
+        return True
+
+    def upsert(self, addr, name, info) -> bool:
+        old = self.devices.get(addr)
+        self.devices[addr] = (name, info)
+        return old is None or old[1] != info
+
+    def search(self, searchfor) -> list:
+        return match_patterns(list(self.devices), searchfor)
+
+    def iterate(self):
+        return ((addr, name, info) for addr, (name, info) in self.devices.items())
+
+    def delete(self, addr) -> bool:
+        return self.devices.pop(addr, None) is not None
+
+    def __len__(self):
+        return len(self.devices)
+
+
+# -----------------------------------------------------------------------------
+class DbmBackend(DeviceBackend):
+    """Key-value backend with the dbm module. The value is the JSON list [name, info], so that
+    None is kept. Files of older versions, with the name and info separated by a NUL, can
+    still be read: a NUL is always escaped in JSON."""
+
+    def __init__(self, filename):
+        """
+        :param filename: The name of the dbm file(s)
+        """
+        self.db = dbm.open(str(filename), "c")
+
+    @staticmethod
+    def _encode(name, info) -> bytes:
+        return json.dumps([name, info], ensure_ascii=False).encode("utf-8")
+
+    @staticmethod
+    def _decode(value) -> tuple:
+        text = value.decode("utf-8")
+        if "\0" in text:
+            name, info = text.split("\0", maxsplit=1)
+        else:
+            name, info = json.loads(text)
+        return name, info
+
+    def add(self, addr, name, info) -> bool:
+        key = addr.encode("utf-8")
+        if key in self.db:
+            debug(f'Cannot not add addr "{addr}" twice')
+            return False
+        self.db[key] = self._encode(name, info)
+        return True
+
+    def upsert(self, addr, name, info) -> bool:
+        key = addr.encode("utf-8")
+        old = self.db.get(key)
+        self.db[key] = self._encode(name, info)
+        return old is None or self._decode(old)[1] != info
+
+    def search(self, searchfor) -> list:
+        return match_patterns([key.decode("utf-8") for key in self.db.keys()], searchfor)
+
+    def iterate(self):
+        for key in self.db.keys():
+            yield (key.decode("utf-8"),) + self._decode(self.db[key])
+
+    def delete(self, addr) -> bool:
+        key = addr.encode("utf-8")
+        if key not in self.db:
+            return False
+        del self.db[key]
+        return True
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return len(self.db)
+
+
+# -----------------------------------------------------------------------------
+backends = {
+    "sqlite": SqliteBackend,
+    "memory": MemoryBackend,
+    "dbm": DbmBackend,
+}
+
+
+# -----------------------------------------------------------------------------
+def open_backend(kind, filename=None, **kwargs) -> DeviceBackend:
+    """Open a device storage backend by name
+
+    :param kind: One of the names in backends: "sqlite", "memory" or "dbm"
+    :param filename: The file to store the devices in, required for all but "memory"
+    :param kwargs: Passed on to the backend
+    :returns: the backend
+
+    >>> backend = open_backend("memory")
+    >>> backend.add("AA:BB:CC:DD:EE:FF", "Hue Lamp", "")
+    True
+    >>> list(backend.iterate())
+    [('AA:BB:CC:DD:EE:FF', 'Hue Lamp', '')]
+    >>> open_backend("dbm")
+    Traceback (most recent call last):
+    ...
+    ValueError: The 'dbm' backend needs a filename
+    """
+
+    if kind not in backends:
+        raise ValueError(f"Unknown backend '{kind}', use one of {', '.join(backends)}")
+    if filename is None and backends[kind].needs_file:
+        raise ValueError(f"The '{kind}' backend needs a filename")
+    return backends[kind](filename, **kwargs)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
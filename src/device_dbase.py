@@ -6,19 +6,106 @@
 """
 
 # Global imports
+import atexit
+import datetime
+import difflib
+import mmap
 import pathlib
 from pathlib import Path
 import sqlite3
+import struct
+import threading
+import time
 
 # Local imports
 from lib.helper import debug
+from lib.helper import addr_to_int, int_to_addr
+import rssi_codec
 from lib.decorators import dumpArgs, dumpFuncname
 
-DB_CREATE = """create table devices
+DB_CREATE = """create table if not exists devices
             (addr text primary key, name text, info text)"""
 
+HISTORY_CREATE = """create table if not exists history
+            (addr text, seq integer, timestamp text, delta text,
+            primary key (addr, seq))"""
+
+SIGHTINGS_CREATE = """create table if not exists sightings
+            (addr integer, timestamp real, rssi integer, adapter integer)"""
+SIGHTINGS_INDEX = "create index if not exists sightings_time on sightings (timestamp)"
+
+RSSI_BLOCKS_CREATE = """create table if not exists rssi_blocks
+            (addr integer, t_start integer, t_end integer, count integer, data blob)"""
+RSSI_BLOCKS_INDEX = "create index if not exists rssi_blocks_addr on rssi_blocks (addr, t_end)"
+SEARCH_RSSI_BLOCKS = "select data from rssi_blocks where addr = ? and t_end >= ? and t_start <= ? order by t_start"
+
 SEARCH_ALL = "select * from devices"
 SEARCH_ADDR = "select addr name from devices where addr GLOB ? order by addr"
+SEARCH_INFO = "select info from devices where addr = ?"
+SEARCH_HISTORY = "select seq, timestamp, delta from history where addr = ? order by seq"
+LAST_HISTORY_SEQ = "select max(seq) from history where addr = ?"
+
+
+# ===============================================================================
+def make_info_delta(old, new) -> str:
+    r"""Create a line-level delta which turns the old info string into the new one.
+
+    The delta is a newline separated list of operations:
+    '=n' keeps the next n old lines, '-n' drops the next n old lines
+    and '+text' inserts the line 'text'.
+
+    :param old: The previous info string ("" for the first snapshot)
+    :param new: The new info string
+    :returns: The delta string
+
+    >>> make_info_delta("Name: a\nRSSI: -60\nPaired: no", "Name: a\nRSSI: -72\nPaired: no")
+    '=1\n-1\n+RSSI: -72\n=1'
+
+    >>> make_info_delta("", "Name: a")
+    '-1\n+Name: a'
+    """
+
+    old_lines = old.split("\n")
+    new_lines = new.split("\n")
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(f"={i2 - i1}")
+            continue
+        if tag in ("delete", "replace"):
+            ops.append(f"-{i2 - i1}")
+        if tag in ("insert", "replace"):
+            ops.extend(f"+{line}" for line in new_lines[j1:j2])
+    return "\n".join(ops)
+
+
+# ===============================================================================
+def apply_info_delta(old, delta) -> str:
+    r"""Apply a delta, made by make_info_delta(), to the old info string
+
+    :param old: The info string the delta was made against
+    :param delta: The delta string
+    :returns: The reconstructed new info string
+
+    >>> apply_info_delta("Name: a\nRSSI: -60\nPaired: no", '=1\n-1\n+RSSI: -72\n=1')
+    'Name: a\nRSSI: -72\nPaired: no'
+    """
+
+    old_lines = old.split("\n")
+    new_lines = []
+    pos = 0
+    for op in delta.split("\n"):
+        if op.startswith("+"):
+            new_lines.append(op[1:])
+        elif op.startswith("="):
+            count = int(op[1:])
+            new_lines.extend(old_lines[pos:pos + count])
+            pos += count
+        elif op.startswith("-"):
+            pos += int(op[1:])
+    return "\n".join(new_lines)
+
 
 # ===============================================================================
 def get_dbasefile_path(dbase_filename="btdevice_dbase.sqlite") -> Path:
@@ -40,13 +127,21 @@ def get_dbasefile_path(dbase_filename="btdevice_dbase.sqlite") -> Path:
 class DeviceDatabase:
     """Database class"""
 
-    def __init__(self, filename):
+    def __init__(self, filename, ramfile=None, persist_interval=60.0, max_unpersisted=1000, sighting_store=None):
         """Intialize this class
         @param filename The name of the database file
+        @param ramfile If given, work on this in-memory (":memory:") or tmpfs database instead,
+            and persist it to filename with the SQLite backup API.
+        @param persist_interval RAM mode only: maximum number of seconds between two persists
+        @param max_unpersisted RAM mode only: persist on commit once this many rows changed since the last persist
+        @param sighting_store If given, sightings go to this store (e.g. a SightingLog) instead of the sightings table
 
         The database fields:
             create table software(path text primary key, name text)
 
+        In RAM mode, a crash loses at most persist_interval seconds of changes. max_unpersisted
+        is checked on every commit(), so the changes of one large batch, or changes which are
+        not committed, can go beyond it. A clean close() (also called at exit) loses nothing.
         """
 
         debug("Initializing DeviceDatabase")
@@ -64,6 +159,25 @@ class DeviceDatabase:
         self.con = None
         self.cur = None
 
+        # The file sqlite works on. In RAM mode, this is not the file on disk.
+        self.workfile = self.dbasefile if ramfile is None else ramfile
+        self.persist_interval = persist_interval
+        self.max_unpersisted = max_unpersisted
+        self.sighting_store = sighting_store
+        self.persisted_changes = 0
+        self.last_persist = time.monotonic()
+        self._lock = threading.RLock()
+        self._stop_persisting = threading.Event()
+        self._persist_thread = None
+
+        if ramfile is not None and self.dbasefile.is_file():
+            # Keep this connection open: an in-memory database is gone once it is closed
+            self.con = sqlite3.connect(self.workfile, check_same_thread=False)
+            disk = sqlite3.connect(self.dbasefile)
+            disk.backup(self.con)
+            disk.close()
+            debug(f"Loaded {self.dbasefile} into {self.workfile}")
+
         if self.dbasefile.is_file():
             self.open()
             debug("Opened existing database")
@@ -71,6 +185,12 @@ class DeviceDatabase:
             self.create()
             debug("Created new database")
 
+        if self.in_ram_mode():
+            self.persisted_changes = self.con.total_changes
+            self._persist_thread = threading.Thread(target=self._persist_loop, daemon=True)
+            self._persist_thread.start()
+            atexit.register(self.close)
+
     # ===============================================================================
     #  open
     # ===============================================================================
@@ -115,10 +235,16 @@ class DeviceDatabase:
 
         # For check_same_thread=False option, see https://stackoverflow.com/questions/48218065/
 
-        self.con = sqlite3.connect(self.dbasefile, check_same_thread=False)
+        if not self.con:
+            self.con = sqlite3.connect(self.workfile, check_same_thread=False)
         self.cur = self.con.cursor()
         debug(f'Creation string = {DB_CREATE}')
         self.cur.execute(DB_CREATE)
+        self.cur.execute(HISTORY_CREATE)
+        self.cur.execute(SIGHTINGS_CREATE)
+        self.cur.execute(SIGHTINGS_INDEX)
+        self.cur.execute(RSSI_BLOCKS_CREATE)
+        self.cur.execute(RSSI_BLOCKS_INDEX)
         debug(f"Returning {self.con}")
         return self.con
 
@@ -130,8 +256,15 @@ class DeviceDatabase:
         """
 
         debug(f"Opening database {self.dbasefile}")
-        self.con = sqlite3.connect(self.dbasefile, check_same_thread=False)
+        if not self.con:
+            self.con = sqlite3.connect(self.workfile, check_same_thread=False)
         self.cur = self.con.cursor()
+        # Databases created before the history, sightings and rssi_blocks tables existed get them here
+        self.cur.execute(HISTORY_CREATE)
+        self.cur.execute(SIGHTINGS_CREATE)
+        self.cur.execute(SIGHTINGS_INDEX)
+        self.cur.execute(RSSI_BLOCKS_CREATE)
+        self.cur.execute(RSSI_BLOCKS_INDEX)
         if self.cur:
             return True
         else:
@@ -145,12 +278,69 @@ class DeviceDatabase:
 
         # debug('Closing database connection')
 
+        if self.sighting_store:
+            self.sighting_store.close()
+
+        if self._persist_thread:
+            self._stop_persisting.set()
+            self._persist_thread.join()
+            self._persist_thread = None
+            atexit.unregister(self.close)
+            self.persist()
+
         if self.con:
             self.con.close()
+            self.con = None
             debug("Database has been closed")
             return True
         return False
 
+    # ===============================================================================
+    #  RAM mode
+    # ===============================================================================
+    def in_ram_mode(self) -> bool:
+        """Return True if this database works on an in-memory or tmpfs copy"""
+
+        return self.workfile != self.dbasefile
+
+    # ===============================================================================
+    def unpersisted_changes(self) -> int:
+        """Return the number of rows changed since the last persist (0 if not in RAM mode)"""
+
+        if not self.in_ram_mode() or not self.con:
+            return 0
+        return self.con.total_changes - self.persisted_changes
+
+    # ===============================================================================
+    def persist(self) -> bool:
+        """Write the in-memory database to the database file on disk.
+
+        :returns: True if the database was written, False if there was nothing to do
+        """
+
+        if not self.in_ram_mode() or not self.con:
+            return False
+
+        with self._lock:
+            self.con.commit()
+            disk = sqlite3.connect(self.dbasefile)
+            self.con.backup(disk)
+            disk.close()
+            self.persisted_changes = self.con.total_changes
+            self.last_persist = time.monotonic()
+        debug(f"Persisted {self.workfile} to {self.dbasefile}")
+        return True
+
+    # ===============================================================================
+    def _persist_loop(self):
+        """Background thread: persist every persist_interval seconds, if anything changed"""
+
+        while not self._stop_persisting.wait(self.persist_interval):
+            # persist() waits for the write operation in progress, so it never
+            # writes a device without its history
+            if self.unpersisted_changes():
+                self.persist()
+
     # ===============================================================================
     #  commit
     # ===============================================================================
@@ -159,7 +349,10 @@ class DeviceDatabase:
         Always returns True
         """
         # if self.con:
-        self.con.commit()
+        with self._lock:
+            self.con.commit()
+            if self.in_ram_mode() and self.unpersisted_changes() >= self.max_unpersisted:
+                self.persist()
         return True
 
     # ===============================================================================
@@ -175,18 +368,96 @@ class DeviceDatabase:
         :return: True in case of success, False in case of an error.
         """
 
-        try:
+        # The device and its history are one change, also for the persist thread
+        with self._lock:
+            try:
+                self.cur.execute(
+                    "insert into devices values (?, ?, ?)",
+                    (addr, name, info),
+                )
+            except sqlite3.IntegrityError:
+                debug(f'Cannot not add addr "{addr}" twice')
+                return False
+
+            # The devices table accepts a missing info, the history stores it as ""
+            self.add_history(addr, "", info or "")
+            self.commit()
+        return True
+
+    # ===============================================================================
+    def upsert(self, addr, name, info) -> bool:
+        """Add a new entry, or update an existing one.
+
+        If the info string of an existing device changed, the line-level delta
+        to the previous info string is stored in the history table.
+
+        :param addr: BT address
+        :param name: Name of the BT device
+        :param info: Info string of this BT device
+        :return: True if the info string was added or changed, False if it was unchanged.
+        """
+
+        with self._lock:
+            self.cur.execute(SEARCH_INFO, (addr,))
+            row = self.cur.fetchone()
+            if row is None:
+                return self.add(addr, name, info)
+
+            old_info = row[0] or ""
             self.cur.execute(
-                "insert into devices values (?, ?, ?)",
-                (addr, name, info),
+                "update devices set name = ?, info = ? where addr = ?",
+                (name, info, addr),
             )
-        except sqlite3.IntegrityError:
-            debug(f'Cannot not add addr "{addr}" twice')
-            return False
+            new_info = info or ""
+            changed = old_info != new_info
+            if changed:
+                self.add_history(addr, old_info, new_info)
+            self.commit()
+        return changed
 
-        self.add(addr, name, info)
-        self.con.commit()
-        return True
+    # ===============================================================================
+    def add_history(self, addr, old_info, new_info):
+        """Store the delta between two successive info snapshots of a device.
+        The caller is responsible for the commit, and holds _lock until then.
+
+        :param addr: BT address
+        :param old_info: The previous info string ("" for the first snapshot)
+        :param new_info: The new info string
+        """
+
+        self.cur.execute(LAST_HISTORY_SEQ, (addr,))
+        last_seq = self.cur.fetchone()[0]
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S.%f")
+
+        if last_seq is None and old_info:
+            # Device was stored before the history table existed: keep its old info as the base
+            self.cur.execute(
+                "insert into history values (?, ?, ?, ?)",
+                (addr, 0, "", make_info_delta("", old_info)),
+            )
+            last_seq = 0
+
+        seq = 0 if last_seq is None else last_seq + 1
+        self.cur.execute(
+            "insert into history values (?, ?, ?, ?)",
+            (addr, seq, timestamp, make_info_delta(old_info, new_info)),
+        )
+
+    # ===============================================================================
+    def get_info_history(self, addr) -> list:
+        """Reconstruct all stored info snapshots of a device
+
+        :param addr: BT address
+        :return: List of (timestamp, info) tuples, oldest first
+        """
+
+        self.cur.execute(SEARCH_HISTORY, (addr,))
+        snapshots = []
+        info = ""
+        for _seq, timestamp, delta in self.cur.fetchall():
+            info = apply_info_delta(info, delta)
+            snapshots.append((timestamp, info))
+        return snapshots
 
     # ===============================================================================
     def search(self, searchfor) -> list:
@@ -232,6 +503,318 @@ class DeviceDatabase:
         rows = self.cur.fetchall()
         return rows
 
+    # ===============================================================================
+    def iterate_devices(self):
+        """Iterate over all entries, without fetching them all in memory first
+
+        :return: iterator of (addr, name, info) tuples
+        """
+
+        return self.con.execute(SEARCH_ALL)
+
+    # ===============================================================================
+    def remove(self, addr) -> bool:
+        """Remove an entry from the devices table. Its info history is kept.
+
+        :param addr: BT address
+        :return: True in case of success, False if the entry did not exist
+        """
+
+        with self._lock:
+            self.cur.execute("delete from devices where addr = ?", (addr,))
+            removed = self.cur.rowcount > 0
+            self.commit()
+        return removed
+
+    # ===============================================================================
+    #  sightings
+    # ===============================================================================
+    def add_sighting(self, addr, timestamp, rssi, adapter=0) -> bool:
+        """Store a single sighting of a device
+
+        :param addr: BT address
+        :param timestamp: time.time() of the sighting
+        :param rssi: Received signal strength
+        :param adapter: Index of the adapter, 0 for hci0
+        :return: True in case of success
+        """
+
+        return self.add_sightings([(addr, timestamp, rssi, adapter)])
+
+    # ===============================================================================
+    def add_sightings(self, sightings) -> bool:
+        """Store a batch of sightings with a single commit
+
+        :param sightings: iterable of (addr, timestamp, rssi, adapter) tuples
+        :return: True in case of success
+        """
+
+        if self.sighting_store:
+            return self.sighting_store.add_sightings(sightings)
+
+        with self._lock:
+            self.cur.executemany(
+                "insert into sightings values (?, ?, ?, ?)",
+                ((addr_to_int(addr), timestamp, rssi, adapter) for addr, timestamp, rssi, adapter in sightings),
+            )
+            self.commit()
+        return True
+
+    # ===============================================================================
+    def get_sightings(self, addr=None, start=None, end=None) -> list:
+        """Get the sightings, optionally of one device and/or within a time range
+
+        :param addr: BT address, or None for all devices
+        :param start: Oldest timestamp to return (inclusive), or None
+        :param end: Newest timestamp to return (inclusive), or None
+        :return: List of (addr, timestamp, rssi, adapter) tuples, in order of arrival
+        """
+
+        if self.sighting_store:
+            return self.sighting_store.get_sightings(addr, start, end)
+
+        conditions = []
+        params = []
+        if addr is not None:
+            conditions.append("addr = ?")
+            params.append(addr_to_int(addr))
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("timestamp <= ?")
+            params.append(end)
+        query = "select * from sightings"
+        if conditions:
+            query += " where " + " and ".join(conditions)
+        self.cur.execute(query + " order by rowid", params)
+        return [(int_to_addr(a), timestamp, rssi, adapter) for a, timestamp, rssi, adapter in self.cur.fetchall()]
+
+    # ===============================================================================
+    #  RSSI history
+    # ===============================================================================
+    def add_rssi_history(self, addr, timestamps, rssis, block_samples=1024) -> bool:
+        """Store the RSSI history of a device as compressed blocks. See rssi_codec.
+
+        :param addr: BT address
+        :param timestamps: list of time.time() values, in ascending order
+        :param rssis: list of rssi values
+        :param block_samples: Maximum number of samples per block
+        :return: True in case of success
+        """
+
+        addr_int = addr_to_int(addr)
+        ms = [round(ts * 1000) for ts in timestamps]
+        block_samples = min(block_samples, rssi_codec.MAX_BLOCK_SAMPLES)
+        rows = []
+        for i in range(0, len(ms), block_samples):
+            block_ms = ms[i:i + block_samples]
+            data = rssi_codec.encode_block(block_ms, rssis[i:i + block_samples])
+            rows.append((addr_int, block_ms[0], block_ms[-1], len(block_ms), data))
+        with self._lock:
+            self.cur.executemany("insert into rssi_blocks values (?, ?, ?, ?, ?)", rows)
+            self.commit()
+        return True
+
+    # ===============================================================================
+    def get_rssi_history(self, addr, start=None, end=None, as_arrays=False) -> tuple:
+        """Get the RSSI history of a device. Only the blocks overlapping start..end are decoded.
+
+        :param addr: BT address
+        :param start: Oldest timestamp to return (inclusive), or None
+        :param end: Newest timestamp to return (inclusive), or None
+        :param as_arrays: If True, return NumPy arrays, decoded with rssi_codec.decode_block_numpy()
+        :return: tuple of (timestamps, rssis). The timestamps are in seconds.
+        """
+
+        if as_arrays and rssi_codec.np is None:
+            raise ImportError("get_rssi_history(as_arrays=True) needs the numpy package")
+        low = -(1 << 63) if start is None else round(start * 1000)
+        high = (1 << 63) - 1 if end is None else round(end * 1000)
+        self.cur.execute(SEARCH_RSSI_BLOCKS, (addr_to_int(addr), low, high))
+        blocks = [row[0] for row in self.cur.fetchall()]
+
+        if as_arrays:
+            np = rssi_codec.np
+            decoded = [rssi_codec.decode_block_numpy(block) for block in blocks]
+            ms = np.concatenate([ts for ts, _rssi in decoded]) if decoded else np.zeros(0, dtype=np.int64)
+            rssis = np.concatenate([rssi for _ts, rssi in decoded]) if decoded else np.zeros(0, dtype=np.int8)
+            mask = (ms >= low) & (ms <= high)
+            return ms[mask] / 1000, rssis[mask]
+
+        timestamps = []
+        rssis = []
+        for block in blocks:
+            block_ms, block_rssis = rssi_codec.decode_block(block)
+            for ts, rssi in zip(block_ms, block_rssis):
+                if low <= ts <= high:
+                    timestamps.append(ts / 1000)
+                    rssis.append(rssi)
+        return timestamps, rssis
+
+
+# ===============================================================================
+class SightingLog:
+    """Log-structured sighting store
+
+    Sightings are appended as fixed-size binary records to segment files in a folder.
+    For every block of index_every records, the lowest and highest timestamp are kept
+    in a sparse time index, so a time range query only unpacks the blocks it overlaps.
+    Readers mmap the segment files.
+
+    It has the same sighting API as DeviceDatabase, and can be plugged in with
+    DeviceDatabase(filename, sighting_store=SightingLog(folder)).
+    """
+
+    # address int, timestamp, rssi and adapter id
+    RECORD = struct.Struct("<QdhH")
+
+    def __init__(self, folder, segment_records=1 << 20, index_every=256):
+        """Initialize this class
+        @param folder The folder to store the segment files in. Will be created if needed.
+        @param segment_records Start a new segment file after this many records
+        @param index_every Number of records per block in the sparse time index
+        """
+
+        self.folder = pathlib.Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.segment_records = segment_records
+        self.index_every = index_every
+
+        # Per segment: list of [min timestamp, max timestamp] for each block of index_every records
+        self.index = []
+        self.segments = sorted(self.folder.glob("sightings-*.seg"))
+        if not self.segments:
+            self._new_segment()
+
+        # Drop a partly written record at the end, which is left by a crash during an append
+        self.records_in_segment = self.segments[-1].stat().st_size // self.RECORD.size
+        with open(self.segments[-1], "r+b") as f:
+            f.truncate(self.records_in_segment * self.RECORD.size)
+
+        self.index = [self._build_index(path) for path in self.segments]
+        self.file = open(self.segments[-1], "ab")
+
+    # ===============================================================================
+    def _new_segment(self):
+        """Add a new, empty, segment file"""
+
+        path = self.folder.joinpath(f"sightings-{len(self.segments):06d}.seg")
+        path.touch()
+        self.segments.append(path)
+        self.index.append([])
+
+    # ===============================================================================
+    def _build_index(self, path) -> list:
+        """Build the sparse time index of an existing segment file"""
+
+        index = []
+        block_size = self.index_every * self.RECORD.size
+        with self._map(path) as mm:
+            for offset in range(0, len(mm), block_size):
+                timestamps = [ts for _addr, ts, _rssi, _adapter in self._unpack(mm, offset, offset + block_size)]
+                index.append([min(timestamps), max(timestamps)])
+        return index
+
+    # ===============================================================================
+    def _map(self, path):
+        """Return a read-only mmap of a segment file, or an empty bytes object for an empty file"""
+
+        size = path.stat().st_size
+        if size < self.RECORD.size:
+            return memoryview(b"")
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), size - size % self.RECORD.size, access=mmap.ACCESS_READ)
+
+    # ===============================================================================
+    def _unpack(self, mm, first, last):
+        """Unpack the records between byte offsets first and last of a mapped segment"""
+
+        return self.RECORD.iter_unpack(mm[first:min(last, len(mm))])
+
+    # ===============================================================================
+    def add_sighting(self, addr, timestamp, rssi, adapter=0) -> bool:
+        """Store a single sighting of a device. See DeviceDatabase.add_sighting()"""
+
+        return self.add_sightings([(addr, timestamp, rssi, adapter)])
+
+    # ===============================================================================
+    def add_sightings(self, sightings) -> bool:
+        """Append a batch of sightings. See DeviceDatabase.add_sightings()"""
+
+        # Pack the whole batch first: a bad address or RSSI raises before anything is
+        # written, and the index only counts records which are in the file
+        pack = self.RECORD.pack
+        records = []
+        timestamps = []
+        for addr, timestamp, rssi, adapter in sightings:
+            records.append(pack(addr_to_int(addr), timestamp, rssi, adapter))
+            timestamps.append(timestamp)
+
+        first = 0
+        while first < len(records):
+            if self.records_in_segment == self.segment_records:
+                self.file.close()
+                self._new_segment()
+                self.records_in_segment = 0
+                self.file = open(self.segments[-1], "ab")
+
+            last = min(len(records), first + self.segment_records - self.records_in_segment)
+            self.file.write(b"".join(records[first:last]))
+
+            index = self.index[-1]
+            for timestamp in timestamps[first:last]:
+                if self.records_in_segment % self.index_every == 0:
+                    index.append([timestamp, timestamp])
+                else:
+                    block = index[-1]
+                    if timestamp < block[0]:
+                        block[0] = timestamp
+                    elif timestamp > block[1]:
+                        block[1] = timestamp
+                self.records_in_segment += 1
+            first = last
+        return True
+
+    # ===============================================================================
+    def get_sightings(self, addr=None, start=None, end=None) -> list:
+        """Get the sightings. See DeviceDatabase.get_sightings()"""
+
+        self.file.flush()
+
+        addr_int = None if addr is None else addr_to_int(addr)
+        low = float("-inf") if start is None else start
+        high = float("inf") if end is None else end
+
+        block_size = self.index_every * self.RECORD.size
+        result = []
+        for path, index in zip(self.segments, self.index):
+            blocks = [nr for nr, (block_min, block_max) in enumerate(index) if block_max >= low and block_min <= high]
+            if not blocks:
+                continue
+            with self._map(path) as mm:
+                for nr in blocks:
+                    for a, timestamp, rssi, adapter in self._unpack(mm, nr * block_size, (nr + 1) * block_size):
+                        if low <= timestamp <= high and (addr_int is None or a == addr_int):
+                            result.append((int_to_addr(a), timestamp, rssi, adapter))
+        return result
+
+    # ===============================================================================
+    def commit(self) -> bool:
+        """Flush the appended records to the segment file"""
+
+        self.file.flush()
+        return True
+
+    # ===============================================================================
+    def close(self) -> bool:
+        """Flush and close the current segment file"""
+
+        if self.file.closed:
+            return False
+        self.file.close()
+        return True
+
 
 # ===============================================================================
 if __name__ == "__main__":
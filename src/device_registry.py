@@ -0,0 +1,197 @@
+##
+# @file: device_registry.py
+# @brief: Registry of the tracked BT devices, with field-level change detection
+
+"""Registry of the tracked BT devices, with field-level change detection
+
+DeviceRegistry.update() applies the parsed fields of a device and returns only the
+fields which actually changed, so the consumers handle deltas instead of complete
+devices. First and last seen are kept as time.monotonic_ns() integers and are only
+converted to a date-time string on output.
+"""
+
+# global imports
+import datetime
+import sys
+import time
+from collections import namedtuple
+
+# local imports
+from lib.helper import addr_to_int, int_to_addr
+
+# Difference between the wall clock and the monotonic clock, to format monotonic times
+WALL_OFFSET_NS = time.time_ns() - time.monotonic_ns()
+
+# A change of a device. kind is "new", "changed" or "deleted", fields is a dictionary
+# of the fields with their new value
+DeviceChange = namedtuple("DeviceChange", "kind addr fields")
+
+
+# -----------------------------------------------------------------------------
+def format_ns(ns) -> str:
+    """Format a time.monotonic_ns() value as a date-time string, like get_timestamp()
+
+    >>> len(format_ns(time.monotonic_ns()))
+    22
+    """
+
+    dt_date = datetime.datetime.fromtimestamp((ns + WALL_OFFSET_NS) / 1e9)
+    return dt_date.strftime("%Y%m%d-%H%M%S.%f")
+
+
+# -----------------------------------------------------------------------------
+class BTDevice:
+    """A tracked BT device.
+
+    To keep tens of thousands of devices in memory, the address is stored as an integer,
+    names are interned (many devices share a name like 'Hue Lamp') and there is no
+    per-instance __dict__. The full info string is not kept, props holds its parsed DeviceInfo.
+
+    >>> device = BTDevice("D8:DD:6B:81:74:8B", "Hue Lamp")
+    >>> device.addr, device.addr_int, device.name is BTDevice("F4:BA:5D:1A:3C:2F", "Hue Lamp").name
+    ('D8:DD:6B:81:74:8B', 238445503018123, True)
+    """
+
+    __slots__ = ("addr_int", "_name", "first_seen", "last_seen", "rssi", "txpower", "manufacturerdata", "servicedata", "props")
+
+    dev = "Device"
+
+    def __init__(self, addr="00:00:00:00:00:00", name="", seen=0):
+        """
+        :param addr: The BT address
+        :param name: The name of the device
+        :param seen: time.monotonic_ns() of the first sighting
+        """
+        self.addr_int = addr_to_int(addr)
+        self.name = name
+        self.first_seen = seen
+        self.last_seen = seen
+        self.rssi = 0
+        self.txpower = 0
+        self.manufacturerdata = None  # dictionary of company id and bytes
+        self.servicedata = None  # dictionary of service UUID and bytes
+        self.props = None  # DeviceInfo, the parsed 'bluetoothctl info'
+
+    @property
+    def addr(self) -> str:
+        return int_to_addr(self.addr_int)
+
+    @addr.setter
+    def addr(self, addr):
+        self.addr_int = addr_to_int(addr)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = sys.intern(name)
+
+    @property
+    def timestamp(self) -> str:
+        """Date-time string of the last sighting"""
+        return format_ns(self.last_seen)
+
+    def __str__(self):
+        s = f"BTDevice (str): addr={self.addr} \nname={self.name} \nprops={self.props}"
+        return s
+
+    def __repr__(self):
+        s = f"BTDevice (repr): addr={self.addr} \nname={self.name} \nprops={self.props}"
+        return s
+
+
+# -----------------------------------------------------------------------------
+class DeviceRegistry:
+    """The tracked BT devices, keyed by address
+
+    >>> registry = DeviceRegistry()
+    >>> registry.update("D8:DD:6B:81:74:8B", name="Hue Lamp", rssi=-60)
+    DeviceChange(kind='new', addr='D8:DD:6B:81:74:8B', fields={'name': 'Hue Lamp', 'rssi': -60})
+    >>> registry.update("D8:DD:6B:81:74:8B", name="Hue Lamp", rssi=-58)
+    DeviceChange(kind='changed', addr='D8:DD:6B:81:74:8B', fields={'rssi': -58})
+    >>> registry.update("D8:DD:6B:81:74:8B", rssi=-58) is None
+    True
+    """
+
+    # The fields which update() accepts
+    FIELDS = frozenset(("name", "rssi", "txpower", "manufacturerdata", "servicedata", "props"))
+
+    def __init__(self, clock=time.monotonic_ns):
+        """
+        :param clock: function returning the current time in integer nanoseconds
+        """
+        self.clock = clock
+        self.devices = {}  # dictionary of BTDevice, key is the address
+
+    # -------------------------------------------------------------------------
+    def update(self, addr, **fields):
+        """Apply new field values of a device, and mark it as seen now
+
+        :param addr: The BT address
+        :param fields: New values, with the names in FIELDS
+        :returns: DeviceChange with only the changed fields, or None if nothing changed
+        """
+
+        unknown = fields.keys() - self.FIELDS
+        if unknown:
+            raise ValueError(f"Unknown device field(s): {', '.join(sorted(unknown))}")
+
+        now = self.clock()
+        device = self.devices.get(addr)
+        if device is None:
+            device = BTDevice(addr, fields.get("name", ""), now)
+            for field, value in fields.items():
+                setattr(device, field, value)
+            self.devices[addr] = device
+            return DeviceChange("new", addr, fields)
+
+        device.last_seen = now
+        changed = {}
+        for field, value in fields.items():
+            if getattr(device, field) != value:
+                setattr(device, field, value)
+                changed[field] = value
+        return DeviceChange("changed", addr, changed) if changed else None
+
+    # -------------------------------------------------------------------------
+    def remove(self, addr):
+        """Forget a device
+
+        :returns: DeviceChange of kind "deleted", or None if the device was unknown
+        """
+
+        if self.devices.pop(addr, None) is None:
+            return None
+        return DeviceChange("deleted", addr, {})
+
+    # -------------------------------------------------------------------------
+    def get(self, addr):
+        """Return the BTDevice of an address, or None"""
+
+        return self.devices.get(addr)
+
+    def seen_since(self, ns) -> list:
+        """Return the addresses of the devices seen at or after the monotonic time ns"""
+
+        return [addr for addr, device in self.devices.items() if device.last_seen >= ns]
+
+    def __contains__(self, addr):
+        return addr in self.devices
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __len__(self):
+        return len(self.devices)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,258 @@
+##
+# @file: event_bus.py
+# @brief: In-process publish/subscribe event bus with a bounded queue per subscriber
+
+"""In-process publish/subscribe event bus with a bounded queue per subscriber
+
+The scan loop publishes every event once. Each subscriber, like the database writer
+or the console, has its own thread and its own bounded queue, so a slow subscriber
+only falls behind itself, and never stalls the scan loop or the other subscribers.
+When the queue of a subscriber is full, its drop policy decides:
+
+* "drop_oldest": the oldest queued event is dropped, for sinks which want the latest state
+* "drop_newest": the new event is dropped, for sinks which want a gapless prefix
+* "block": publish() waits, only for sinks which must not lose anything
+
+Subscription.stats() counts the delivered and dropped events, and measures the lag:
+the number of queued events, and the time from publish() until the handler finished.
+
+A subscriber can also have a timer: a function which is called every interval seconds
+in the thread of the subscriber, also when no events arrive. It shares the thread with
+the handler, so both can use the same state without a lock.
+"""
+
+# global imports
+import threading
+import time
+from collections import deque
+
+# local imports
+from lib.helper import debug
+
+POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+# -----------------------------------------------------------------------------
+class Subscription:
+    """A subscriber of an EventBus, with its queue and its thread"""
+
+    def __init__(self, handler, name, maxsize, policy, timer=None, interval=1.0):
+        """
+        :param handler: function(event), called in the thread of the subscription
+        :param name: Name of the subscriber, for the statistics
+        :param maxsize: Maximum number of queued events
+        :param policy: What to do with an event when the queue is full, one of POLICIES
+        :param timer: Optional function(), called every interval seconds in the thread of the subscription
+        :param interval: Number of seconds between the calls of timer
+        """
+
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+
+        self.handler = handler
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.timer = timer
+        self.interval = interval
+
+        self.queue = deque()  # (publish time, event)
+        self.cond = threading.Condition()
+        self.closing = False
+
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_queued = 0
+        self.latency_sum = 0.0  # seconds, from publish() until the handler finished
+        self.latency_max = 0.0
+
+        self.thread = threading.Thread(target=self._run, name=f"subscriber {name}", daemon=True)
+        self.thread.start()
+
+    # -------------------------------------------------------------------------
+    def offer(self, event):
+        """Queue an event, following the drop policy if the queue is full"""
+
+        with self.cond:
+            if self.closing:
+                return
+            self.published += 1
+            if len(self.queue) >= self.maxsize:
+                if self.policy == "drop_newest":
+                    self.dropped += 1
+                    return
+                if self.policy == "drop_oldest":
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.queue) >= self.maxsize and not self.closing:
+                        self.cond.wait()
+            self.queue.append((time.perf_counter(), event))
+            self.max_queued = max(self.max_queued, len(self.queue))
+            self.cond.notify_all()
+
+    # -------------------------------------------------------------------------
+    def _run(self):
+        next_timer = time.monotonic() + self.interval
+        while True:
+            with self.cond:
+                while not self.queue and not self.closing:
+                    if self.timer is None:
+                        self.cond.wait()
+                        continue
+                    remaining = next_timer - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                queued = bool(self.queue)
+                if queued:
+                    published, event = self.queue.popleft()
+                    # Wake up a blocked publisher
+                    self.cond.notify_all()
+                elif self.closing:
+                    return
+
+            if self.timer is not None and time.monotonic() >= next_timer:
+                next_timer = time.monotonic() + self.interval
+                try:
+                    self.timer()
+                except Exception as ex:
+                    self.errors += 1
+                    debug(f"Timer of subscriber {self.name} failed: {ex}")
+            if not queued:
+                continue
+
+            try:
+                self.handler(event)
+            except Exception as ex:
+                self.errors += 1
+                debug(f"Subscriber {self.name} failed: {ex}")
+
+            latency = time.perf_counter() - published
+            self.delivered += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    # -------------------------------------------------------------------------
+    def lag(self) -> int:
+        """Number of events which are queued, but not handled yet"""
+
+        return len(self.queue)
+
+    def stats(self) -> dict:
+        """Counters and lag of the subscriber, latencies in ms"""
+
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queued": self.lag(),
+            "max_queued": self.max_queued,
+            "mean_latency_ms": 1000 * self.latency_sum / self.delivered if self.delivered else 0.0,
+            "max_latency_ms": 1000 * self.latency_max,
+        }
+
+    # -------------------------------------------------------------------------
+    def close(self, drain=True):
+        """Stop the thread of the subscription
+
+        :param drain: True to handle the queued events first, False to drop them
+        """
+
+        with self.cond:
+            self.closing = True
+            if not drain:
+                self.dropped += len(self.queue)
+                self.queue.clear()
+            self.cond.notify_all()
+        self.thread.join()
+
+
+# -----------------------------------------------------------------------------
+class EventBus:
+    """Publish events to any number of subscribers
+
+    >>> received = []
+    >>> with EventBus() as bus:
+    ...     subscription = bus.subscribe(received.append, "list")
+    ...     for event in range(3):
+    ...         bus.publish(event)
+    >>> received, subscription.stats()["delivered"]
+    ([0, 1, 2], 3)
+    """
+
+    def __init__(self):
+        self.subscriptions = []
+        self.lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    def subscribe(self, handler, name=None, maxsize=1000, policy="drop_oldest", timer=None, interval=1.0) -> Subscription:
+        """Add a subscriber, which gets the events published from now on
+
+        :param handler: function(event), called in a thread of the subscriber
+        :param name: Name of the subscriber, default the name of the handler
+        :param maxsize: Maximum number of queued events
+        :param policy: What to do with an event when the queue is full, one of POLICIES
+        :param timer: Optional function(), called every interval seconds in the thread of the subscriber
+        :param interval: Number of seconds between the calls of timer
+        :returns: Subscription
+        """
+
+        name = name or getattr(handler, "__name__", "subscriber")
+        subscription = Subscription(handler, name, maxsize, policy, timer, interval)
+        with self.lock:
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription, drain=True):
+        """Remove a subscriber, and stop its thread"""
+
+        with self.lock:
+            self.subscriptions = [other for other in self.subscriptions if other is not subscription]
+        subscription.close(drain)
+
+    # -------------------------------------------------------------------------
+    def publish(self, event):
+        """Queue an event for all subscribers. Only waits for subscribers with the "block" policy."""
+
+        for subscription in self.subscriptions:
+            subscription.offer(event)
+
+    # -------------------------------------------------------------------------
+    def stats(self) -> list:
+        """Return the stats() of every subscriber"""
+
+        return [subscription.stats() for subscription in self.subscriptions]
+
+    def close(self, drain=True):
+        """Stop all subscribers
+
+        :param drain: True to handle the queued events first, False to drop them
+        """
+
+        with self.lock:
+            subscriptions = self.subscriptions
+        for subscription in subscriptions:
+            subscription.close(drain)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,197 @@
+##
+# @file: info_fetcher.py
+# @brief: Parallel device info fetching
+
+"""Parallel device info fetching
+
+InfoFetcher runs a bounded number of 'bluetoothctl info' queries concurrently, each
+with its own deadline, and yields the results in the order they finish. One slow or
+vanished device only occupies one worker until its deadline.
+"""
+
+# global imports
+import statistics
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# local imports
+from command import run_command
+from bluetoothctl_session import BluetoothctlSession
+from lib.helper import debug
+
+# ok is False if there was no valid info before the deadline
+InfoResult = namedtuple("InfoResult", "addr info latency ok")
+
+
+# -----------------------------------------------------------------------------
+def process_fetch(addr, deadline) -> str:
+    """Get the info of a device with a new bluetoothctl process, killed at the deadline"""
+
+    return run_command(f"bluetoothctl info {addr}", timeout=deadline)
+
+
+# -----------------------------------------------------------------------------
+class SessionFetch:
+    """Get the info of a device through a BluetoothctlSession per worker thread
+
+    Starting a session counts against the deadline of the first fetch of the worker. A
+    session which does not answer before the deadline is killed, its late response would
+    be taken for the answer to the next query. The next fetch of that worker starts a new
+    session.
+    """
+
+    def __init__(self, program="bluetoothctl"):
+        self.program = program
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def __call__(self, addr, deadline) -> str:
+        start = time.monotonic()
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = BluetoothctlSession(self.program, timeout=deadline)
+            with self.lock:
+                self.sessions.append(session)
+            if not session.ready:
+                self._discard(session)
+                return ""
+            self.local.session = session
+        try:
+            info = session.info(addr, timeout=deadline - (time.monotonic() - start))
+        except Exception:
+            self._discard(session)
+            raise
+        if time.monotonic() - start >= deadline:
+            self._discard(session)
+        return info
+
+    def _discard(self, session):
+        """Kill a session which did not answer in time"""
+        self.local.session = None
+        with self.lock:
+            self.sessions.remove(session)
+        if session.process.poll() is None:
+            session.process.kill()
+            session.process.wait()
+        session.close()
+
+    def close(self):
+        """Close the sessions of all workers"""
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+
+
+# -----------------------------------------------------------------------------
+def is_valid_info(addr, info) -> bool:
+    """Test if info is a complete answer for this address
+
+    >>> is_valid_info("24:FC:E5:8F:AB:89", "Device 24:FC:E5:8F:AB:89 (public)\\n\\tName: x")
+    True
+
+    >>> is_valid_info("24:FC:E5:8F:AB:89", "Device 24:FC:E5:8F:AB:89 not available")
+    False
+    """
+
+    return bool(info) and info.lstrip().startswith(f"Device {addr} (")
+
+
+# -----------------------------------------------------------------------------
+class InfoFetcher:
+    """Fetch the info of many devices concurrently"""
+
+    def __init__(self, workers=8, deadline=5.0, fetch=None):
+        """
+        :param workers: Maximum number of concurrent info queries
+        :param deadline: Number of seconds a single query may take
+        :param fetch: function(addr, deadline) returning the info string. Default a SessionFetch.
+        """
+
+        self.workers = workers
+        self.deadline = deadline
+        self.fetch = SessionFetch() if fetch is None else fetch
+        self.latencies = {}  # latest latency in seconds, key is the address
+        self.failed = set()  # addresses without valid info in the last fetch
+
+    # -------------------------------------------------------------------------
+    def _fetch_one(self, addr) -> InfoResult:
+        start = time.perf_counter()
+        try:
+            info = self.fetch(addr, self.deadline)
+        except Exception as ex:
+            debug(f"info {addr} failed: {ex}")
+            info = ""
+        latency = time.perf_counter() - start
+        return InfoResult(addr, info, latency, is_valid_info(addr, info))
+
+    # -------------------------------------------------------------------------
+    def fetch_all(self, addresses):
+        """Fetch the info of all addresses, and yield each InfoResult as soon as it is finished
+
+        The sessions of a SessionFetch are closed when the last result has been yielded,
+        or when the caller stops early.
+
+        :param addresses: iterable of BT addresses
+        """
+
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = [executor.submit(self._fetch_one, addr) for addr in addresses]
+            for future in as_completed(futures):
+                result = future.result()
+                self.latencies[result.addr] = result.latency
+                if result.ok:
+                    self.failed.discard(result.addr)
+                else:
+                    self.failed.add(result.addr)
+                yield result
+        finally:
+            # If the caller stops early, drop the queries which have not started yet
+            executor.shutdown(cancel_futures=True)
+            # The worker threads have ended, nothing will use their sessions again
+            self.close()
+
+    # -------------------------------------------------------------------------
+    def stats(self) -> dict:
+        """Latency statistics, in seconds, of the latest query of every device"""
+
+        latencies = sorted(self.latencies.values())
+        if not latencies:
+            return {"devices": 0}
+        return {
+            "devices": len(latencies),
+            "failed": len(self.failed),
+            "min": latencies[0],
+            "mean": statistics.fmean(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+        }
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """Close the sessions of the default fetch function"""
+
+        if isinstance(self.fetch, SessionFetch):
+            self.fetch.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,199 @@
+##
+# @file: info_parser.py
+# @brief: Typed parser for 'bluetoothctl info' output
+
+"""Typed parser for 'bluetoothctl info' output
+
+parse_info() walks the text once and returns a DeviceInfo, with every property
+converted to its type: RSSI and TxPower to int, Paired/Trusted/... to bool, Class
+to int, UUIDs to a list and ManufacturerData/ServiceData to bytes.
+"""
+
+# global imports
+import re
+
+# Value of RSSI and TxPower, like '-62' or, by newer bluez versions, like '0xffffffc2 (-62)'
+INT_VALUE_RE = re.compile(r"\((-?\d+)\)$|^(-?\d+)$")
+# The UUID between the parentheses of 'Audio Source (0000110a-0000-1000-8000-00805f9b34fb)'
+UUID_RE = re.compile(r"\(([0-9a-fA-F-]+)\)$")
+
+
+# -----------------------------------------------------------------------------
+class DeviceInfo:
+    """Typed record of the info of one device"""
+
+    __slots__ = (
+        "addr", "addr_type", "name", "alias", "device_class", "icon",
+        "paired", "trusted", "blocked", "connected", "legacy_pairing",
+        "rssi", "txpower", "uuids", "modalias",
+        "manufacturer_data", "service_data", "other",
+    )
+
+    def __init__(self):
+        self.addr = ""
+        self.addr_type = ""  # "public" or "random"
+        self.name = ""
+        self.alias = ""
+        self.device_class = None  # int
+        self.icon = ""
+        self.paired = False
+        self.trusted = False
+        self.blocked = False
+        self.connected = False
+        self.legacy_pairing = False
+        self.rssi = None  # int
+        self.txpower = None  # int
+        self.uuids = []
+        self.modalias = ""
+        self.manufacturer_data = {}  # key is the company id (int), value is bytes
+        self.service_data = {}  # key is the service UUID, value is bytes
+        self.other = {}  # Properties without a field, as strings, or bytes for hex dumps
+
+    def as_dict(self) -> dict:
+        """Return the fields as a dictionary"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{field}={getattr(self, field)!r}" for field in self.__slots__ if getattr(self, field) not in ("", None, [], {}))
+        return f"DeviceInfo({fields})"
+
+
+# -----------------------------------------------------------------------------
+def parse_int(value):
+    """Convert an RSSI or TxPower value
+
+    >>> parse_int("-62"), parse_int("0xffffffc2 (-62)"), parse_int("unknown")
+    (-62, -62, None)
+    """
+
+    match = INT_VALUE_RE.search(value)
+    if not match:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+# -----------------------------------------------------------------------------
+def parse_hex(value) -> int:
+    """Convert a hex value like Class or the ManufacturerData Key, with or without
+    the decimal value which bluez adds
+
+    >>> parse_hex("0x000c043c"), parse_hex("0x000c043c (787516)"), parse_hex("0x0075 (117)")
+    (787516, 787516, 117)
+    """
+
+    return int(value.split()[0], 16)
+
+
+# -----------------------------------------------------------------------------
+def parse_uuid(value) -> str:
+    """Get the UUID out of an UUID property value
+
+    >>> parse_uuid("Audio Source              (0000110a-0000-1000-8000-00805f9b34fb)")
+    '0000110a-0000-1000-8000-00805f9b34fb'
+    """
+
+    match = UUID_RE.search(value)
+    return match.group(1) if match else value
+
+
+# Property name: (field, converter)
+SCALAR_PROPERTIES = {
+    "Name": ("name", str),
+    "Alias": ("alias", str),
+    "Class": ("device_class", parse_hex),
+    "Icon": ("icon", str),
+    "Paired": ("paired", lambda value: value == "yes"),
+    "Trusted": ("trusted", lambda value: value == "yes"),
+    "Blocked": ("blocked", lambda value: value == "yes"),
+    "Connected": ("connected", lambda value: value == "yes"),
+    "LegacyPairing": ("legacy_pairing", lambda value: value == "yes"),
+    "RSSI": ("rssi", parse_int),
+    "TxPower": ("txpower", parse_int),
+    "Modalias": ("modalias", str),
+}
+
+
+# -----------------------------------------------------------------------------
+def parse_info(text) -> DeviceInfo:
+    r"""Parse the output of 'bluetoothctl info {addr}' in one pass
+
+    :param text: The string to parse
+    :returns: DeviceInfo
+
+    >>> info = parse_info('''Device 23:A0:64:00:3A:F1 (random)
+    ...     Paired: no
+    ...     RSSI: -73
+    ...     ServiceData Key: 0000fd6f-0000-1000-8000-00805f9b34fb
+    ...     ServiceData Value:
+    ...   d7 e5 ea 9f                                      ....
+    ... ''')
+    >>> info.addr, info.addr_type, info.paired, info.rssi
+    ('23:A0:64:00:3A:F1', 'random', False, -73)
+    >>> info.service_data
+    {'0000fd6f-0000-1000-8000-00805f9b34fb': b'\xd7\xe5\xea\x9f'}
+    """
+
+    info = DeviceInfo()
+
+    data_key = None
+    data_dict = None
+    value = None  # bytearray while collecting hex dump lines
+
+    for line in text.splitlines():
+        if value is not None:
+            try:
+                value += bytes.fromhex(line.lstrip()[:47])
+                continue
+            except ValueError:
+                # End of the hex dump. A value without its Key line is skipped.
+                if data_key is not None:
+                    data_dict[data_key] = bytes(value)
+                data_key = None
+                value = None
+
+        line = line.strip()
+        key, _sep, val = line.partition(":")
+        val = val.strip()
+
+        prop = SCALAR_PROPERTIES.get(key)
+        if prop:
+            field, convert = prop
+            setattr(info, field, convert(val))
+        elif key == "UUID":
+            info.uuids.append(parse_uuid(val))
+        elif key == "ManufacturerData Key":
+            data_key = parse_hex(val)
+        elif key == "ServiceData Key":
+            data_key = val
+        elif key == "ManufacturerData Value":
+            data_dict = info.manufacturer_data
+            value = bytearray()
+        elif key == "ServiceData Value":
+            data_dict = info.service_data
+            value = bytearray()
+        elif line.startswith("Device "):
+            _dev, info.addr, *addr_type = line.split(" ", maxsplit=2)
+            info.addr_type = addr_type[0].strip("()") if addr_type else ""
+        elif line and not val:
+            # Another property with a hex dump, like 'AdvertisingFlags:'
+            data_dict = info.other
+            data_key = key
+            value = bytearray()
+        elif line:
+            info.other[key] = val
+
+    if value is not None and data_key is not None:
+        data_dict[data_key] = bytes(value)
+
+    return info
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
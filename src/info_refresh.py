@@ -0,0 +1,309 @@
+##
+# @file: info_refresh.py
+# @brief: Device info refresh scheduling with a priority heap
+
+"""Device info refresh scheduling with a priority heap
+
+Asking 'bluetoothctl info' for every known device on every run costs one query per
+device, while most of them did not change. RefreshScheduler spends a fixed budget of
+info queries per cycle on the devices most likely to have new data.
+
+Each device has a refresh interval: short for devices with a strong signal, and for
+devices whose info changed often in the past, long for weak and stable ones. The heap
+is keyed on the time the device is due, last refresh plus interval, so the devices
+which are the most overdue relative to their interval come first. Keying on the due
+time keeps the order valid while time passes, only a new RSSI or a refresh result
+changes the key of a device. Outdated heap entries are skipped when popped.
+
+A device which was never refreshed counts as max_interval old, so new devices come
+first, strongest signal first. freshness() reports how well the budget keeps up.
+
+Each scan run is a new process, so save() and load() keep the refresh history in a
+JSON file in between. The clock must then be the wall clock, time.time. Rotating random
+addresses come and go every few minutes, so a device which was not refreshed for the
+retention period is left out of the file.
+"""
+
+# global imports
+import heapq
+import json
+import time
+import zlib
+
+# Info lines which change on every query, and are already known from the scan
+VOLATILE_TAGS = ("RSSI:", "TxPower:")
+
+
+# -----------------------------------------------------------------------------
+def info_digest(info) -> int:
+    """Checksum of an info string, without the lines which change on every query
+
+    >>> info_digest("Device 24:FC:E5:8F:AB:89 (public)\\n\\tRSSI: -62") == info_digest("Device 24:FC:E5:8F:AB:89 (public)\\n\\tRSSI: -70")
+    True
+    """
+
+    lines = [line for line in info.splitlines() if not line.strip().startswith(VOLATILE_TAGS)]
+    return zlib.crc32("\n".join(lines).encode())
+
+
+# -----------------------------------------------------------------------------
+def signal_weight(rssi) -> float:
+    """Weight of the signal strength, from 0.1 at -100 dBm or weaker to 1.0 at -40 dBm or stronger
+
+    >>> signal_weight(-40), signal_weight(-70), signal_weight(None)
+    (1.0, 0.5, 0.5)
+    """
+
+    if rssi is None:
+        return 0.5
+    return min(1.0, max(0.1, (rssi + 100) / 60))
+
+
+# -----------------------------------------------------------------------------
+class RefreshState:
+    """Refresh bookkeeping of one device"""
+
+    __slots__ = ("rssi", "change_rate", "last_refresh", "digest", "interval", "version", "refreshes")
+
+    def __init__(self, rssi, last_refresh):
+        self.rssi = rssi
+        self.change_rate = 0.5  # running average of the fraction of refreshes with changed info
+        self.last_refresh = last_refresh
+        self.digest = None  # info_digest() of the latest info
+        self.interval = 0.0  # seconds
+        self.version = 0  # only the heap entry with this version is valid
+        self.refreshes = 0
+
+
+# -----------------------------------------------------------------------------
+class RefreshScheduler:
+    """Choose which devices get an info query in each cycle
+
+    >>> scheduler = RefreshScheduler(budget=2, clock=lambda: 0.0)
+    >>> for addr, rssi in (("D8:DD:6B:81:74:8B", -90), ("24:FC:E5:8F:AB:89", -50), ("00:7C:2D:E5:BE:D9", -70)):
+    ...     scheduler.add(addr, rssi)
+    >>> scheduler.next_batch()
+    ['24:FC:E5:8F:AB:89', '00:7C:2D:E5:BE:D9']
+    >>> scheduler.done("24:FC:E5:8F:AB:89", "Device 24:FC:E5:8F:AB:89 (public)")
+    False
+    >>> scheduler.done("00:7C:2D:E5:BE:D9", "Device 00:7C:2D:E5:BE:D9 (public)")
+    False
+    >>> scheduler.next_batch()
+    ['D8:DD:6B:81:74:8B', '24:FC:E5:8F:AB:89']
+    """
+
+    def __init__(self, budget=16, base_interval=60.0, min_interval=5.0, max_interval=3600.0,
+                 change_floor=0.1, alpha=0.3, retention=None, clock=time.monotonic):
+        """
+        :param budget: Number of info queries per cycle
+        :param base_interval: Refresh interval in seconds of a device with a strong signal, which always changes
+        :param min_interval: Shortest refresh interval in seconds
+        :param max_interval: Longest refresh interval in seconds, also the assumed age of new devices
+        :param change_floor: Added to the change rate, so that stable devices are still refreshed
+        :param alpha: Weight of the latest refresh in the running average of the change rate
+        :param retention: Seconds after its last refresh that save() forgets a device, default 24 max_intervals
+        :param clock: function returning the current time in seconds
+        """
+
+        self.budget = budget
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.change_floor = change_floor
+        self.alpha = alpha
+        self.retention = 24 * max_interval if retention is None else retention
+        self.clock = clock
+
+        self.devices = {}  # key is the address, value is RefreshState
+        self.heap = []  # entries of (due time, addr, version)
+        self.queries = 0
+        self.changes = 0
+
+    # -------------------------------------------------------------------------
+    def _interval(self, state) -> float:
+        weight = signal_weight(state.rssi) * (self.change_floor + state.change_rate)
+        return min(self.max_interval, max(self.min_interval, self.base_interval / weight))
+
+    def _push(self, addr, state, due=None):
+        """Set the interval of a device, and add its heap entry. Older entries become invalid.
+
+        :param due: Time of the next refresh, default the last refresh plus the interval
+        """
+
+        state.interval = self._interval(state)
+        state.version += 1
+        if due is None:
+            due = state.last_refresh + state.interval
+        heapq.heappush(self.heap, (due, addr, state.version))
+        if len(self.heap) > 2 * len(self.devices) + 64:
+            self._compact()
+
+    def _compact(self):
+        """Drop the invalid heap entries"""
+
+        self.heap = [entry for entry in self.heap
+                     if entry[1] in self.devices and self.devices[entry[1]].version == entry[2]]
+        heapq.heapify(self.heap)
+
+    # -------------------------------------------------------------------------
+    def add(self, addr, rssi=None, now=None):
+        """Add a device, or update the signal strength of a known device
+
+        :param addr: The BT address
+        :param rssi: The latest RSSI of the device, None if unknown
+        :param now: The current time, default clock()
+        """
+
+        state = self.devices.get(addr)
+        if state is None:
+            if now is None:
+                now = self.clock()
+            state = self.devices[addr] = RefreshState(rssi, now - self.max_interval)
+            self._push(addr, state)
+        elif rssi is not None and rssi != state.rssi:
+            state.rssi = rssi
+            if self._interval(state) != state.interval:
+                self._push(addr, state)
+
+    def remove(self, addr):
+        """Forget a device. Its heap entry is dropped when it is popped."""
+
+        self.devices.pop(addr, None)
+
+    # -------------------------------------------------------------------------
+    def next_batch(self, budget=None, present=None) -> list:
+        """Take the devices to query in this cycle, most overdue first
+
+        The devices are out of the heap until done() is called for them.
+
+        :param budget: Number of devices, default the budget of the scheduler
+        :param present: Optional collection of addresses, only these devices are taken.
+                        The others keep their place in the heap.
+        :returns: list of addresses
+        """
+
+        budget = self.budget if budget is None else budget
+        batch = []
+        absent = []
+        while self.heap and len(batch) < budget:
+            entry = heapq.heappop(self.heap)
+            _due, addr, version = entry
+            state = self.devices.get(addr)
+            if state is None or state.version != version:
+                continue
+            if present is not None and addr not in present:
+                absent.append(entry)
+            else:
+                batch.append(addr)
+        for entry in absent:
+            heapq.heappush(self.heap, entry)
+        return batch
+
+    # -------------------------------------------------------------------------
+    def done(self, addr, info, now=None) -> bool:
+        """Report the result of an info query, and schedule the next refresh of the device
+
+        :param addr: The BT address
+        :param info: The info string, or None if the query failed
+        :param now: Time of the query, default clock()
+        :returns: True if the info changed since the previous refresh
+        """
+
+        state = self.devices.get(addr)
+        if state is None:
+            return False
+        if now is None:
+            now = self.clock()
+        self.queries += 1
+
+        if not info:
+            # Try again after the shortest interval, without counting it as fresh
+            self._push(addr, state, now + self.min_interval)
+            return False
+
+        digest = info_digest(info)
+        changed = state.digest is not None and digest != state.digest
+        state.change_rate += self.alpha * (changed - state.change_rate)
+        state.digest = digest
+        state.last_refresh = now
+        state.refreshes += 1
+        self.changes += changed
+        self._push(addr, state)
+        return changed
+
+
+    # -------------------------------------------------------------------------
+    def freshness(self, now=None) -> dict:
+        """Report how fresh the info of the devices is
+
+        :param now: The current time, default clock()
+        :returns: dict with the mean and max age in seconds of the refreshed devices, the
+                  fraction of devices refreshed within their interval, and the query counters
+        """
+
+        if now is None:
+            now = self.clock()
+        ages = [now - state.last_refresh for state in self.devices.values() if state.refreshes]
+        fresh = sum(1 for state in self.devices.values() if state.refreshes and now - state.last_refresh <= state.interval)
+        return {
+            "devices": len(self.devices),
+            "never_refreshed": len(self.devices) - len(ages),
+            "fresh": fresh / len(self.devices) if self.devices else 1.0,
+            "mean_age": sum(ages) / len(ages) if ages else 0.0,
+            "max_age": max(ages, default=0.0),
+            "queries": self.queries,
+            "changes": self.changes,
+        }
+
+    def __len__(self):
+        return len(self.devices)
+
+    # -------------------------------------------------------------------------
+    def save(self, filename, now=None):
+        """Write the refresh history of the devices to a JSON file, without the expired devices
+
+        :param now: The current time, default clock()
+        """
+
+        if now is None:
+            now = self.clock()
+        devices = {addr: [state.rssi, state.change_rate, state.last_refresh, state.digest, state.refreshes]
+                   for addr, state in self.devices.items() if now - state.last_refresh <= self.retention}
+        with open(filename, "w") as fh:
+            json.dump({"devices": devices}, fh)
+
+    def load(self, filename, now=None) -> bool:
+        """Add the refresh history of a save() file. Known devices keep their state, expired ones are skipped.
+
+        :param now: The current time, default clock()
+        :returns: False if there is no history, because the file does not exist or is unreadable
+        """
+
+        try:
+            with open(filename) as fh:
+                devices = json.load(fh)["devices"]
+        except (OSError, ValueError, KeyError):
+            return False
+
+        if now is None:
+            now = self.clock()
+        for addr, (rssi, change_rate, last_refresh, digest, refreshes) in devices.items():
+            if addr in self.devices or now - last_refresh > self.retention:
+                continue
+            state = self.devices[addr] = RefreshState(rssi, last_refresh)
+            state.change_rate = change_rate
+            state.digest = digest
+            state.refreshes = refreshes
+            self._push(addr, state)
+        return bool(devices)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -120,6 +120,27 @@ class IteratorWithPushback():
             self.pushed_back.append(element)
 
 
+# -----------------------------------------------------------------------------
+def addr_to_int(addr) -> int:
+    """Convert a BT address string to an integer
+
+    >>> addr_to_int("24:FC:E5:8F:AB:89")
+    40668601756553
+    """
+    return int(addr.replace(":", ""), 16)
+
+
+# -----------------------------------------------------------------------------
+def int_to_addr(value) -> str:
+    """Convert an integer to a BT address string
+
+    >>> int_to_addr(40668601756553)
+    '24:FC:E5:8F:AB:89'
+    """
+    s = f"{value:012X}"
+    return f"{s[0:2]}:{s[2:4]}:{s[4:6]}:{s[6:8]}:{s[8:10]}:{s[10:12]}"
+
+
 # -----------------------------------------------------------------------------
 def print_header(header):
     """Print an underlined header
@@ -0,0 +1,216 @@
+##
+# @file: multi_scan.py
+# @brief: Concurrent scanning with every Bluetooth adapter
+
+"""Concurrent scanning with every Bluetooth adapter
+
+MultiAdapterScanner runs one scan worker per adapter, each with its own bluetoothctl
+session which has selected that adapter. The workers put the scan lines in one queue,
+and scan() merges them into a single stream of AdapterEvents, tagged with the index
+of the adapter which saw them. A device which is seen by several adapters is only
+reported as new once. Per adapter, AdapterStats counts the events and devices, to show
+how the coverage grows with every USB dongle which is added.
+"""
+
+# global imports
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+
+# local imports
+from bluetoothctl_session import BluetoothctlSession
+from lib.helper import debug
+
+# A line of 'bluetoothctl list', like 'Controller B8:27:EB:6D:21:BE raspberrypi [default]'
+CONTROLLER_RE = re.compile(r"^Controller ((?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}) ?(.*?)(?: \[default\])?$", re.MULTILINE)
+
+# adapter is the index in MultiAdapterScanner.controllers, event is what parse() made of the line
+AdapterEvent = namedtuple("AdapterEvent", "adapter event")
+
+# Maximum number of seconds between the checks of MultiAdapterScanner.stop, when the adapters are quiet
+STOP_INTERVAL = 0.5
+# Number of seconds after the duration to wait for a worker to finish
+WORKER_GRACE = 5.0
+
+
+# -----------------------------------------------------------------------------
+def list_controllers(program="bluetoothctl") -> list:
+    """Return the addresses of all adapters, with the output of 'bluetoothctl list'
+
+    :param program: The bluetoothctl command line
+    """
+
+    with BluetoothctlSession(program) as session:
+        return parse_controllers(session.command("list"))
+
+
+def parse_controllers(text) -> list:
+    """Get the controller addresses out of the output of 'bluetoothctl list'
+
+    >>> parse_controllers("Controller B8:27:EB:6D:21:BE raspberrypi [default]\\nController 00:1A:7D:DA:71:13 dongle")
+    ['B8:27:EB:6D:21:BE', '00:1A:7D:DA:71:13']
+    """
+
+    return [addr for addr, _name in CONTROLLER_RE.findall(text)]
+
+
+# -----------------------------------------------------------------------------
+class AdapterStats:
+    """Throughput counters of one adapter"""
+
+    __slots__ = ("controller", "lines", "events", "devices", "new_devices", "elapsed")
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.lines = 0  # scan lines received
+        self.events = 0  # device events
+        self.devices = set()  # addresses seen by this adapter
+        self.new_devices = 0  # devices which this adapter saw first
+        self.elapsed = 0.0  # seconds of scanning
+
+    def as_dict(self) -> dict:
+        return {
+            "controller": self.controller,
+            "lines": self.lines,
+            "events": self.events,
+            "devices": len(self.devices),
+            "new_devices": self.new_devices,
+            "events_per_s": self.events / self.elapsed if self.elapsed else 0.0,
+        }
+
+
+# -----------------------------------------------------------------------------
+class MultiAdapterScanner:
+    """Scan with several adapters at the same time, and merge the results"""
+
+    def __init__(self, controllers=None, program="bluetoothctl", parse=None):
+        """
+        :param controllers: Addresses of the adapters to use, default all of them
+        :param program: The bluetoothctl command line
+        :param parse: function(line) returning an event with addr and kind attributes, or None
+        """
+
+        self.program = program
+        self.controllers = list_controllers(program) if controllers is None else list(controllers)
+        self.parse = parse
+        self.stats = [AdapterStats(controller) for controller in self.controllers]
+        self.seen_by = {}  # key is the address, value is the set of adapter indexes
+        self.stop = threading.Event()
+
+    # -------------------------------------------------------------------------
+    def _worker(self, adapter, duration, lines):
+        """Scan with one adapter, and put (adapter, line) in the queue. (adapter, None) marks the end."""
+
+        start = time.monotonic()
+        end = start + duration
+        try:
+            with BluetoothctlSession(self.program) as session:
+                session.command(f"select {self.controllers[adapter]}")
+                session.scan("on")
+                try:
+                    # Read in slices, to see stop also when the adapter is quiet
+                    while not self.stop.is_set() and session.process.poll() is None:
+                        remaining = end - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        for line in session.read_events(min(remaining, STOP_INTERVAL)):
+                            lines.put((adapter, line))
+                            if self.stop.is_set():
+                                break
+                finally:
+                    session.scan("off")
+        except Exception as ex:
+            debug(f"Scan with {self.controllers[adapter]} failed: {ex}")
+        finally:
+            self.stats[adapter].elapsed += time.monotonic() - start
+            lines.put((adapter, None))
+
+    # -------------------------------------------------------------------------
+    def scan(self, duration, recorder=None):
+        """Scan with all adapters for duration seconds
+
+        Setting self.stop ends the scan early, within STOP_INTERVAL seconds.
+
+        :param duration: Number of seconds to scan
+        :param recorder: Optional CaptureWriter, to record the raw scan output, with the
+                         source "scan:{adapter}"
+        :returns: generator of AdapterEvent, in order of arrival
+        """
+
+        lines = queue.Queue()
+        self.stop.clear()
+        end = time.monotonic() + duration
+        workers = [
+            threading.Thread(target=self._worker, args=(adapter, duration, lines), daemon=True)
+            for adapter in range(len(self.controllers))
+        ]
+        for worker in workers:
+            worker.start()
+
+        running = len(workers)
+        try:
+            while running:
+                try:
+                    adapter, line = lines.get(timeout=STOP_INTERVAL)
+                except queue.Empty:
+                    if self.stop.is_set():
+                        break
+                    if time.monotonic() > end + WORKER_GRACE:
+                        debug(f"{running} scan workers did not finish")
+                        break
+                    continue
+                if line is None:
+                    running -= 1
+                    continue
+                self.stats[adapter].lines += 1
+                if recorder:
+                    recorder.write(f"scan:{adapter}", line)
+                event = self.parse(line) if self.parse else None
+                if event is None:
+                    continue
+                if self._merge(adapter, event):
+                    yield AdapterEvent(adapter, event)
+        finally:
+            self.stop.set()
+
+    def _merge(self, adapter, event) -> bool:
+        """Update the counters with an event
+
+        :returns: False if the event is a duplicate from another adapter
+        """
+
+        stats = self.stats[adapter]
+        stats.events += 1
+        stats.devices.add(event.addr)
+
+        adapters = self.seen_by.get(event.addr)
+        if adapters is None:
+            adapters = self.seen_by[event.addr] = set()
+            stats.new_devices += 1
+        known = bool(adapters)
+
+        if event.kind == "DEL":
+            # Only gone when no adapter sees it anymore
+            adapters.discard(adapter)
+            return not adapters
+        adapters.add(adapter)
+        return not (event.kind == "NEW" and known)
+
+    # -------------------------------------------------------------------------
+    def coverage(self) -> int:
+        """Number of different devices seen by all adapters together"""
+
+        return len(self.seen_by)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,180 @@
+##
+# @file: ndjson_output.py
+# @brief: Streaming NDJSON output, one compact JSON record per line
+
+"""Streaming NDJSON output, one compact JSON record per line
+
+With '--format ndjson' the scanners write their results as newline delimited JSON to
+stdout, for downstream tools, instead of the human-readable blocks. Every record is a
+dict with a "type" key, like {"type":"scan",...} or {"type":"device",...}.
+
+NdjsonWriter encodes each record on write(), but collects the lines and writes them to
+the binary stdout in one call per batch, followed by a flush. A batch ends after
+batch_size records, after flush_interval seconds, or when the caller knows that no more
+records are coming soon, see flush(). So a live scan shows up in the pipe at once,
+while a fast replay does not pay a write and a flush per record.
+
+The records are encoded with orjson if it is installed, else with the compact
+separators of the standard json module. jsonable() converts the values which JSON does
+not know: bytes become a hex string, namedtuples become a dict.
+"""
+
+# global imports
+import io
+import json
+import os
+import sys
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# -----------------------------------------------------------------------------
+def jsonable(value):
+    """Convert a value into one which every JSON encoder accepts
+
+    >>> jsonable({0x75: b"\\x42\\x04", "uuid": ("fd6f",)})
+    {'117': '4204', 'uuid': ['fd6f']}
+    """
+
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, dict):
+        return {key if isinstance(key, str) else str(key): jsonable(item) for key, item in value.items()}
+    if isinstance(value, tuple) and hasattr(value, "_asdict"):
+        return {key: jsonable(item) for key, item in value._asdict().items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [jsonable(item) for item in value]
+    return str(value)
+
+
+# -----------------------------------------------------------------------------
+if orjson is not None:
+    ENCODER = "orjson"
+
+    def encode(record) -> bytes:
+        """Encode a record as one line of compact JSON, without the newline
+
+        >>> encode({"type": "device", "addr": "D8:DD:6B:81:74:8B", "rssi": -60})
+        b'{"type":"device","addr":"D8:DD:6B:81:74:8B","rssi":-60}'
+        """
+        return orjson.dumps(record, default=jsonable)
+
+else:
+    ENCODER = "json"
+    _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=jsonable)
+
+    def encode(record) -> bytes:
+        """Encode a record as one line of compact JSON, without the newline
+
+        >>> encode({"type": "device", "addr": "D8:DD:6B:81:74:8B", "rssi": -60})
+        b'{"type":"device","addr":"D8:DD:6B:81:74:8B","rssi":-60}'
+        """
+        return _encoder.encode(record).encode()
+
+
+# -----------------------------------------------------------------------------
+class NdjsonWriter:
+    """Write records as NDJSON, in batches
+
+    Not thread safe, use it from one thread at a time.
+
+    >>> stream = io.BytesIO()
+    >>> with NdjsonWriter(stream, batch_size=2) as writer:
+    ...     for rssi in (-60, -61, -62):
+    ...         writer.write({"type": "scan", "rssi": rssi})
+    ...     writer.flushes
+    1
+    >>> print(stream.getvalue().decode(), end="")
+    {"type":"scan","rssi":-60}
+    {"type":"scan","rssi":-61}
+    {"type":"scan","rssi":-62}
+    """
+
+    def __init__(self, stream=None, batch_size=512, flush_interval=0.2, clock=time.monotonic):
+        """
+        :param stream: Binary or text stream, default sys.stdout. A text stream with a
+                       binary buffer, like sys.stdout, is written through its buffer.
+        :param batch_size: Maximum number of records per write
+        :param flush_interval: Maximum number of seconds a record waits for its batch
+        :param clock: function returning the current time in seconds
+        """
+
+        stream = sys.stdout if stream is None else stream
+        self.stream = getattr(stream, "buffer", stream)
+        self.text = isinstance(self.stream, io.TextIOBase)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        self.lines = []
+        self.batch_start = 0.0
+        self.written = 0
+        self.flushes = 0
+        self.broken = False  # the reader closed the pipe
+
+    # -------------------------------------------------------------------------
+    def write(self, record):
+        """Add a record to the batch, and write the batch if it is full or old enough
+
+        :param record: dict, with values which encode() accepts
+        """
+
+        if self.broken:
+            return
+        if not self.lines:
+            self.batch_start = self.clock()
+        self.lines.append(encode(record))
+        self.written += 1
+        if len(self.lines) >= self.batch_size or self.clock() - self.batch_start >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the batch, and flush the stream"""
+
+        if not self.lines or self.broken:
+            return
+        self.lines.append(b"")
+        data = b"\n".join(self.lines)
+        self.lines.clear()
+        try:
+            self.stream.write(data.decode() if self.text else data)
+            self.stream.flush()
+        except BrokenPipeError:
+            # Like 'head': the reader is done. Point the stream at devnull, so that the
+            # flush at exit does not fail again.
+            self.broken = True
+            try:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, self.stream.fileno())
+                os.close(devnull)
+            except (AttributeError, OSError, ValueError):
+                pass
+            return
+        self.flushes += 1
+
+    def close(self):
+        """Write the last batch"""
+
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,240 @@
+##
+# @file: parser_benchmarks.py
+# @brief: Benchmark suite of the scan output parsers
+
+"""Benchmark suite of the scan output parsers
+
+bench_parsers() measures the speed and peak memory of the bluetoothctl, lescan and
+sdptool parsers on synthetic corpora of several sizes, made from the sample strings of
+the parsers. It is the "parsers" benchmark of benchmarks.py, which writes the results
+to JSON with '--json', and compares them with an earlier run with '--compare'.
+"""
+
+# global imports
+import time
+import tracemalloc
+
+# local imports
+from lib.helper import print_header
+from lib.helper import int_to_addr
+import py_bluetoothctl_scan
+import btle_scan
+from device_registry import DeviceRegistry
+from address_clusters import AddressClusters
+
+try:
+    import btcommon
+except ImportError:
+    # btcommon needs the pybluez package
+    btcommon = None
+
+
+# -----------------------------------------------------------------------------
+def with_address(text, old, new) -> str:
+    """Replace an address in a sample string, also in the 'AA-BB-..' form of unnamed devices
+
+    >>> with_address("Device 47:B6:7A:81:C4:BC 47-B6-7A-81-C4-BC", "47:B6:7A:81:C4:BC", "00:00:00:00:00:01")
+    'Device 00:00:00:00:00:01 00-00-00-00-00-01'
+    """
+
+    return text.replace(old, new).replace(old.replace(":", "-"), new.replace(":", "-"))
+
+
+# -----------------------------------------------------------------------------
+def devices_corpus(size) -> str:
+    """'bluetoothctl devices' output with size devices, cycling the sample lines
+
+    >>> devices_corpus(2).splitlines()
+    ['Device 00:00:00:00:00:00 00-00-00-00-00-00', 'Device 00:00:00:00:00:01 Hue Lamp']
+    """
+
+    samples = py_bluetoothctl_scan.sampleoutput_bluetoothctl_devices.strip().splitlines()
+    return "".join(with_address(samples[i % len(samples)], samples[i % len(samples)][7:24], addr) + "\n"
+                   for i, addr in enumerate(map(int_to_addr, range(size))))
+
+
+# -----------------------------------------------------------------------------
+def info_corpus(size) -> list:
+    """size 'bluetoothctl info' strings, cycling the sample infos
+
+    >>> [info.split()[1] for info in info_corpus(2)]
+    ['00:00:00:00:00:00', '00:00:00:00:00:01']
+    """
+
+    samples = (py_bluetoothctl_scan.sampleoutput_bluetoothctl_info
+               + [py_bluetoothctl_scan.test_info_servicedata, py_bluetoothctl_scan.test_info_manufdata])
+    samples = [sample.strip() + "\n" for sample in samples]
+    return [with_address(samples[i % len(samples)], samples[i % len(samples)].split()[1], addr)
+            for i, addr in enumerate(map(int_to_addr, range(size)))]
+
+
+# -----------------------------------------------------------------------------
+def lescan_corpus(size) -> str:
+    """'hcitool lescan' output with size devices, each first without name, like the sample,
+    and every fourth one without a name at all
+
+    >>> lescan_corpus(2).splitlines()[1:]
+    ['00:00:00:00:00:00 (unknown)', '00:00:00:00:00:00 Hue Lamp', '00:00:00:00:00:01 (unknown)', '00:00:00:00:00:01 Hue Lamp']
+    """
+
+    names = [line.split(" ", 1)[1] for line in btle_scan.sample_output.splitlines()[1:]]
+    names = [name for name in names if name != "(unknown)"] + [None]
+    lines = ["LE Scan ..."]
+    for i, addr in enumerate(map(int_to_addr, range(size))):
+        lines.append(f"{addr} (unknown)")
+        if names[i % len(names)]:
+            lines.append(f"{addr} {names[i % len(names)]}")
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------------------------------
+def inq_corpus(size) -> str:
+    """'sdptool records' output with size service records, cycling the sample records"""
+
+    samples = btcommon.records_sample_data.strip().split("\n\n")
+    return "\n\n".join(samples[i % len(samples)] for i in range(size)) + "\n\n"
+
+
+# -----------------------------------------------------------------------------
+def process_devices_fresh(data):
+    """process_devices() into an empty registry, as on the first scan, so that the runs do not share devices"""
+
+    saved = py_bluetoothctl_scan.registry, py_bluetoothctl_scan.bt_devices, py_bluetoothctl_scan.clusters
+    py_bluetoothctl_scan.registry = DeviceRegistry()
+    py_bluetoothctl_scan.bt_devices = py_bluetoothctl_scan.registry.devices
+    py_bluetoothctl_scan.clusters = AddressClusters()
+    try:
+        return py_bluetoothctl_scan.process_devices(data)
+    finally:
+        py_bluetoothctl_scan.registry, py_bluetoothctl_scan.bt_devices, py_bluetoothctl_scan.clusters = saved
+
+
+# -----------------------------------------------------------------------------
+def parser_suite() -> dict:
+    """The parsers of the suite
+
+    :returns: dict, key is the parser name, value is a tuple of (corpus function, parse function)
+    """
+
+    suite = {
+        "get_mac_addresses": (devices_corpus, py_bluetoothctl_scan.get_mac_addresses),
+        "process_devices": (devices_corpus, process_devices_fresh),
+        "process_device_info": (info_corpus, lambda infos: [py_bluetoothctl_scan.process_device_info(info)
+                                                            for info in infos]),
+        "get_special_data": (info_corpus, lambda infos: [
+            py_bluetoothctl_scan.get_special_data(info, "ManufacturerData Key:", "ManufacturerData Value:")
+            for info in infos]),
+        "process_le_scan": (lescan_corpus, btle_scan.process_le_scan),
+    }
+    if btcommon is not None:
+        suite["parse_inq"] = (inq_corpus, lambda data: btcommon.parse_inq(data, "00:00:00:00:00:00"))
+    return suite
+
+
+# -----------------------------------------------------------------------------
+def measure(parse, corpus, records, min_time=0.2, rounds=5) -> dict:
+    """Call parse(corpus) for at least min_time seconds, then once more to trace the memory
+
+    The time is split into rounds, and the fastest round counts, like timeit does, so that
+    other load on the machine makes less noise in the comparison of two versions.
+
+    :param records: Number of devices or service records in the corpus
+    :param rounds: Number of rounds
+    :returns: dict with the calls and records per second, and the peak of the traced memory in KiB
+    """
+
+    best = 0.0
+    for _round in range(rounds):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            parse(corpus)
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / rounds:
+                break
+        best = max(best, calls / elapsed)
+
+    tracemalloc.start()
+    parse(corpus)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "records": records,
+        "ops_per_s": best,
+        "records_per_s": records * best,
+        "peak_kib": peak / 1024,
+    }
+
+
+# -----------------------------------------------------------------------------
+def bench_parsers(sizes=(10, 100, 1000, 10_000), min_time=0.2):
+    """Speed and peak memory of the bluetoothctl, lescan and sdptool parsers, on synthetic corpora
+
+    Write the results with 'python benchmarks.py --json FILE parsers', and compare them with
+    the results of another version with '--compare OLD_FILE'.
+
+    :param sizes: Numbers of devices or service records per corpus
+    :param min_time: Minimum number of seconds to call each parser per size
+    :returns: dict, key is the parser name, value is a dict of size and measure() result
+    """
+
+    results = {}
+    print_header(f"Parsers, corpora of {', '.join(str(size) for size in sizes)} records")
+    if btcommon is None:
+        print("btcommon needs pybluez, parse_inq skipped")
+    for name, (make_corpus, parse) in parser_suite().items():
+        results[name] = {}
+        for size in sizes:
+            corpus = make_corpus(size)
+            results[name][str(size)] = result = measure(parse, corpus, size, min_time)
+            print(f"{name:20} {size:7} records {result['ops_per_s']:12,.1f} ops/s "
+                  f"{result['records_per_s']:12,.0f} records/s  peak {result['peak_kib']:10,.1f} KiB")
+    return results
+
+
+# -----------------------------------------------------------------------------
+def compare_parsers(old, new) -> list:
+    """Compare two bench_parsers() results, e.g. of two versions
+
+    >>> old = {"get_mac_addresses": {"100": {"ops_per_s": 1000.0, "peak_kib": 10.0}}}
+    >>> new = {"get_mac_addresses": {"100": {"ops_per_s": 500.0, "peak_kib": 12.5}}}
+    >>> compare_parsers(old, new)
+    [('get_mac_addresses', '100', -0.5, 0.25)]
+
+    :returns: list of (parser, size, relative change of the ops/s, relative change of the peak memory)
+    """
+
+    changes = []
+    for name, sizes in new.items():
+        for size, result in sizes.items():
+            before = old.get(name, {}).get(size)
+            if before and before["ops_per_s"] and before["peak_kib"]:
+                changes.append((name, size, result["ops_per_s"] / before["ops_per_s"] - 1,
+                                result["peak_kib"] / before["peak_kib"] - 1))
+    return changes
+
+
+# -----------------------------------------------------------------------------
+def print_comparison(changes, threshold=0.2):
+    """Print the compare_parsers() changes, marking those beyond the threshold
+
+    The default threshold is above the run to run noise of a small single core machine.
+    """
+
+    print_header("Parsers compared with the earlier results")
+    for name, size, speed, memory in changes:
+        mark = "  <-- slower" if speed < -threshold else "  <-- more memory" if memory > threshold else ""
+        print(f"{name:20} {size:>7} records  ops/s {speed:+7.1%}  peak {memory:+7.1%}{mark}")
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,211 @@
+##
+# @file: presence.py
+# @brief: Presence detection with a hierarchical timing wheel
+
+"""Presence detection with a hierarchical timing wheel
+
+PresenceTracker turns sightings into "arrive" and "depart" events. Instead of checking
+the last seen time of every device on every tick, each device has one timer in a
+TimingWheel. A sighting only updates the last seen time of the device, which is O(1).
+When the timer of a device expires, the device has departed, unless it was seen in
+the meantime: then the timer is set again, to the new deadline. So a device which
+stays present costs one timer per departure timeout, and a tick only touches the
+timers which expire in it.
+
+Hysteresis: a device arrives after arrive_sightings sightings, and departs after it
+was not seen for depart_after seconds.
+"""
+
+# global imports
+import time
+from collections import namedtuple
+
+# kind is "arrive" or "depart"
+PresenceEvent = namedtuple("PresenceEvent", "kind addr time")
+
+
+# -----------------------------------------------------------------------------
+class TimingWheel:
+    """Hierarchical timing wheel with integer ticks
+
+    Level 0 has a bucket for each of the next slots ticks, level 1 a bucket for each of
+    the next slots * slots ticks, and so on. When level 0 has gone round, the next bucket
+    of level 1 is moved down (cascaded) into level 0.
+
+    >>> wheel = TimingWheel(slots=4, levels=3)
+    >>> for tick in (3, 9, 20, 70):
+    ...     wheel.schedule(f"t{tick}", tick)
+    >>> wheel.advance(10), wheel.advance(20), wheel.advance(100)
+    (['t3', 't9'], ['t20'], ['t70'])
+    """
+
+    def __init__(self, slots=256, levels=4, now=0):
+        """
+        :param slots: Number of buckets per level
+        :param levels: Number of levels. Timers beyond slots ** levels ticks are cascaded more than once.
+        :param now: The current tick
+        """
+
+        self.slots = slots
+        self.wheels = [[[] for _slot in range(slots)] for _level in range(levels)]
+        self.now = now
+        self.count = 0  # number of scheduled timers
+
+    # -------------------------------------------------------------------------
+    def schedule(self, item, tick):
+        """Add a timer, which expires at tick. A tick in the past expires at the next advance()."""
+
+        tick = max(tick, self.now + 1)
+        delta = tick - self.now
+        level = 0
+        span = self.slots
+        while delta >= span and level < len(self.wheels) - 1:
+            level += 1
+            span *= self.slots
+        bucket = (tick // (span // self.slots)) % self.slots
+        self.wheels[level][bucket].append((tick, item))
+        self.count += 1
+
+    # -------------------------------------------------------------------------
+    def advance(self, tick) -> list:
+        """Move the wheel to tick
+
+        :returns: list of the items of the timers which expired, in order of expiry
+        """
+
+        expired = []
+        slots = self.slots
+        while self.now < tick:
+            self.now += 1
+
+            # Cascade the higher levels which went round, from the top down
+            span = slots ** (len(self.wheels) - 1)
+            for level in range(len(self.wheels) - 1, 0, -1):
+                if self.now % span == 0:
+                    bucket = (self.now // span) % slots
+                    timers = self.wheels[level][bucket]
+                    if timers:
+                        self.wheels[level][bucket] = []
+                        self.count -= len(timers)
+                        for timer_tick, item in timers:
+                            if timer_tick == self.now:
+                                expired.append(item)
+                            else:
+                                self.schedule(item, timer_tick)
+                span //= slots
+
+            bucket = self.now % slots
+            timers = self.wheels[0][bucket]
+            if timers:
+                self.wheels[0][bucket] = []
+                self.count -= len(timers)
+                expired.extend(item for _tick, item in timers)
+        return expired
+
+    def __len__(self):
+        return self.count
+
+
+# -----------------------------------------------------------------------------
+class PresenceTracker:
+    """Arrive and depart events of devices, from their sightings
+
+    >>> tracker = PresenceTracker(depart_after=10, arrive_sightings=2, clock=lambda: 0.0)
+    >>> tracker.sighting("D8:DD:6B:81:74:8B", now=0.0) is None
+    True
+    >>> tracker.sighting("D8:DD:6B:81:74:8B", now=1.0)
+    PresenceEvent(kind='arrive', addr='D8:DD:6B:81:74:8B', time=1.0)
+    >>> tracker.tick(now=10.0)
+    []
+    >>> tracker.tick(now=11.0)
+    [PresenceEvent(kind='depart', addr='D8:DD:6B:81:74:8B', time=11.0)]
+    """
+
+    def __init__(self, depart_after=30.0, arrive_sightings=2, resolution=1.0, clock=time.monotonic):
+        """
+        :param depart_after: Number of seconds without sightings before a device departs
+        :param arrive_sightings: Number of sightings before a device arrives
+        :param resolution: Number of seconds per tick of the timing wheel
+        :param clock: function returning the current time in seconds
+        """
+
+        self.arrive_sightings = arrive_sightings
+        self.resolution = resolution
+        self.depart_ticks = max(1, round(depart_after / resolution))
+        self.clock = clock
+        self.wheel = TimingWheel(now=self._tick_of(clock()))
+        # key is the address, value is [last seen tick, number of sightings, present]
+        self.devices = {}
+
+    def _tick_of(self, now) -> int:
+        return int(now // self.resolution)
+
+    # -------------------------------------------------------------------------
+    def sighting(self, addr, now=None):
+        """Register a sighting of a device
+
+        :param addr: The BT address
+        :param now: Time of the sighting, default clock()
+        :returns: PresenceEvent if the device arrived, else None
+        """
+
+        if now is None:
+            now = self.clock()
+        tick = self._tick_of(now)
+        state = self.devices.get(addr)
+        if state is None:
+            state = [tick, 0, False]
+            self.devices[addr] = state
+            self.wheel.schedule(addr, tick + self.depart_ticks)
+        state[0] = tick
+        state[1] += 1
+        if not state[2] and state[1] >= self.arrive_sightings:
+            state[2] = True
+            return PresenceEvent("arrive", addr, now)
+        return None
+
+    # -------------------------------------------------------------------------
+    def tick(self, now=None) -> list:
+        """Advance the time, and find the departed devices
+
+        Devices which did not reach arrive_sightings are forgotten without an event.
+
+        :param now: The current time, default clock()
+        :returns: list of PresenceEvent
+        """
+
+        if now is None:
+            now = self.clock()
+        tick = self._tick_of(now)
+        events = []
+        for addr in self.wheel.advance(tick):
+            state = self.devices[addr]
+            deadline = state[0] + self.depart_ticks
+            if deadline > tick:
+                # Seen after the timer was set
+                self.wheel.schedule(addr, deadline)
+                continue
+            del self.devices[addr]
+            if state[2]:
+                events.append(PresenceEvent("depart", addr, now))
+        return events
+
+    # -------------------------------------------------------------------------
+    def present(self) -> list:
+        """Return the addresses of the present devices"""
+
+        return [addr for addr, state in self.devices.items() if state[2]]
+
+    def __len__(self):
+        return len(self.devices)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
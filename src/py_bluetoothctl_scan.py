@@ -6,43 +6,50 @@
 """
 
 # global imports
+import argparse
+import contextlib
+import os
 import sys
 import datetime
 import re
+import time
+from collections import namedtuple
 
 # local imports
-from command import run_command
+from command import run_command, stream_command
 from lib.helper import print_header
 from lib.helper import debug
 from lib.helper import clear_debug_window
 from lib.decorators import dumpFuncname, dumpArgs
-from lib.helper import IteratorWithPushback
 from device_dbase import DeviceDatabase
+from bluetoothctl_session import BluetoothctlSession, strip_terminal_output, PROMPT_RE
+from info_fetcher import InfoFetcher
+from info_parser import parse_info, parse_int
+from device_registry import BTDevice, DeviceChange, DeviceRegistry
+from adv_decoders import decode_advertisement
+from capture import CaptureWriter, replay_capture
+import rssi_filter
+import sighting_buffer
+from presence import PresenceTracker
+from scan_scheduler import DutyCycleScheduler
+from multi_scan import MultiAdapterScanner
+from info_refresh import RefreshScheduler
+from address_clusters import AddressClusters, clean_name, shape_of
+from event_bus import EventBus
+from ndjson_output import NdjsonWriter, jsonable
 
 
 # -----------------------------------------------------------------------------
-class BTDevice:
-    dev: str
-    addr: str
-    name: str = ""
-    timestamp: str = ""
-    rssi: int = 0
-    txpower: int = 0
-    manufacturerdata: str = ""
-    servicedata: str = ""
-    info: str = ""  # The full info string
-    props: dict = {}  # The info string, broken up in properties
+# Next to this script, wherever it is started from
+DBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbase")
+DBASE_PATH = os.path.join(DBASE_DIR, "dbase.sql")
+# The RefreshScheduler history, kept between runs
+REFRESH_STATE_PATH = os.path.join(DBASE_DIR, "info_refresh.json")
 
-    def __str__(self):
-        s = f"BTDevice (str): addr={self.addr} \nname={self.name} \nprops={self.props} \ninfo={self.info}"
-        return s
-
-    def __repr__(self):
-        s = f"BTDevice (repr): addr={self.addr} \nname={self.name} \nprops={self.props} \ninfo={self.info}"
-        return s
-
-
-bt_devices = {}  # dictionary of BTDevice, key is the address
+registry = DeviceRegistry()
+bt_devices = registry.devices  # dictionary of BTDevice, key is the address
+clusters = AddressClusters()  # the registry and the database use the logical id of rotating addresses
+refresh = RefreshScheduler(clock=time.time)  # info refresh history, see REFRESH_STATE_PATH
 
 # -----------------------------------------------------------------------------
 sampleoutput_bluetoothctl_devices = """
@@ -134,6 +141,188 @@ def live_scan(timeout=5, verbose=False):
     return scan_result
 
 
+# -----------------------------------------------------------------------------
+# A parsed line of 'bluetoothctl scan on' output.
+# kind is "NEW", "CHG" or "DEL", key is the changed property (e.g. "RSSI") or "Name" for NEW and DEL
+ScanEvent = namedtuple("ScanEvent", "kind addr key value")
+
+# ScanEvent key: BTDevice field
+SCAN_EVENT_FIELDS = {"Name": "name", "RSSI": "rssi", "TxPower": "txpower"}
+
+# A scan event, resolved against the registry: addr is the logical id, scan the ScanEvent,
+# change the DeviceChange or None, merged the list of apply_merges(), time the time.time()
+DeviceEvent = namedtuple("DeviceEvent", "addr scan change merged adapter time")
+
+SCAN_EVENT_RE = re.compile(r"^\[(NEW|CHG|DEL)\] Device ((?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}) ?(.*)$")
+
+# A line of 'bluetoothctl devices', like 'Device D8:DD:6B:81:74:8B Hue Lamp'
+# The address is matched as 17 hex digits and colons, which is faster than checking each group
+DEVICE_LINE_RE = re.compile(r"^Device ([0-9A-Fa-f:]{17}) ?(.*)", re.MULTILINE)
+
+
+# -----------------------------------------------------------------------------
+def parse_scan_line(line):
+    r"""Parse one line of 'bluetoothctl scan on' output
+
+    :param line: The line to parse. Colors and prompts will be stripped.
+    :returns: ScanEvent, or None if this line is not a device event
+
+    >>> parse_scan_line("[0;93m[CHG][0m Device 47:B6:7A:81:C4:BC RSSI: -62")
+    ScanEvent(kind='CHG', addr='47:B6:7A:81:C4:BC', key='RSSI', value=-62)
+
+    >>> parse_scan_line("[bluetooth]# [NEW] Device D8:DD:6B:81:74:8B Hue Lamp")
+    ScanEvent(kind='NEW', addr='D8:DD:6B:81:74:8B', key='Name', value='Hue Lamp')
+
+    >>> parse_scan_line("[CHG] Device 47:B6:7A:81:C4:BC TxPower: 0xfffffff4 (-12)")
+    ScanEvent(kind='CHG', addr='47:B6:7A:81:C4:BC', key='TxPower', value=-12)
+
+    >>> parse_scan_line("[CHG] Controller B8:27:EB:6D:21:BE Discovering: yes") is None
+    True
+    """
+
+    line = PROMPT_RE.sub("", strip_terminal_output(line).strip())
+    match = SCAN_EVENT_RE.match(line)
+    if not match:
+        return None
+
+    kind, addr, rest = match.groups()
+    if kind != "CHG":
+        return ScanEvent(kind, addr, "Name", rest)
+
+    key, _sep, value = rest.partition(": ")
+    if key in ("RSSI", "TxPower"):
+        int_value = parse_int(value)
+        if int_value is not None:
+            value = int_value
+    return ScanEvent(kind, addr, key, value)
+
+
+# -----------------------------------------------------------------------------
+@dumpFuncname
+def live_scan_events(timeout=5, recorder=None):
+    """Perform a live Bluetooth scan, and yield the device events as soon as they arrive
+
+    :param timeout: Scan duration
+    :param recorder: Optional CaptureWriter, to record the raw scan output
+    :returns: generator of ScanEvent
+    """
+
+    print(f"Scanning for {timeout} seconds...")
+
+    try:
+        # On a pseudo terminal, so that bluetoothctl writes each event as soon as it has it
+        lines = stream_command(f"bluetoothctl --timeout {timeout} scan on", tty=True)
+        if recorder:
+            lines = recorder.record_lines(lines, "scan")
+        for line in lines:
+            event = parse_scan_line(line)
+            if event:
+                yield event
+    finally:
+        run_command("bluetoothctl scan off")
+
+
+# -----------------------------------------------------------------------------
+def scheduled_scan_events(duration, scheduler, recorder=None, session=None):
+    """Scan in windows with idle gaps in between, as planned by a DutyCycleScheduler,
+    and yield the device events as soon as they arrive
+
+    :param duration: Total number of seconds to scan and idle
+    :param scheduler: DutyCycleScheduler
+    :param recorder: Optional CaptureWriter, to record the raw scan output
+    :param session: BluetoothctlSession to use, default a new one
+    :returns: generator of ScanEvent
+    """
+
+    own_session = session is None
+    if own_session:
+        session = BluetoothctlSession()
+    end = time.monotonic() + duration
+    try:
+        while time.monotonic() < end:
+            transport, window = scheduler.next_window()
+            window = min(window, end - time.monotonic())
+            debug(f"Scanning {transport} for {window:.1f} seconds")
+
+            new_devices = 0
+            start = time.monotonic()
+            session.scan(transport)
+            try:
+                for line in session.read_events(window):
+                    if recorder:
+                        recorder.write("scan", line)
+                    event = parse_scan_line(line)
+                    if event:
+                        if event.kind == "NEW" and event.addr not in registry:
+                            new_devices += 1
+                        yield event
+            finally:
+                session.scan("off")
+            scheduler.report(transport, time.monotonic() - start, new_devices)
+
+            time.sleep(max(0.0, min(scheduler.idle_gap(), end - time.monotonic())))
+    finally:
+        if own_session:
+            session.close()
+
+
+# -----------------------------------------------------------------------------
+def apply_scan_event(event):
+    """Apply a scan event to the device registry
+
+    Rotating addresses are resolved to their logical device first, so a new address of
+    a known device updates the known device.
+
+    :param event: The ScanEvent to apply
+    :returns: DeviceChange with the changed fields, or None if nothing changed
+
+    >>> apply_scan_event(ScanEvent("NEW", "5A:B5:65:89:46:37", "Name", "Tile"))
+    DeviceChange(kind='new', addr='5A:B5:65:89:46:37', fields={'name': 'Tile'})
+    >>> apply_scan_event(ScanEvent("CHG", "5A:B5:65:89:46:37", "RSSI", -71))
+    DeviceChange(kind='changed', addr='5A:B5:65:89:46:37', fields={'rssi': -71})
+    >>> apply_scan_event(ScanEvent("DEL", "5A:B5:65:89:46:37", "Name", "Tile"))
+    DeviceChange(kind='deleted', addr='5A:B5:65:89:46:37', fields={})
+    """
+
+    if event.kind == "DEL":
+        # A superseded address of a rotating device going away is not the device going away
+        if not clusters.is_current(event.addr):
+            return None
+        return registry.remove(clusters.lookup(event.addr))
+
+    name = event.value if event.key == "Name" else None
+    rssi = event.value if event.key == "RSSI" and isinstance(event.value, int) else None
+    shape = shape_of(txpower=event.value) if event.key == "TxPower" and isinstance(event.value, int) else None
+    addr = clusters.resolve(event.addr, name=name, rssi=rssi, shape=shape)
+
+    if event.kind == "NEW":
+        # A new address of a known device does not rename it to the address
+        if addr in registry and not clean_name(event.addr, event.value):
+            return registry.update(addr)
+        return registry.update(addr, name=event.value)
+    if event.key in SCAN_EVENT_FIELDS:
+        return registry.update(addr, **{SCAN_EVENT_FIELDS[event.key]: event.value})
+    # Another property changed, the device has been seen
+    return registry.update(addr)
+
+
+# -----------------------------------------------------------------------------
+def apply_merges(db=None) -> list:
+    """Drop the provisional devices which turned out to be a new address of a known device
+
+    :param db: Optional DeviceDatabase, to remove their rows from
+    :returns: list of (provisional address, logical id) tuples
+    """
+
+    merged = clusters.pop_merged()
+    for provisional, _cid in merged:
+        registry.remove(provisional)
+        refresh.remove(provisional)
+        if db is not None:
+            db.remove(provisional)
+    return merged
+
+
 # -----------------------------------------------------------------------------
 @dumpFuncname
 def get_live_devices(verbose=False):
@@ -156,6 +345,21 @@ Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)
 """
 
 
+def parse_device_list(data) -> list:
+    r"""Parse the output of 'bluetoothctl devices' in one pass over the whole buffer
+
+    Lines which are not a device line, like prompts or empty lines, are skipped.
+
+    :param data: string with the output of 'bluetoothctl devices'
+    :returns: list of (address, name) tuples
+
+    >>> parse_device_list(testdata)[1:]
+    [('D8:DD:6B:81:74:8B', 'Hue Lamp'), ('24:FC:E5:8F:AB:89', '[TV] Samsung Q70 Series (49)')]
+    """
+
+    return DEVICE_LINE_RE.findall(data)
+
+
 def get_mac_addresses(data):
     r"""Process the output of 'bluetoothctl devices'
 
@@ -166,14 +370,7 @@ def get_mac_addresses(data):
     ['47:B6:7A:81:C4:BC', 'D8:DD:6B:81:74:8B', '24:FC:E5:8F:AB:89']
     """
 
-    addr_list = []
-    for line in data.splitlines():
-        if not line:
-            continue
-        debug(f"line = '{line}'")
-        dev, addr, value = line.split(" ", maxsplit=2)
-        addr_list.append(addr)
-    return addr_list
+    return [match.group(1) for match in DEVICE_LINE_RE.finditer(data)]
 
 
 # -----------------------------------------------------------------------------
@@ -181,59 +378,23 @@ def get_mac_addresses(data):
 def process_devices(data):
     """Process the bluetoothctl devices
 
-    :param data: string with lines to process
+    :param data: string with lines to process. Lines which are not a device line are skipped.
     :returns: dictionary of bluetooth devices
 
     Example string: see [sample_output]
     """
 
-    for line in data.splitlines():
-
-        datetimestr = get_timestamp()
-
-        if not line:
-            continue
-
-        # Reset values
-        device = None
-        addr = None
-
-        try:
-            dev, addr, value = line.split(" ", maxsplit=2)
-            debug(f"{dev}, {addr}, {value}")
-
-            if addr not in bt_devices:
-                # This is a new device
-
-                # device = BTDevice(addr=addr, dev=dev, timestamp=datetimestr, name=value)
-                device = BTDevice()
-                device.addr = addr
-                device.dev = dev
-                device.timestamp = datetimestr
-                device.name = value
-
-                # print('new device has been found', device)
-            else:
-                # This device was seen before. Update the information
-                device = bt_devices.get(addr)
-                device.timestamp = datetimestr
-                # print('existing device has been updated:', device)
-        except ValueError:
-            print('ERROR: Problem in line "line"')
-
-        # Add / Replace this device in the dictionary
-        # print(device)
-        if addr and device:
-            bt_devices[addr] = device
+    for addr, name in parse_device_list(data):
+        # New devices get their name, known devices are marked as seen
+        addr = clusters.lookup(addr)
+        if addr in bt_devices:
+            registry.update(addr)
+        else:
+            registry.update(addr, name=name)
 
     return bt_devices
 
 
-# -----------------------------------------------------------------------------
-def reset_value() -> list:
-    return []
-
-
 # -----------------------------------------------------------------------------
 test_info_servicedata = r"""
 Device 23:A0:64:00:3A:F1 (random)
@@ -278,11 +439,60 @@ Device 24:FC:E5:8F:AB:89 (public)
 """
 
 
+def get_special_bytes(info, tag1, tag2) -> dict:
+    """Extract the hex dumps after a key and value tag from the info string, in one pass.
+
+    The hex values are in the fixed first column (16 values, 47 characters) of the
+    hex dump lines, so they are converted with bytes.fromhex() in one go.
+
+    :param info: The string to process
+    :param tag1: The key tag, e.g. "ServiceData Key:" or "ManufacturerData Key:"
+    :param tag2: The value tag, e.g. "ServiceData Value:" or "ManufacturerData Value:"
+    :returns: dictionary of key and bytes
+
+    >>> get_special_bytes(test_info_servicedata, "ServiceData Key:", "ServiceData Value:")
+    {'0000fd6f-0000-1000-8000-00805f9b34fb': b'\\xd7\\xe5\\xea\\x9f\\x94GL0\\xaa\\x0cD\\xa9U&\\r\\xd9O\\xb7\\x8c\\xfd'}
+
+    >>> get_special_bytes(test_info_manufdata, "ManufacturerData Key:", "ManufacturerData Value:")["0x0075"].hex()
+    '420401207e190f0002013100000000000000000000000000'
+    """
+
+    dict_to_return = {}
+    if tag2 not in info:
+        return dict_to_return
+
+    key = None
+    value = None  # bytearray while collecting hex dump lines
+    for line in info.splitlines():
+        if value is not None:
+            try:
+                value += bytes.fromhex(line.lstrip()[:47])
+                continue
+            except ValueError:
+                # End of the hex dump
+                if key and value:
+                    dict_to_return[key] = bytes(value)
+                key = None
+                value = None
+
+        if tag1 in line:
+            key = line.split(":", maxsplit=1)[1].strip()
+        elif tag2 in line:
+            value = bytearray()
+
+    if key and value:
+        dict_to_return[key] = bytes(value)
+
+    return dict_to_return
+
+
+# -----------------------------------------------------------------------------
 def get_special_data(info, tag1, tag2) -> dict:
     """Extract ServiceData (key and value) from the info string
     :param info: The string to process
     :param tag1: The first tag to process, e.g. "ServiceData Key:" or "ManufacturerData Key:"
     :param tag2: The 2nd tag to process, e.g. "ServiceData Value:" or "ManufacturerData Value:"
+    :returns: dictionary of key and list of values. See get_special_bytes() for the values as bytes.
 
     >>> get_special_data("abc", "ServiceData Key:", "ServiceData Value:")
     {}
@@ -292,99 +502,7 @@ def get_special_data(info, tag1, tag2) -> dict:
     {'0000fd6f-0000-1000-8000-00805f9b34fb': [215, 229, 234, 159, 148, 71, 76, 48, 170, 12, 68, 169, 85, 38, 13, 217, 79, 183, 140, 253]}
     """
 
-    # @dumpArgs
-    def get_key(line):
-        _header, key = line.split(":")
-        key = key.strip()
-        # debug(f'Returning key = {key}')
-        return key
-
-    # @dumpArgs
-    def get_valuelist_from_one_line(line) -> list:
-        line = line.strip()
-        list_to_return = []
-        while True:
-            s = line.split(" ", maxsplit=16)  # For example ['00', '00', '00', '00', '00', '00', '00', '00', '', '', '', '', '', '', '', '', '                 ........']
-            # debug(s)
-            try:
-                for i, hexvalue in enumerate(s):
-                    val = int(hexvalue, 16)
-                    list_to_return.append(val)
-            except ValueError:
-                # End of the valid hex values
-                break
-        # debug(f"returning {list_to_return}")
-        return list_to_return
-
-    # @dumpArgs
-    def get_value(lines) -> list:
-        """Get the hex values out of next line of iterator
-        :param lines: iterator of lines
-        :returns: tuple of the next line (without hex values) and the list of values
-        """
-        value_list = []
-        while True:
-            try:
-                line = next(lines)
-                # debug(f"get_value {line}")
-            except StopIteration:
-                # debug(f"returning value_list1 {value_list}")
-                return value_list
-            tmp_list = get_valuelist_from_one_line(line)
-            value_list.extend(tmp_list)
-            # debug(f"current value_list = {value_list}")
-            # debug(f"current line = {line}")
-            if (tag1 in line) or (tag2 in line):
-                debug(f'Pushing back line {line}')
-                lines.push_back(line)
-                # debug(f"returning value_list2 {value_list}")
-                return value_list
-
-    # Look ahead and see if the desired strings are available.
-    # If not, then return immediately
-    if (tag1 not in info) or (tag2 not in info):
-        return {}
-
-    # debug(info)
-
-    key_to_return = None
-    dict_to_return = {}
-
-    lines = IteratorWithPushback(info.splitlines())
-    line = next(lines)
-    while True:
-        # debug('-----')
-        # debug(f"Start of while true 0, line={line}")
-        try:
-            # debug(f"key_to_return={key_to_return}")
-            # debug(f"value_to_return={value_to_return}")
-            if tag1 in line:
-                # debug("-----")
-                # debug(f"Found tag1 '{tag1}' in line '{line}'")
-                key_to_return = get_key(line)
-                # debug(f"key_to_return={key_to_return}")
-                line = next(lines)
-                continue   # We found the line with key
-            elif tag2 in line:
-                # debug("-----")
-                # debug(f"Found tag2 '{tag2}' in line '{line}'")
-                value_to_return = get_value(lines)
-                # debug(f"final key={key_to_return} value_to_return={value_to_return}")
-                # Add key and value to the dictionary to return
-                if key_to_return and value_to_return:
-                    dict_to_return[key_to_return] = value_to_return
-                # Reset the key and value which will be build up
-                key_to_return = ""
-                value_to_return = []
-                line = next(lines)
-            else:
-                line = next(lines)
-                continue
-        except StopIteration:
-            # debug("End of iterator")
-            break
-
-    return dict_to_return
+    return {key: list(value) for key, value in get_special_bytes(info, tag1, tag2).items()}
 
 
 # -----------------------------------------------------------------------------
@@ -417,53 +535,71 @@ def get_manuf_data(info) -> dict:
 
 
 # -----------------------------------------------------------------------------
-@dumpFuncname
 def process_device_info(info) -> BTDevice:
     """Process deviceinfo string for one device
 
-    :param info: The string to process. For an example, see ...
-    """
+    :param info: The string to process. For an example, see Samsung_Q70_info
+    :returns: BTDevice, with the DeviceInfo of parse_info() in props
 
-    bt_device = BTDevice()
-    hex_value_list = reset_value()
-    key = ""
+    >>> device = process_device_info(Samsung_Q70_info)
+    >>> device.addr, device.name, device.manufacturerdata[0x0075][:4]
+    ('24:FC:E5:8F:AB:89', '[TV] Samsung Q70 Series (49)', b'B\\x04\\x01 ')
+    """
 
-    for line in info.splitlines():
+    record = parse_info(info)
 
-        line = line.strip()
-        if not line:  # Empty line
-            continue
+    bt_device = BTDevice(record.addr, record.name)
+    bt_device.rssi = record.rssi or 0
+    bt_device.txpower = record.txpower or 0
+    bt_device.manufacturerdata = record.manufacturer_data or None
+    bt_device.servicedata = record.service_data or None
+    bt_device.props = record
+    return bt_device
 
-        if line.startswith("Device "):
-            dev_type, addr, comment = line.split(" ", maxsplit=2)
-            bt_device.dev_type = dev_type
-            bt_device.addr = addr
-            bt_device.comment = comment
-            bt_device.info = info
-            debug(bt_device)
-            continue
 
-        try:
-            key, val = line.split(":", maxsplit=1)
-            key = key.strip()
-            val = val.strip()
-            debug(f"key={key}, val={val}")
-            bt_device.props[key.strip()] = val
-            hex_value_list = reset_value()
-            continue
-        except ValueError:
-            # print(f"Could not use split(':') on line={line}")
-            l2 = line
-            if len(line) > 47:
-                l2 = line[:47]
-            t = re.findall(r"[0-9a-fA-F]+", l2)  # Find the hexadecimal combinations
-            # print("regex output: ", t)
-            hex_value_list.extend(t)
-            bt_device.props[key.strip()] = hex_value_list
+# -----------------------------------------------------------------------------
+def print_device_info(bt_device):
+    """Print a device, and its decoded advertisement payloads"""
 
-    print()
     print(bt_device)
-    return bt_device
+    for decoded in decode_advertisement(bt_device.manufacturerdata, bt_device.servicedata):
+        print(f"advertisement: {decoded}")
+
+
+# -----------------------------------------------------------------------------
+def device_record(bt_device, kind="device") -> dict:
+    """NDJSON record of a device
+
+    :param bt_device: BTDevice
+    :param kind: The record type, "device" for the device list, "info" for the device info,
+                 which adds the decoded advertisement payloads
+    """
+
+    record = {
+        "type": kind,
+        "addr": bt_device.addr,
+        "name": bt_device.name,
+        "rssi": bt_device.rssi,
+        "txpower": bt_device.txpower,
+        "manufacturerdata": jsonable(bt_device.manufacturerdata),
+        "servicedata": jsonable(bt_device.servicedata),
+    }
+    if kind == "info":
+        record["advertisements"] = [dict(jsonable(decoded), format=type(decoded).__name__)
+                                    for decoded in decode_advertisement(bt_device.manufacturerdata, bt_device.servicedata)]
+    return record
+
+
+def show_device_info(bt_device, writer=None):
+    """Print a device and its decoded advertisement payloads, or write them as NDJSON
+
+    :param writer: Optional NdjsonWriter
+    """
+
+    if writer is None:
+        print_device_info(bt_device)
+    else:
+        writer.write(device_record(bt_device, "info"))
 
 
 # -----------------------------------------------------------------------------
@@ -477,23 +613,316 @@ def get_timestamp():
     return datetimestr
 
 
+# -----------------------------------------------------------------------------
+def make_device_event(event, adapter=0) -> DeviceEvent:
+    """Apply a scan event to the registry, and make the DeviceEvent for the subscribers
+
+    :param event: The ScanEvent
+    :param adapter: Index of the adapter which saw the event
+    """
+
+    change = apply_scan_event(event)
+    merged = apply_merges()
+    return DeviceEvent(clusters.lookup(event.addr), event, change, merged, adapter, time.time())
+
+
+def print_device_event(device_event):
+    """Console subscriber: print the registry changes"""
+
+    if device_event.change:
+        print(device_event.change)
+    for provisional, cid in device_event.merged:
+        print(f"{provisional} is a new address of {cid}")
+
+
+def device_event_record(device_event) -> dict:
+    """NDJSON record of a DeviceEvent
+
+    >>> scan = ScanEvent("CHG", "47:B6:7A:81:C4:BC", "RSSI", -62)
+    >>> change = DeviceChange("changed", "47:B6:7A:81:C4:BC", {"rssi": -62})
+    >>> record = device_event_record(DeviceEvent("47:B6:7A:81:C4:BC", scan, change, [], 0, 1700000000.0))
+    >>> record["kind"], record["key"], record["value"], record["change"], record["fields"]
+    ('CHG', 'RSSI', -62, 'changed', {'rssi': -62})
+    """
+
+    event, change = device_event.scan, device_event.change
+    record = {
+        "type": "scan",
+        "time": device_event.time,
+        "adapter": device_event.adapter,
+        "kind": event.kind,
+        "addr": event.addr,
+        "device": device_event.addr,
+        "key": event.key,
+        "value": event.value,
+    }
+    if change is not None:
+        record["change"] = change.kind
+        record["fields"] = jsonable(change.fields)
+    if device_event.merged:
+        record["merged"] = [{"addr": provisional, "device": cid} for provisional, cid in device_event.merged]
+    return record
+
+
+def analyze_device_event(device_event, smoother=None, presence=None, sightings=None):
+    """Analytics subscriber: smooth the RSSI, keep the recent sightings, and print arrive and depart events
+
+    :param smoother: Optional RssiSmoother, to smooth the RSSI and estimate the distance
+    :param presence: Optional PresenceTracker, to print arrive and depart events
+    :param sightings: Optional SightingBuffer, to keep the recent sightings in memory
+    """
+
+    addr, event = device_event.addr, device_event.scan
+    if presence is not None:
+        if event.kind != "DEL":
+            arrived = presence.sighting(addr)
+            if arrived:
+                print(arrived)
+        print_departures(presence)
+    if not isinstance(event.value, int):
+        return
+    if event.key == "RSSI":
+        if smoother is not None:
+            smoother.add(addr, event.value)
+        if sightings is not None:
+            sightings.add_sighting(addr, device_event.time, event.value, device_event.adapter)
+    elif event.key == "TxPower" and smoother is not None:
+        smoother.set_txpower([addr], [event.value])
+
+
+def print_departures(presence):
+    """Advance a PresenceTracker to the current time, and print the depart events
+
+    :param presence: PresenceTracker
+    """
+
+    for presence_event in presence.tick():
+        print(presence_event)
+
+
+def store_device_event(device_event, db):
+    """Database subscriber: store new devices and RSSI sightings
+
+    :param db: DeviceDatabase
+    """
+
+    addr, event = device_event.addr, device_event.scan
+    for provisional, _cid in device_event.merged:
+        db.remove(provisional)
+    if event.kind == "NEW":
+        # Only the first address of a logical device gets a row
+        if addr == event.addr:
+            db.add(addr, event.value, "")
+    elif event.key == "RSSI" and isinstance(event.value, int):
+        db.add_sighting(addr, device_event.time, event.value, device_event.adapter)
+
+
+# -----------------------------------------------------------------------------
+def store_scan_event(event, db, smoother=None, presence=None, adapter=0, sightings=None, writer=None):
+    """Apply a scan event to the registry, and store new devices and RSSI sightings,
+    with all subscribers called in turn
+
+    :param event: The ScanEvent
+    :param db: DeviceDatabase
+    :param smoother: Optional RssiSmoother, to smooth the RSSI and estimate the distance
+    :param presence: Optional PresenceTracker, to print arrive and depart events
+    :param adapter: Index of the adapter which saw the event
+    :param sightings: Optional SightingBuffer, to keep the recent sightings in memory
+    :param writer: Optional NdjsonWriter, to write the event as NDJSON instead of printing the change
+    """
+
+    device_event = make_device_event(event, adapter)
+    if writer is None:
+        print_device_event(device_event)
+    else:
+        writer.write(device_event_record(device_event))
+    analyze_device_event(device_event, smoother, presence, sightings)
+    store_device_event(device_event, db)
+
+
+# -----------------------------------------------------------------------------
+def make_scan_bus(db, smoother=None, presence=None, sightings=None, writer=None) -> EventBus:
+    """Make an EventBus with the database, console and analytics subscribers, each in its
+    own thread, so a slow subscriber does not stall the scan
+
+    The database keeps the oldest events when it falls behind, so no device row is lost
+    before its sightings. The console and analytics keep the latest events. The analytics
+    thread also looks for departed devices every second, as they are not seen anymore.
+
+    With a writer, the events are written as NDJSON instead of printed. That subscriber
+    blocks the scan when the reader of the pipe falls behind, so no event is lost, and
+    writes a batch whenever it has caught up with the scan.
+
+    :param db: DeviceDatabase
+    :param smoother: Optional RssiSmoother
+    :param presence: Optional PresenceTracker
+    :param sightings: Optional SightingBuffer
+    :param writer: Optional NdjsonWriter
+    """
+
+    bus = EventBus()
+    bus.subscribe(lambda device_event: store_device_event(device_event, db), "database", 100_000, "drop_newest")
+    if writer is None:
+        bus.subscribe(print_device_event, "console", 1000, "drop_oldest")
+    else:
+        def write_device_event(device_event):
+            writer.write(device_event_record(device_event))
+            if not subscription.lag():
+                writer.flush()
+
+        subscription = bus.subscribe(write_device_event, "ndjson", 10_000, "block")
+    bus.subscribe(lambda device_event: analyze_device_event(device_event, smoother, presence, sightings),
+                  "analytics", 10_000, "drop_oldest",
+                  timer=(lambda: print_departures(presence)) if presence is not None else None)
+    return bus
+
+
+# -----------------------------------------------------------------------------
+def print_smoothed_rssi(smoother):
+    """Print the smoothed RSSI and estimated distance of every device"""
+
+    smoother.flush()
+    print_header("SMOOTHED RSSI")
+    for addr in smoother.slots:
+        ema, kalman, distance = smoother.get(addr)
+        if ema is None:
+            continue
+        distance_str = f"{distance:6.1f} m" if distance is not None else "     ? m"
+        print(f"{addr}  ema {ema:6.1f}  kalman {kalman:6.1f}  {distance_str}")
+
+
+# -----------------------------------------------------------------------------
+def print_recent_sightings(sightings, seconds=300.0):
+    """Print the number of sightings and the RSSI range of every device, of the last seconds"""
+
+    print_header(f"SIGHTINGS OF THE LAST {seconds:.0f} SECONDS")
+    for row in sightings.group_by(seconds):
+        print(f"{sightings.addresses[row['addr_id']]}  {row['count']:6} sightings  "
+              f"rssi {row['min_rssi']:4} .. {row['max_rssi']:4}  mean {row['mean_rssi']:6.1f}")
+
+
+# -----------------------------------------------------------------------------
+def replay_scan(filename, speed, db, smoother=None, presence=None, sightings=None, writer=None):
+    """Feed a capture file through the parsers
+
+    :param filename: Capture file, made with --record
+    :param speed: Replay speed factor, 0 for as fast as possible
+    :param db: DeviceDatabase to store the scan events in
+    :param smoother: Optional RssiSmoother
+    :param presence: Optional PresenceTracker
+    :param sightings: Optional SightingBuffer
+    :param writer: Optional NdjsonWriter, to write the scan events as NDJSON
+    :returns: tuple of (the 'bluetoothctl devices' output, list of info strings)
+    """
+
+    data = ""
+    infos = []
+    for record in replay_capture(filename, speed):
+        # "scan", or "scan:{adapter}" for a scan with all adapters
+        source, _sep, adapter = record.source.partition(":")
+        if source == "scan":
+            event = parse_scan_line(record.data)
+            if event:
+                store_scan_event(event, db, smoother, presence, int(adapter or 0), sightings, writer)
+        elif record.source == "devices":
+            data = record.data
+        elif record.source == "info":
+            infos.append(record.data)
+    return data, infos
+
+
 # =============================================================================
-def main():
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Scan for BT devices with bluetoothctl")
+    parser.add_argument("--record", metavar="FILE", help="record the bluetoothctl output in a capture file (.gz, or .zst)")
+    parser.add_argument("--replay", metavar="FILE", help="replay a capture file instead of scanning")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 for as fast as possible (default 1)")
+    parser.add_argument("--adaptive", type=float, metavar="SECONDS",
+                        help="scan for SECONDS in adaptive LE and classic windows, instead of one 30 second window")
+    parser.add_argument("--all-adapters", action="store_true", help="scan with every adapter at the same time")
+    parser.add_argument("--info-budget", type=int, default=16, metavar="N",
+                        help="number of devices to query the info of, the most likely to have changed first (default 16). "
+                             "Every device is queried while there is no refresh history yet")
+    parser.add_argument("--format", choices=("text", "ndjson"), default="text",
+                        help="text for people, or ndjson: one JSON record per line on stdout, the text goes to stderr")
+    args = parser.parse_args(argv)
+
+    if args.format == "ndjson":
+        with NdjsonWriter() as writer, contextlib.redirect_stdout(sys.stderr):
+            scan(args, writer)
+    else:
+        scan(args)
+
+
+def scan(args, writer=None):
+    """Scan, or replay, and show the devices and their info
+
+    :param args: The parsed command line arguments of main()
+    :param writer: Optional NdjsonWriter, to write the results as NDJSON
+    """
 
     # Determine if we are working online (on the Raspberry Pi) or offline on Windows
     online = False
-    if sys.platform == "linux":
+    if sys.platform == "linux" and not args.replay:
         online = True
 
-    dbase_path = "./dbase/dbase.sql"
+    dbase_path = DBASE_PATH
     db = DeviceDatabase(dbase_path)
+    recorder = CaptureWriter(args.record) if args.record and online else None
+    smoother = rssi_filter.RssiSmoother() if rssi_filter.np is not None else None
+    sightings = sighting_buffer.SightingBuffer() if sighting_buffer.np is not None else None
+    presence = PresenceTracker(depart_after=30.0)
 
     if online:
-        live_scan(timeout=30)
+        # Load the info refresh history before the scan, so that apply_merges() also drops
+        # the provisional addresses of the earlier runs
+        refresh.budget = args.info_budget
+        history = refresh.load(REFRESH_STATE_PATH)
+
+        # Store the devices and their RSSI while the scan is running
+        bus = make_scan_bus(db, smoother, presence, sightings, writer)
+        if args.all_adapters:
+            scanner = MultiAdapterScanner(parse=parse_scan_line)
+            for adapter, event in scanner.scan(30, recorder):
+                bus.publish(make_device_event(event, adapter))
+                if writer and writer.broken:
+                    break
+            for stats in scanner.stats:
+                print(stats.as_dict())
+            print(f"devices seen by all adapters together: {scanner.coverage()}")
+        else:
+            if args.adaptive:
+                scheduler = DutyCycleScheduler()
+                events = scheduled_scan_events(args.adaptive, scheduler, recorder)
+            else:
+                events = live_scan_events(timeout=30, recorder=recorder)
+            for event in events:
+                bus.publish(make_device_event(event))
+                if writer and writer.broken:
+                    break
+            if args.adaptive:
+                print(f"scan duty cycle: {scheduler.duty_cycle():.0%} in {len(scheduler.history)} windows")
+        bus.close()
+        for stats in bus.stats():
+            print(stats)
+            if writer:
+                writer.write(dict(stats, type="subscriber"))
         data = get_live_devices()
+        if recorder:
+            recorder.write("devices", data)
+    elif args.replay:
+        print(f"Replaying {args.replay}")
+        data, infos = replay_scan(args.replay, args.speed, db, smoother, presence, sightings, writer)
     else:
         print("No live capture was peformed, using sample output")
         data = sampleoutput_bluetoothctl_devices
+        infos = sampleoutput_bluetoothctl_info + [test_info_servicedata]
+
+    if smoother is not None:
+        print_smoothed_rssi(smoother)
+    if sightings is not None:
+        print_recent_sightings(sightings)
 
     # Get a list of mac addresses from the ouput
     addresses = get_mac_addresses(data)
@@ -504,19 +933,40 @@ def main():
     devs = process_devices(data)
     for dev in devs.items():
         print(dev)
+        if writer:
+            writer.write(device_record(dev[1]))
     print()
+    if writer:
+        writer.flush()
 
     # Get information for each device:
     if online:
-        # Get online info for each discovered device
-        for addr in devs:
-            info = run_command(f"bluetoothctl info {addr}", verbose=True)
-            if info:
-                process_device_info(info)
+        # Get online info for the devices most likely to have new data, with a few bluetoothctl sessions in parallel.
+        # The refresh history is kept between runs. Without history, every device is queried.
+        for addr, dev in devs.items():
+            # A device which never reported its RSSI has the default of 0
+            refresh.add(addr, dev.rssi or None)
+        budget = args.info_budget if history else len(devs)
+        with InfoFetcher(workers=8, deadline=5.0) as fetcher:
+            # Query the current address of rotating devices
+            batch = refresh.next_batch(budget, present=devs)
+            for result in fetcher.fetch_all([clusters.current(addr) for addr in batch]):
+                refresh.done(clusters.lookup(result.addr), result.info if result.ok else None)
+                if result.ok:
+                    if recorder:
+                        recorder.write("info", result.info)
+                    show_device_info(process_device_info(result.info), writer)
+            print(f"info latency: {fetcher.stats()}")
+        refresh.save(REFRESH_STATE_PATH)
+        print(f"info freshness: {refresh.freshness()}")
+        print(f"rotating addresses: {clusters.stats()}")
     else:
-        # Use offline sample info
-        for info in sampleoutput_bluetoothctl_info:
-            process_device_info(info)
+        # Use the replayed or offline sample info
+        for info in infos:
+            show_device_info(process_device_info(info), writer)
+
+    if recorder:
+        recorder.close()
 
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,189 @@
+##
+# @file: rssi_codec.py
+# @brief: Compressed block format for RSSI history
+
+"""Compressed block format for RSSI history
+
+A block holds the samples (timestamp in ms, rssi) of one device, in the spirit of the
+Gorilla time series encoding:
+
+- header: number of samples, first timestamp and first rssi
+- per following sample, the delta-of-delta of the timestamp, zigzag and varint encoded.
+  Samples at a regular interval cost a single byte.
+- per following sample, the rssi XOR-ed with the previous rssi, varint encoded.
+  An rssi which barely changes costs a single byte.
+
+A sample typically takes 2 bytes, where a row in the sightings table takes about 20-30.
+"""
+
+# global imports
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# number of samples, first timestamp in ms, first rssi
+HEADER = struct.Struct("<Hqb")
+
+# Maximum number of samples in one block
+MAX_BLOCK_SAMPLES = 0xFFFF
+
+
+# -----------------------------------------------------------------------------
+def zigzag(value) -> int:
+    """Map a signed to an unsigned integer, with small absolute values staying small
+
+    >>> [zigzag(v) for v in (0, -1, 1, -2, 2)]
+    [0, 1, 2, 3, 4]
+    """
+    return (value << 1) ^ (value >> 63)
+
+
+# -----------------------------------------------------------------------------
+def unzigzag(value) -> int:
+    """The inverse of zigzag()
+
+    >>> [unzigzag(v) for v in (0, 1, 2, 3, 4)]
+    [0, -1, 1, -2, 2]
+    """
+    return (value >> 1) ^ -(value & 1)
+
+
+# -----------------------------------------------------------------------------
+def encode_block(timestamps, rssis) -> bytes:
+    """Encode the samples of one device into a block
+
+    :param timestamps: list of integer timestamps in ms, at most MAX_BLOCK_SAMPLES
+    :param rssis: list of rssi values, -128..127
+    :returns: the encoded block
+
+    >>> encode_block([1000, 2000, 3000, 4000], [-60, -60, -61, -60]).hex()
+    '0400e803000000000000c4d00f0000000707'
+    """
+
+    count = len(timestamps)
+    if not count:
+        return b""
+
+    out = bytearray(HEADER.pack(count, timestamps[0], rssis[0]))
+
+    prev_ts = timestamps[0]
+    prev_delta = 0
+    for ts in timestamps[1:]:
+        delta = ts - prev_ts
+        value = zigzag(delta - prev_delta)
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+        prev_ts = ts
+        prev_delta = delta
+
+    prev_rssi = rssis[0] & 0xFF
+    for rssi in rssis[1:]:
+        rssi &= 0xFF
+        value = rssi ^ prev_rssi
+        if value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+        prev_rssi = rssi
+
+    return bytes(out)
+
+
+# -----------------------------------------------------------------------------
+def decode_block(block) -> tuple:
+    """Decode a block into lists of timestamps and rssi values
+
+    :param block: a block made by encode_block()
+    :returns: tuple of (list of timestamps in ms, list of rssi values)
+
+    >>> decode_block(encode_block([1000, 2000, 3000, 4000], [-60, -60, -61, -60]))
+    ([1000, 2000, 3000, 4000], [-60, -60, -61, -60])
+    """
+
+    if not block:
+        return [], []
+
+    count, ts, rssi = HEADER.unpack_from(block)
+
+    values = []
+    value = 0
+    shift = 0
+    for byte in memoryview(block)[HEADER.size:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+
+    timestamps = [ts]
+    delta = 0
+    for value in values[:count - 1]:
+        delta += unzigzag(value)
+        ts += delta
+        timestamps.append(ts)
+
+    rssis = [rssi]
+    rssi &= 0xFF
+    for value in values[count - 1:]:
+        rssi ^= value
+        rssis.append(rssi - 256 if rssi > 127 else rssi)
+
+    return timestamps, rssis
+
+
+# -----------------------------------------------------------------------------
+def decode_block_numpy(block) -> tuple:
+    """Decode a block into NumPy arrays, without a Python loop over the samples
+
+    :param block: a block made by encode_block()
+    :returns: tuple of (int64 array of timestamps in ms, int8 array of rssi values)
+    """
+
+    if np is None:
+        raise ImportError("decode_block_numpy() needs the numpy package")
+    if not block:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+
+    count, ts, rssi = HEADER.unpack_from(block)
+    buf = np.frombuffer(block, dtype=np.uint8, offset=HEADER.size)
+
+    # Every byte without the continuation bit ends a varint
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.empty_like(ends)
+    starts[0:1] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+    shifts = (np.arange(len(buf)) - np.repeat(starts, lengths)) * 7
+    values = np.add.reduceat((buf & 0x7F).astype(np.int64) << shifts, starts) if len(buf) else buf.astype(np.int64)
+
+    dods = values[:count - 1]
+    dods = (dods >> 1) ^ -(dods & 1)
+    timestamps = np.empty(count, dtype=np.int64)
+    timestamps[0] = ts
+    np.cumsum(np.cumsum(dods), out=timestamps[1:])
+    timestamps[1:] += ts
+
+    xors = np.empty(count, dtype=np.uint8)
+    xors[0] = rssi & 0xFF
+    xors[1:] = values[count - 1:]
+    rssis = np.bitwise_xor.accumulate(xors).view(np.int8)
+
+    return timestamps, rssis
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
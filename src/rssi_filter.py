@@ -0,0 +1,232 @@
+##
+# @file: rssi_filter.py
+# @brief: Vectorized RSSI smoothing and distance estimation
+
+"""Vectorized RSSI smoothing and distance estimation
+
+A single RSSI value is too noisy to act on. RssiSmoother keeps two filters per device,
+an exponential moving average and a 1-D Kalman filter, in NumPy arrays indexed by a
+device slot. All RSSI values of a scan window are applied with one call to update(),
+with array operations instead of a Python loop per device. Values which arrive one by
+one are collected with add(), and applied together once per window.
+
+The distance is estimated with the log-distance path loss model, from the TxPower of
+the device, when the device advertises one:
+
+    distance = 10 ** ((txpower - ONE_METER_LOSS - rssi) / (10 * path_loss_exponent))
+"""
+
+# global imports
+import time
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Path loss from 0 m to 1 m in dB. TxPower is the power at 0 m.
+ONE_METER_LOSS = 41
+
+
+# -----------------------------------------------------------------------------
+class RssiSmoother:
+    """Per-device EMA and Kalman filter state of the RSSI
+
+    >>> smoother = RssiSmoother()
+    >>> smoother.update(["AA:BB:CC:DD:EE:FF"] * 3, [-60, -70, -60])
+    >>> smoother.set_txpower(["AA:BB:CC:DD:EE:FF"], [-12])
+    >>> ema, kalman, distance = smoother.get("AA:BB:CC:DD:EE:FF")
+    >>> round(ema, 1), round(kalman, 1), round(distance, 2)
+    (-62.1, -63.3, 3.27)
+    """
+
+    def __init__(self, capacity=1024, alpha=0.3, process_noise=0.5, measurement_noise=16.0, path_loss_exponent=2.0,
+                 window=1.0, clock=time.monotonic):
+        """
+        :param capacity: Initial number of device slots. The arrays grow when needed.
+        :param alpha: Weight of a new value in the exponential moving average
+        :param process_noise: Kalman process noise variance, per update, in dB^2
+        :param measurement_noise: Kalman measurement noise variance, in dB^2
+        :param path_loss_exponent: 2.0 in free space, 2.5-4 indoors
+        :param window: Number of seconds to collect values with add() before they are applied
+        :param clock: function returning the current time in seconds
+        """
+
+        if np is None:
+            raise ImportError("RssiSmoother needs the numpy package")
+
+        self.alpha = alpha
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.path_loss_exponent = path_loss_exponent
+        self.window = window
+        self.clock = clock
+        self.window_start = None
+        self.pending_addresses = []
+        self.pending_rssis = []
+
+        self.slots = {}  # key is the address, value is the index in the arrays
+        self.count = np.zeros(capacity, dtype=np.int64)  # number of RSSI values
+        self.ema = np.zeros(capacity)
+        self.kalman = np.zeros(capacity)  # Kalman estimate
+        self.variance = np.zeros(capacity)  # Kalman estimate variance
+        self.txpower = np.full(capacity, np.nan)
+
+    # -------------------------------------------------------------------------
+    def _grow(self, capacity):
+        """Enlarge the arrays to capacity slots"""
+
+        extra = capacity - len(self.count)
+        self.count = np.concatenate((self.count, np.zeros(extra, dtype=np.int64)))
+        self.ema = np.concatenate((self.ema, np.zeros(extra)))
+        self.kalman = np.concatenate((self.kalman, np.zeros(extra)))
+        self.variance = np.concatenate((self.variance, np.zeros(extra)))
+        self.txpower = np.concatenate((self.txpower, np.full(extra, np.nan)))
+
+    def slot_of(self, addresses):
+        """Return the slot indexes of the addresses, adding new devices
+
+        :param addresses: list of BT addresses
+        :returns: int array of slot indexes
+        """
+
+        slots = self.slots
+        try:
+            indexes = np.array(itemgetter(*addresses)(slots), dtype=np.int64, ndmin=1)
+        except KeyError:
+            # There are new devices
+            indexes = np.fromiter((slots.setdefault(addr, len(slots)) for addr in addresses), dtype=np.int64, count=len(addresses))
+        if len(slots) > len(self.count):
+            self._grow(max(len(slots), 2 * len(self.count)))
+        return indexes
+
+    # -------------------------------------------------------------------------
+    def update(self, addresses, rssis):
+        """Apply the RSSI values of a scan window
+
+        Values of the same device are applied in the given order.
+
+        :param addresses: list of BT addresses
+        :param rssis: RSSI values in dBm, same length as addresses
+        """
+
+        if not len(addresses):
+            return
+        slots = self.slot_of(addresses)
+        rssis = np.fromiter(rssis, dtype=np.float64, count=len(rssis))
+
+        # Rank of every value within its device, the n-th value of a device is applied
+        # in round n, so each round updates every slot at most once
+        order = np.argsort(slots, kind="stable")
+        sorted_slots = slots[order]
+        starts = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+        if len(starts) == len(slots):
+            # Every device has one value, a single round
+            self._apply(slots, rssis)
+            return
+        lengths = np.diff(np.r_[starts, len(slots)])
+        ranks = np.arange(len(slots)) - np.repeat(starts, lengths)
+
+        # Values sorted by round, and sorted by device within each round
+        by_rank = order[np.argsort(ranks, kind="stable")]
+        ends = np.cumsum(np.bincount(ranks))
+        begin = 0
+        for end in ends:
+            selected = by_rank[begin:end]
+            self._apply(slots[selected], rssis[selected])
+            begin = end
+
+    def add(self, addr, rssi):
+        """Collect one RSSI value. The values are applied when the window has passed.
+
+        :param addr: The BT address
+        :param rssi: RSSI value in dBm
+        """
+
+        now = self.clock()
+        if self.window_start is None:
+            self.window_start = now
+        self.pending_addresses.append(addr)
+        self.pending_rssis.append(rssi)
+        if now - self.window_start >= self.window:
+            self.flush()
+
+    def flush(self):
+        """Apply the values collected with add()"""
+
+        self.update(self.pending_addresses, self.pending_rssis)
+        self.pending_addresses = []
+        self.pending_rssis = []
+        self.window_start = None
+
+    def _apply(self, slots, rssis):
+        """Apply one value to each of the (unique) slots"""
+
+        new = self.count[slots] == 0
+        if new.any():
+            # The first value initializes the filters
+            first = slots[new]
+            self.ema[first] = rssis[new]
+            self.kalman[first] = rssis[new]
+            self.variance[first] = self.measurement_noise
+            self.count[first] = 1
+            slots = slots[~new]
+            rssis = rssis[~new]
+
+        self.count[slots] += 1
+        self.ema[slots] += self.alpha * (rssis - self.ema[slots])
+
+        variance = self.variance[slots] + self.process_noise
+        gain = variance / (variance + self.measurement_noise)
+        self.kalman[slots] += gain * (rssis - self.kalman[slots])
+        self.variance[slots] = (1 - gain) * variance
+
+    # -------------------------------------------------------------------------
+    def set_txpower(self, addresses, txpowers):
+        """Set the TxPower of devices, used for the distance estimation
+
+        :param addresses: list of BT addresses
+        :param txpowers: TxPower values in dBm, same length as addresses
+        """
+
+        self.txpower[self.slot_of(addresses)] = txpowers
+
+    def distances(self):
+        """Estimated distance in meters of every slot, from the Kalman estimate.
+        NaN for devices without TxPower or RSSI.
+        """
+
+        used = len(self.slots)
+        rssi = np.where(self.count[:used] > 0, self.kalman[:used], np.nan)
+        return 10 ** ((self.txpower[:used] - ONE_METER_LOSS - rssi) / (10 * self.path_loss_exponent))
+
+    # -------------------------------------------------------------------------
+    def get(self, addr):
+        """Return the state of a device
+
+        :returns: tuple of (EMA, Kalman estimate, distance in meters), with None for unknown values
+        """
+
+        slot = self.slots.get(addr)
+        if slot is None or not self.count[slot]:
+            return None, None, None
+        txpower = self.txpower[slot]
+        distance = None
+        if not np.isnan(txpower):
+            distance = float(10 ** ((txpower - ONE_METER_LOSS - self.kalman[slot]) / (10 * self.path_loss_exponent)))
+        return float(self.ema[slot]), float(self.kalman[slot]), distance
+
+    def __len__(self):
+        return len(self.slots)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
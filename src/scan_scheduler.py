@@ -0,0 +1,142 @@
+##
+# @file: scan_scheduler.py
+# @brief: Adaptive scan duty-cycle scheduler
+
+"""Adaptive scan duty-cycle scheduler
+
+Scanning continuously keeps the adapter busy, while most of the time no new devices
+show up. DutyCycleScheduler alternates scan windows with idle gaps, and takes turns
+between the transports (LE and classic BR/EDR discovery). Per transport, the window
+grows while it finds new devices, and shrinks when it does not. The idle gap shrinks
+when new devices are found and grows otherwise. duty_cycle() is the achieved fraction
+of the time the adapter was scanning.
+
+A scan loop looks like:
+
+    scheduler = DutyCycleScheduler()
+    while True:
+        transport, window = scheduler.next_window()
+        new_devices = scan(transport, window)
+        scheduler.report(transport, window, new_devices)
+        time.sleep(scheduler.idle_gap())
+"""
+
+# global imports
+from collections import namedtuple
+
+# A finished scan window, duration in seconds
+ScanWindow = namedtuple("ScanWindow", "transport duration new_devices")
+
+
+# -----------------------------------------------------------------------------
+class DutyCycleScheduler:
+    """Scan window and idle gap lengths, adapted to the rate of new devices
+
+    >>> scheduler = DutyCycleScheduler(min_window=2, max_window=16, start_window=4)
+    >>> scheduler.next_window()
+    ('le', 4)
+    >>> scheduler.report("le", 4, new_devices=3)
+    >>> scheduler.next_window()
+    ('bredr', 4)
+    >>> scheduler.report("bredr", 4, new_devices=0)
+    >>> scheduler.next_window(), scheduler.next_window()
+    (('le', 8.0), ('bredr', 2))
+    """
+
+    def __init__(self, transports=("le", "bredr"), min_window=2.0, max_window=30.0, start_window=10.0,
+                 min_idle=0.0, max_idle=60.0, min_rate=0.05, grow=2.0, shrink=0.5):
+        """
+        :param transports: The transports to take turns with, in bluetoothctl 'scan' terms
+        :param min_window: Shortest scan window in seconds
+        :param max_window: Longest scan window in seconds
+        :param start_window: First scan window of each transport
+        :param min_idle: Shortest idle gap in seconds
+        :param max_idle: Longest idle gap in seconds
+        :param min_rate: Number of new devices per second, below which a window counts as quiet
+        :param grow: Factor for the window after a busy window, and for the idle gap after quiet ones
+        :param shrink: Factor for the window after a quiet window
+        """
+
+        self.transports = transports
+        self.min_window = min_window
+        self.max_window = max_window
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.min_rate = min_rate
+        self.grow = grow
+        self.shrink = shrink
+
+        self.windows = {transport: start_window for transport in transports}
+        self.idle = min_idle
+        self.turn = 0
+        self.busy = False  # True if a window of the current round found new devices
+
+        self.scan_time = 0.0
+        self.idle_time = 0.0
+        self.history = []  # list of ScanWindow
+
+    # -------------------------------------------------------------------------
+    def next_window(self) -> tuple:
+        """Return the next scan window
+
+        :returns: tuple of (transport, window in seconds)
+        """
+
+        transport = self.transports[self.turn % len(self.transports)]
+        self.turn += 1
+        return transport, self.windows[transport]
+
+    # -------------------------------------------------------------------------
+    def report(self, transport, duration, new_devices):
+        """Adapt to the result of a scan window
+
+        :param transport: The transport of the window
+        :param duration: Number of seconds the window actually took
+        :param new_devices: Number of devices found which were not seen before
+        """
+
+        self.scan_time += duration
+        self.history.append(ScanWindow(transport, duration, new_devices))
+
+        window = self.windows[transport]
+        if duration and new_devices / duration >= self.min_rate:
+            self.windows[transport] = min(self.max_window, window * self.grow)
+            self.busy = True
+        else:
+            self.windows[transport] = max(self.min_window, window * self.shrink)
+
+    # -------------------------------------------------------------------------
+    def idle_gap(self) -> float:
+        """Return the idle gap before the next window, in seconds
+
+        The gap is only taken after a round over all transports. It is reset after a
+        round with new devices, and grows after a quiet round.
+        """
+
+        if self.turn % len(self.transports):
+            return 0.0
+        if self.busy:
+            self.idle = self.min_idle
+        else:
+            self.idle = min(self.max_idle, max(self.idle * self.grow, self.min_window))
+        self.busy = False
+        self.idle_time += self.idle
+        return self.idle
+
+    # -------------------------------------------------------------------------
+    def duty_cycle(self) -> float:
+        """Fraction of the time spent scanning, 0.0 .. 1.0"""
+
+        total = self.scan_time + self.idle_time
+        return self.scan_time / total if total else 0.0
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
@@ -0,0 +1,329 @@
+##
+# @file: sighting_buffer.py
+# @brief: Chunked columnar in-memory sighting buffer with NumPy
+
+"""Chunked columnar in-memory sighting buffer with NumPy
+
+SightingBuffer keeps the recent sightings in memory for analytics, without SQLite and
+without a Python object per sighting. The sightings are appended to preallocated
+NumPy structured array chunks of SIGHTING_DTYPE, 16 bytes per sighting. The address
+is stored as a small integer id, see addresses.
+
+A chunk covers at most chunk_seconds of sightings. Chunks which are older than the
+retention are dropped as a whole, and their array is reused for the next chunk. A
+chunk which is closed by its time span while less than half full is shrunk to a copy
+of its sightings, so a slow stream of sightings does not hold mostly empty arrays. Since
+each chunk knows its oldest and newest timestamp, a query over the last N minutes
+only looks at the chunks which overlap that time range.
+
+views() gives zero-copy access to the chunks of a time range. window() returns the
+sightings of a time range as one array, a copy when they span several chunks, which can
+be filtered with NumPy masks. group_by() computes statistics per device without a Python
+loop, and to_pandas() makes a DataFrame of a window(), if pandas is installed.
+
+It has the same sighting API as DeviceDatabase, and can be plugged in with
+DeviceDatabase(filename, sighting_store=SightingBuffer()).
+"""
+
+# global imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+# Data type of one sighting
+SIGHTING_DTYPE = np.dtype([("addr_id", "<u4"), ("ts", "<f8"), ("rssi", "<i2"), ("adapter", "<u2")]) if np else None
+
+# Data type of the group_by() result
+DEVICE_STATS_DTYPE = np.dtype([
+    ("addr_id", "<u4"), ("count", "<i8"), ("mean_rssi", "<f8"), ("min_rssi", "<i2"), ("max_rssi", "<i2"),
+    ("first_seen", "<f8"), ("last_seen", "<f8"),
+]) if np else None
+
+
+# -----------------------------------------------------------------------------
+class SightingChunk:
+    """A preallocated array of sightings, filled from the start"""
+
+    __slots__ = ("data", "count", "t_start", "t_min", "t_max")
+
+    def __init__(self, data, t_start):
+        self.data = data
+        self.count = 0
+        self.t_start = t_start  # timestamp of the first sighting, which sets the time span of the chunk
+        self.t_min = float("inf")
+        self.t_max = float("-inf")
+
+    def view(self):
+        """Zero-copy view of the filled part"""
+        return self.data[:self.count]
+
+
+# -----------------------------------------------------------------------------
+class SightingBuffer:
+    """Recent sightings in NumPy structured array chunks
+
+    >>> buffer = SightingBuffer(chunk_size=4, chunk_seconds=60.0, retention=300.0)
+    >>> buffer.add_sightings([("D8:DD:6B:81:74:8B", 1000.0 + i, -60 - i, 0) for i in range(6)])
+    True
+    >>> buffer.add_sighting("24:FC:E5:8F:AB:89", 1010.0, -50)
+    True
+    >>> len(buffer), len(buffer.chunks)
+    (7, 2)
+    >>> stats = buffer.group_by(seconds=8, now=1010.0)
+    >>> [(buffer.addresses[row["addr_id"]], int(row["count"]), float(row["mean_rssi"])) for row in stats]
+    [('D8:DD:6B:81:74:8B', 4, -63.5), ('24:FC:E5:8F:AB:89', 1, -50.0)]
+    """
+
+    def __init__(self, chunk_size=1 << 16, chunk_seconds=60.0, retention=3600.0):
+        """
+        :param chunk_size: Number of sightings per chunk
+        :param chunk_seconds: Maximum time span of the sightings in a chunk
+        :param retention: Number of seconds to keep the sightings, after the newest sighting
+        """
+
+        if np is None:
+            raise ImportError("SightingBuffer needs the numpy package")
+
+        self.chunk_size = chunk_size
+        self.chunk_seconds = chunk_seconds
+        self.retention = retention
+
+        self.ids = {}  # key is the address, value is the addr_id
+        self.addresses = []  # the address of each addr_id
+        self.chunks = []  # SightingChunk, oldest first
+        self.free = []  # arrays of dropped chunks, for reuse
+        self.newest = float("-inf")
+
+    # -------------------------------------------------------------------------
+    def addr_id(self, addr) -> int:
+        """Return the id of an address, and assign one if it is new"""
+
+        addr_id = self.ids.get(addr)
+        if addr_id is None:
+            addr_id = self.ids[addr] = len(self.addresses)
+            self.addresses.append(addr)
+        return addr_id
+
+    def _new_chunk(self, t_start) -> SightingChunk:
+        if self.chunks and self.chunks[-1].count < self.chunk_size // 2:
+            # Closed by its time span while mostly empty: keep a copy of the filled part,
+            # and reuse the array for the next chunk
+            chunk = self.chunks[-1]
+            self.free.append(chunk.data)
+            chunk.data = chunk.view().copy()
+        data = self.free.pop() if self.free else np.empty(self.chunk_size, dtype=SIGHTING_DTYPE)
+        chunk = SightingChunk(data, t_start)
+        self.chunks.append(chunk)
+        return chunk
+
+    def _rotate(self):
+        """Drop the chunks of which all sightings are older than the retention"""
+
+        limit = self.newest - self.retention
+        while len(self.chunks) > 1 and self.chunks[0].t_max < limit:
+            data = self.chunks.pop(0).data
+            if len(data) == self.chunk_size:
+                self.free.append(data)
+
+    # -------------------------------------------------------------------------
+    def append(self, addr_ids, timestamps, rssis, adapters=0):
+        """Append a batch of sightings, given as columns
+
+        :param addr_ids: array of addr_id values, see addr_id()
+        :param timestamps: array of time.time() values, mostly in ascending order
+        :param rssis: array of RSSI values
+        :param adapters: array of adapter indexes, or one index for all
+        """
+
+        addr_ids = np.asarray(addr_ids, dtype=np.uint32)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        rssis = np.asarray(rssis, dtype=np.int16)
+        adapters = np.broadcast_to(np.asarray(adapters, dtype=np.uint16), addr_ids.shape)
+
+        done = 0
+        while done < len(addr_ids):
+            chunk = self.chunks[-1] if self.chunks else None
+            if chunk is None or chunk.count == self.chunk_size or timestamps[done] >= chunk.t_start + self.chunk_seconds:
+                chunk = self._new_chunk(timestamps[done])
+
+            # Up to the chunk size, and up to the first sighting beyond the time span of the chunk
+            n = min(self.chunk_size - chunk.count, len(addr_ids) - done)
+            beyond = np.flatnonzero(timestamps[done:done + n] >= chunk.t_start + self.chunk_seconds)
+            if len(beyond):
+                n = beyond[0]
+
+            rows = chunk.data[chunk.count:chunk.count + n]
+            rows["addr_id"] = addr_ids[done:done + n]
+            rows["ts"] = timestamps[done:done + n]
+            rows["rssi"] = rssis[done:done + n]
+            rows["adapter"] = adapters[done:done + n]
+            chunk.count += n
+            chunk.t_min = min(chunk.t_min, timestamps[done:done + n].min())
+            chunk.t_max = max(chunk.t_max, timestamps[done:done + n].max())
+            self.newest = max(self.newest, chunk.t_max)
+            done += n
+        self._rotate()
+
+    # -------------------------------------------------------------------------
+    def add_sighting(self, addr, timestamp, rssi, adapter=0) -> bool:
+        """Store a single sighting of a device. See DeviceDatabase.add_sighting()"""
+
+        chunk = self.chunks[-1] if self.chunks else None
+        if chunk is None or chunk.count == self.chunk_size or timestamp >= chunk.t_start + self.chunk_seconds:
+            chunk = self._new_chunk(timestamp)
+        chunk.data[chunk.count] = (self.addr_id(addr), timestamp, rssi, adapter)
+        chunk.count += 1
+        if timestamp < chunk.t_min:
+            chunk.t_min = timestamp
+        if timestamp > chunk.t_max:
+            chunk.t_max = timestamp
+            if timestamp > self.newest:
+                self.newest = timestamp
+                if self.chunks[0].t_max < timestamp - self.retention:
+                    self._rotate()
+        return True
+
+    def add_sightings(self, sightings) -> bool:
+        """Append a batch of sightings. See DeviceDatabase.add_sightings()"""
+
+        sightings = list(sightings)
+        if sightings:
+            addrs, timestamps, rssis, adapters = zip(*sightings)
+            self.append([self.addr_id(addr) for addr in addrs], timestamps, rssis, adapters)
+        return True
+
+    def get_sightings(self, addr=None, start=None, end=None) -> list:
+        """Get the sightings. See DeviceDatabase.get_sightings()"""
+
+        rows = self.window(start=start, end=end)
+        if addr is not None:
+            if addr not in self.ids:
+                return []
+            rows = rows[rows["addr_id"] == self.ids[addr]]
+        addresses = self.addresses
+        return [(addresses[addr_id], ts, rssi, adapter) for addr_id, ts, rssi, adapter in rows.tolist()]
+
+    def commit(self) -> bool:
+        return True
+
+    def close(self) -> bool:
+        return True
+
+    # -------------------------------------------------------------------------
+    def views(self, start=None, end=None) -> list:
+        """Zero-copy views of the chunks which overlap a time range
+
+        The views may contain sightings outside the time range. They are only valid until
+        the next append, which may shrink a chunk or reuse the array of a dropped chunk.
+
+        :param start: Oldest timestamp (inclusive), or None
+        :param end: Newest timestamp (inclusive), or None
+        :returns: list of structured arrays
+        """
+
+        low = float("-inf") if start is None else start
+        high = float("inf") if end is None else end
+        return [chunk.view() for chunk in self.chunks if chunk.count and chunk.t_max >= low and chunk.t_min <= high]
+
+    def window(self, seconds=None, now=None, start=None, end=None):
+        """Return the sightings within a time range, as one structured array
+
+        :param seconds: Only the last seconds before now, instead of start
+        :param now: The end of the last seconds, default the newest sighting
+        :param start: Oldest timestamp (inclusive), or None
+        :param end: Newest timestamp (inclusive), or None
+        :returns: structured array of SIGHTING_DTYPE, in order of arrival
+        """
+
+        if seconds is not None:
+            now = self.newest if now is None else now
+            start, end = now - seconds, now if end is None else end
+        low = float("-inf") if start is None else start
+        high = float("inf") if end is None else end
+
+        parts = []
+        for chunk in self.chunks:
+            if not chunk.count or chunk.t_max < low or chunk.t_min > high:
+                continue
+            rows = chunk.view()
+            if chunk.t_min < low or chunk.t_max > high:
+                ts = rows["ts"]
+                rows = rows[(ts >= low) & (ts <= high)]
+            parts.append(rows)
+        if not parts:
+            return np.empty(0, dtype=SIGHTING_DTYPE)
+        return np.concatenate(parts)
+
+    # -------------------------------------------------------------------------
+    def group_by(self, seconds=None, now=None, rows=None):
+        """Statistics per device, of the sightings of the last seconds
+
+        :param seconds: Only the last seconds before now, default all sightings
+        :param now: The end of the last seconds, default the newest sighting
+        :param rows: The sightings to use, instead of a window(), e.g. after filtering with a mask
+        :returns: structured array of DEVICE_STATS_DTYPE, one row per device, in order of addr_id
+        """
+
+        if rows is None:
+            rows = self.window(seconds, now)
+        if not len(rows):
+            return np.empty(0, dtype=DEVICE_STATS_DTYPE)
+
+        order = np.argsort(rows["addr_id"], kind="stable")
+        ids = rows["addr_id"][order]
+        rssi = rows["rssi"][order]
+        ts = rows["ts"][order]
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+
+        stats = np.empty(len(starts), dtype=DEVICE_STATS_DTYPE)
+        stats["addr_id"] = ids[starts]
+        stats["count"] = np.diff(np.r_[starts, len(ids)])
+        stats["mean_rssi"] = np.add.reduceat(rssi.astype(np.int64), starts) / stats["count"]
+        stats["min_rssi"] = np.minimum.reduceat(rssi, starts)
+        stats["max_rssi"] = np.maximum.reduceat(rssi, starts)
+        stats["first_seen"] = np.minimum.reduceat(ts, starts)
+        stats["last_seen"] = np.maximum.reduceat(ts, starts)
+        return stats
+
+    # -------------------------------------------------------------------------
+    def to_pandas(self, seconds=None, now=None):
+        """Return the sightings of the last seconds as a pandas DataFrame
+
+        This is not zero-copy: window() copies the sightings into one array when they
+        span several chunks, and pandas may copy the columns again. Use views() to work
+        on the chunks without copying. The addr column is categorical, with the
+        addresses as categories.
+        """
+
+        if pd is None:
+            raise ImportError("SightingBuffer.to_pandas() needs the pandas package")
+
+        rows = self.window(seconds, now)
+        frame = pd.DataFrame({name: rows[name] for name in ("ts", "rssi", "adapter")}, copy=False)
+        frame.insert(0, "addr", pd.Categorical.from_codes(rows["addr_id"].astype(np.int32), categories=self.addresses))
+        return frame
+
+    def __len__(self):
+        return sum(chunk.count for chunk in self.chunks)
+
+    def nbytes(self) -> int:
+        """Memory of the chunk arrays, including the reusable ones"""
+
+        return sum(chunk.data.nbytes for chunk in self.chunks) + sum(data.nbytes for data in self.free)
+
+
+# =============================================================================
+if __name__ == "__main__":
+
+    import sys
+    import doctest
+
+    failed, tested = doctest.testmod(optionflags=doctest.NORMALIZE_WHITESPACE)
+    if not failed == 0:
+        sys.exit(0)
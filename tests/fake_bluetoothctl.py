@@ -0,0 +1,98 @@
+"""Minimal bluetoothctl stand-in for the session tests.
+Prints a colored prompt, answers 'devices', 'info', 'list', 'select' and 'scan', and prints
+an asynchronous event before every info response. 'scan le' and 'scan bredr' each find one
+device, 'scan on' finds the devices in range of the selected controller.
+Like bluetoothctl, its output is block buffered when it does not go to a terminal.
+"""
+
+import sys
+import time
+
+PROMPT = "\x01\x1b[0;94m\x02[bluetooth]\x01\x1b[0m\x02# "
+
+DEVICES = """Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)
+Device D8:DD:6B:81:74:8B Hue Lamp
+"""
+
+SCAN = {
+    "le": "[\x1b[0;92mNEW\x1b[0m] Device D8:DD:6B:81:74:8B Hue Lamp\n",
+    "bredr": "[\x1b[0;92mNEW\x1b[0m] Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n",
+}
+
+CONTROLLERS = {
+    "B8:27:EB:6D:21:BE": "raspberrypi [default]",
+    "00:1A:7D:DA:71:13": "raspberrypi #2",
+}
+
+# Devices in range of each controller, with their RSSI
+IN_RANGE = {
+    "B8:27:EB:6D:21:BE": [("D8:DD:6B:81:74:8B", -60), ("24:FC:E5:8F:AB:89", -70)],
+    "00:1A:7D:DA:71:13": [("24:FC:E5:8F:AB:89", -50), ("5A:B5:65:89:46:37", -80)],
+}
+
+selected = ["B8:27:EB:6D:21:BE"]
+
+INFO = """Device {addr} (public)
+\tName: [TV] Samsung Q70 Series (49)
+\tPaired: no
+\tRSSI: -62
+"""
+
+
+def run(cmd):
+    if cmd == ["devices"]:
+        sys.stdout.write(DEVICES)
+    elif cmd[:1] == ["info"]:
+        if cmd[1] in DEVICES:
+            sys.stdout.write(INFO.format(addr=cmd[1]))
+        else:
+            sys.stdout.write(f"Device {cmd[1]} not available\n")
+    elif cmd == ["list"]:
+        for addr, name in CONTROLLERS.items():
+            sys.stdout.write(f"Controller {addr} {name}\n")
+    elif cmd[:1] == ["select"]:
+        selected[0] = cmd[1]
+    elif cmd[:1] == ["scan"]:
+        if cmd[1] == "off":
+            sys.stdout.write("Discovery stopped\n")
+        elif cmd[1] == "on":
+            sys.stdout.write("Discovery started\n")
+            for addr, rssi in IN_RANGE[selected[0]]:
+                sys.stdout.write(f"[\x1b[0;92mNEW\x1b[0m] Device {addr} {addr.replace(':', '-')}\n")
+                sys.stdout.write(f"[\x1b[0;93mCHG\x1b[0m] Device {addr} RSSI: {rssi}\n")
+        else:
+            sys.stdout.write("Discovery started\n" + PROMPT + SCAN.get(cmd[1], ""))
+
+
+def main():
+    # Block buffered unless on a terminal, even with python -u or PYTHONUNBUFFERED
+    sys.stdout = open(sys.stdout.fileno(), "w", buffering=1 if sys.stdout.isatty() else 8192, closefd=False)
+
+    # Non-interactive, like 'bluetoothctl info 24:FC:E5:8F:AB:89', or like
+    # 'bluetoothctl --timeout 30 scan on', which keeps running for the timeout
+    if len(sys.argv) > 1:
+        args = sys.argv[1:]
+        timeout = 0
+        if args[0] == "--timeout":
+            timeout = float(args[1])
+            args = args[2:]
+        run(args)
+        time.sleep(timeout)
+        return
+
+    sys.stdout.write("Agent registered\n" + PROMPT)
+    sys.stdout.flush()
+    for line in sys.stdin:
+        cmd = line.split()
+        if cmd == ["quit"]:
+            break
+        if cmd[:1] == ["info"]:
+            sys.stdout.write("\r\x1b[K[\x1b[0;93mCHG\x1b[0m] Device D8:DD:6B:81:74:8B RSSI: -70\n" + PROMPT)
+            sys.stdout.flush()
+        run(cmd)
+        sys.stdout.write(PROMPT)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
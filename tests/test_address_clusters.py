@@ -0,0 +1,120 @@
+# global imports
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from address_clusters import AddressClusters, address_kind, shape_of
+from device_registry import DeviceRegistry
+from info_refresh import RefreshScheduler
+from py_bluetoothctl_scan import ScanEvent
+import py_bluetoothctl_scan
+
+
+def rpa(i):
+    """A resolvable private address"""
+    return f'4A:00:00:00:{i // 256:02X}:{i % 256:02X}'
+
+
+def test_address_kind():
+
+    assert address_kind('D8:DD:6B:81:74:8B') == 'public'
+    assert address_kind('D8:DD:6B:81:74:8B', 'random') == 'static'
+    assert address_kind('5A:B5:65:89:46:37') == 'resolvable'
+    assert address_kind('1A:B5:65:89:46:37') == 'non-resolvable'
+    assert address_kind('5A:B5:65:89:46:37', 'public') == 'public'
+
+
+def test_rotation_chain():
+
+    clusters = AddressClusters(max_gap=10.0, settle_time=5.0, clock=lambda: 0.0)
+    now = 0.0
+    for rotation in range(20):
+        for _sighting in range(100):
+            cid = clusters.resolve(rpa(rotation), now=now, rssi=-60 + rotation % 3, shape=shape_of({6: b'\x01' * 27}))
+            now += 2.0
+        # The old address falls silent before the new address appears
+        now += 3.0
+
+    assert cid == rpa(0)
+    assert len(clusters) == 1
+    assert clusters.links == 19
+    assert clusters.current(cid) == rpa(19)
+    assert len(clusters.aliases) == 1 + clusters.max_aliases
+    assert len(clusters.pop_merged()) == 19
+
+
+def test_active_devices_are_not_merged():
+
+    clusters = AddressClusters(max_gap=10.0, settle_time=5.0, clock=lambda: 0.0)
+    for second in range(0, 60, 2):
+        clusters.resolve(rpa(1), now=float(second), rssi=-60)
+        # Same RSSI, but both are active at the same time
+        if second >= 20:
+            clusters.resolve(rpa(2), now=float(second) + 1, rssi=-61)
+        # Silent after the first sighting, but the next address has a different payload shape
+        if second == 40:
+            clusters.resolve(rpa(3), now=40.0, shape=shape_of({0x004C: b'\x10\x05'}))
+            clusters.resolve(rpa(4), now=45.0, shape=shape_of({0x004C: b'\x12\x19\x00'}))
+
+    assert clusters.pop_merged() == []
+    assert len(clusters) == 4
+    assert not clusters.provisional
+
+
+def test_superseded_address_splits():
+
+    clusters = AddressClusters(max_gap=10.0, settle_time=5.0, clock=lambda: 0.0)
+    clusters.resolve(rpa(1), now=0.0, name='Tile')
+    clusters.resolve(rpa(2), now=5.0, name='Tile')
+    clusters.resolve(rpa(2), now=12.0)
+    assert clusters.lookup(rpa(2)) == rpa(1)
+
+    # The first address was only silent for a while: a device of its own
+    assert clusters.resolve(rpa(1), now=20.0) == rpa(1)
+    assert clusters.resolve(rpa(2), now=21.0) == rpa(2)
+    assert clusters.splits == 1 and len(clusters) == 2
+
+
+def test_expire():
+
+    clusters = AddressClusters(max_gap=10.0, settle_time=5.0, expire_after=100.0, clock=lambda: 0.0)
+    # Too far apart to be rotations of one device
+    for i in range(1000):
+        clusters.resolve(rpa(i), now=20.0 * i)
+    # Public addresses are not tracked
+    clusters.resolve('D8:DD:6B:81:74:8B', now=20000.0)
+
+    # Only the addresses of the last expire_after seconds, and of the time since the last expire()
+    assert len(clusters) <= 7
+    assert len(clusters.aliases) == len(clusters)
+    assert all(len(ids) for ids in clusters.index.values())
+
+
+def test_registry_stays_bounded(monkeypatch):
+
+    time = [0.0]
+    monkeypatch.setattr(py_bluetoothctl_scan, 'clusters', AddressClusters(clock=lambda: time[0]))
+    registry = DeviceRegistry()
+    monkeypatch.setattr(py_bluetoothctl_scan, 'registry', registry)
+    refresh = RefreshScheduler(clock=lambda: time[0])
+    monkeypatch.setattr(py_bluetoothctl_scan, 'refresh', refresh)
+
+    for rotation in range(10):
+        addr = f'7B:00:00:00:00:{rotation:02X}'
+        refresh.add(addr)
+        py_bluetoothctl_scan.apply_scan_event(ScanEvent('NEW', addr, 'Name', addr.replace(':', '-')))
+        for _sighting in range(30):
+            time[0] += 1.0
+            py_bluetoothctl_scan.apply_scan_event(ScanEvent('CHG', addr, 'RSSI', -70))
+            py_bluetoothctl_scan.apply_merges()
+        time[0] += 2.0
+
+    # bluez forgets the old addresses, which is not the device going away
+    assert py_bluetoothctl_scan.apply_scan_event(ScanEvent('DEL', '7B:00:00:00:00:03', 'Name', '')) is None
+
+    assert list(registry.devices) == ['7B:00:00:00:00:00']
+    # The provisional addresses are not refreshed, nor saved
+    assert list(refresh.devices) == ['7B:00:00:00:00:00']
+    assert registry.get('7B:00:00:00:00:00').rssi == -70
@@ -0,0 +1,51 @@
+# global imports
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+import adv_decoders
+from adv_decoders import decode_advertisement, decode_manufacturer_data, decode_service_data, service_uuid
+from info_parser import parse_info
+import py_bluetoothctl_scan
+
+
+def test_exposure_notification_fixture():
+
+    info = parse_info(py_bluetoothctl_scan.test_info_servicedata)
+    decoded = decode_advertisement(info.manufacturer_data, info.service_data)
+
+    assert len(decoded) == 1
+    assert decoded[0].rpi == bytes.fromhex('d7e5ea9f94474c30aa0c44a955260dd9')
+    assert decoded[0].aem == bytes.fromhex('4fb78cfd')
+
+
+def test_unknown_and_short_payloads():
+
+    # Samsung (0x0075) has no decoder
+    info = parse_info(py_bluetoothctl_scan.test_info_manufdata)
+    assert decode_advertisement(info.manufacturer_data, info.service_data) == []
+
+    assert decode_manufacturer_data(0x004C, bytes.fromhex('0215f782')) is None
+    assert decode_manufacturer_data(0x004C, bytes.fromhex('1005031c2a6b21')) is None
+    assert decode_service_data(service_uuid(0xFD6F), b'') is None
+    assert decode_service_data(service_uuid(0xFEAA), b'') is None
+
+
+def test_eddystone_url():
+
+    url = decode_service_data(service_uuid(0xFEAA), b'\x10\xee\x01example\x00path')
+    assert url == adv_decoders.EddystoneURL(-18, 'https://www.example.com/path')
+
+
+def test_register_decoder():
+
+    @adv_decoders.manufacturer_decoder(0xFFFF)
+    def decode_test(data):
+        return bytes(data[::-1])
+
+    try:
+        assert decode_advertisement({0xFFFF: b'\x01\x02'}) == [b'\x02\x01']
+    finally:
+        del adv_decoders.manufacturer_decoders[0xFFFF]
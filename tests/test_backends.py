@@ -0,0 +1,103 @@
+# global imports
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+import device_backends
+
+
+@pytest.mark.parametrize('kind', list(device_backends.backends))
+def test_backend(kind, tmp_path):
+
+    backend = device_backends.open_backend(kind, tmp_path / 'devices')
+
+    assert backend.add('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1')
+    assert not backend.add('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1')
+    assert backend.upsert('11:22:33:44:55:66', 'testname2', 'testinfo2')
+    assert not backend.upsert('11:22:33:44:55:66', 'testname2', 'testinfo2')
+    assert backend.upsert('11:22:33:44:55:66', 'testname2', 'testinfo3')
+
+    assert backend.search('*') == ['11:22:33:44:55:66', 'aa:bb:cc:dd:ee:ff']
+    assert backend.search(['aa:*', 'AA:*']) == ['aa:bb:cc:dd:ee:ff']
+    assert backend.search('doesnotexist') == []
+
+    assert sorted(backend.iterate()) == [
+        ('11:22:33:44:55:66', 'testname2', 'testinfo3'),
+        ('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1'),
+    ]
+    assert len(backend) == 2
+
+    assert backend.delete('aa:bb:cc:dd:ee:ff')
+    assert not backend.delete('aa:bb:cc:dd:ee:ff')
+    assert list(backend.iterate()) == [('11:22:33:44:55:66', 'testname2', 'testinfo3')]
+    backend.close()
+
+
+def test_unknown_backend():
+
+    with pytest.raises(ValueError):
+        device_backends.open_backend('nosuchbackend')
+
+
+def test_missing_filename():
+
+    with pytest.raises(ValueError, match='needs a filename'):
+        device_backends.open_backend('sqlite')
+    assert len(device_backends.open_backend('memory')) == 0
+
+
+def test_incomplete_backend():
+
+    class NoDelete(device_backends.DeviceBackend):
+        def add(self, addr, name, info):
+            return True
+
+    # Fails at once, not in the middle of a scan
+    with pytest.raises(TypeError):
+        NoDelete()
+
+
+# GLOB patterns where fnmatch and SQLite differ, and some where they agree
+GLOB_PATTERNS = ['*', 'aa:*', 'AA:*', '??:BB:*', '*[0-9]', '*[^0-9]', '[!a]*', '[]a]*', '*[F-A]', 'AA:[0-9',
+                 '*[-]*', '[a-b-]*', '*:5[!5]', '*:5[^5]']
+
+
+@pytest.mark.parametrize('kind', list(device_backends.backends))
+def test_backend_parity(kind, tmp_path):
+
+    entries = [
+        ('AA:BB:CC:DD:EE:FF', 'Hue Lamp', None),
+        ('aa:bb:cc:dd:ee:ff', None, 'testinfo1'),
+        ('11:22:33:44:55:66', None, None),
+        ('!1:22:33:44:55:5A', 'ünïcode', 'multi\nline\0info'),
+        (']a:22:33:44:55:66', '', ''),
+        ('-b:22:33:44:55:66', 'name', 'info'),
+    ]
+
+    backend = device_backends.open_backend(kind, tmp_path / 'devices')
+    for entry in entries:
+        assert backend.add(*entry)
+
+    # None is kept, as in the SQLite backend
+    assert sorted(backend.iterate()) == sorted(entries)
+
+    # The patterns follow the SQLite GLOB operator
+    con = sqlite3.connect(':memory:')
+    for pattern in GLOB_PATTERNS:
+        expected = sorted(addr for addr, _name, _info in entries
+                          if con.execute('select ? glob ?', (addr, pattern)).fetchone()[0])
+        assert backend.search(pattern) == expected, pattern
+    con.close()
+    backend.close()
+
+
+def test_dbm_old_values():
+
+    # Written by the versions which separated the name and info with a NUL
+    assert device_backends.DbmBackend._decode(b'Hue Lamp\0testinfo1') == ('Hue Lamp', 'testinfo1')
+    assert device_backends.DbmBackend._decode(device_backends.DbmBackend._encode(None, 'x\0y')) == (None, 'x\0y')
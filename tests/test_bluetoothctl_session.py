@@ -0,0 +1,49 @@
+# global imports
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from bluetoothctl_session import BluetoothctlSession
+
+fake_bluetoothctl = [sys.executable, '-u', os.path.join(os.path.dirname(__file__), 'fake_bluetoothctl.py')]
+
+
+def test_session():
+
+    with BluetoothctlSession(fake_bluetoothctl) as session:
+
+        devices = session.devices()
+        assert devices.splitlines() == [
+            'Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)',
+            'Device D8:DD:6B:81:74:8B Hue Lamp',
+        ]
+
+        # The same session is reused for every command
+        for _i in range(3):
+            info = session.info('24:FC:E5:8F:AB:89')
+            assert info.splitlines() == [
+                'Device 24:FC:E5:8F:AB:89 (public)',
+                '\tName: [TV] Samsung Q70 Series (49)',
+                '\tPaired: no',
+                '\tRSSI: -62',
+            ]
+
+        assert session.info('00:00:00:00:00:00') == 'Device 00:00:00:00:00:00 not available'
+
+        # The asynchronous events are kept apart
+        assert session.pop_events() == ['[CHG] Device D8:DD:6B:81:74:8B RSSI: -70'] * 4
+        assert session.pop_events() == []
+
+    assert session.process.poll() == 0
+
+
+def test_empty_response():
+
+    with BluetoothctlSession(fake_bluetoothctl, timeout=5.0) as session:
+        start = time.monotonic()
+        assert session.command('select 00:1A:7D:DA:71:13') == ''
+        # Framed on the prompt, not on the timeout
+        assert time.monotonic() - start < 1.0
@@ -0,0 +1,114 @@
+# global imports
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from capture import CaptureWriter, CaptureRecord, read_capture, replay_capture
+from device_dbase import DeviceDatabase
+import py_bluetoothctl_scan
+
+
+def test_round_trip(tmp_path):
+
+    filename = tmp_path / 'site.cap.gz'
+    with CaptureWriter(filename) as writer:
+        writer.write('scan', '[NEW] Device D8:DD:6B:81:74:8B Hue Lamp\n', timestamp=0.5)
+        writer.write('info', py_bluetoothctl_scan.Samsung_Q70_info.encode('utf-8'), timestamp=1.25)
+
+    # Appending keeps the earlier records
+    with CaptureWriter(filename) as writer:
+        writer.write('devices', 'Device D8:DD:6B:81:74:8B Hue Lamp', timestamp=2.0)
+
+    assert list(read_capture(filename)) == [
+        CaptureRecord(0.5, 'scan', '[NEW] Device D8:DD:6B:81:74:8B Hue Lamp\n'),
+        CaptureRecord(1.25, 'info', py_bluetoothctl_scan.Samsung_Q70_info),
+        CaptureRecord(2.0, 'devices', 'Device D8:DD:6B:81:74:8B Hue Lamp'),
+    ]
+
+
+def test_truncated_capture(tmp_path):
+
+    filename = tmp_path / 'site.cap.gz'
+    with CaptureWriter(filename) as writer:
+        for i in range(100):
+            writer.write('scan', f'[CHG] Device D8:DD:6B:81:74:8B RSSI: -{i}\n', timestamp=i)
+
+    # Cut off the compressed stream, like a recorder which was killed
+    raw = filename.read_bytes()
+    filename.write_bytes(raw[:len(raw) // 2])
+
+    records = list(read_capture(filename))
+    assert 0 < len(records) < 100
+    assert records[-1].data == f'[CHG] Device D8:DD:6B:81:74:8B RSSI: -{len(records) - 1}\n'
+
+
+def test_replay_speed(tmp_path):
+
+    filename = tmp_path / 'site.cap.gz'
+    with CaptureWriter(filename) as writer:
+        for timestamp in (0.0, 1.0, 3.0):
+            writer.write('scan', 'line', timestamp=timestamp)
+
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    assert len(list(replay_capture(filename, speed=2.0, sleep=sleep, clock=lambda: now[0]))) == 3
+    assert sleeps == [0.5, 1.0]
+
+    sleeps.clear()
+    assert len(list(replay_capture(filename, speed=0, sleep=sleep, clock=lambda: now[0]))) == 3
+    assert sleeps == []
+
+
+def test_appended_sessions(tmp_path):
+
+    filename = tmp_path / 'site.cap.gz'
+    with CaptureWriter(filename, clock=lambda: 1000.0) as writer:
+        for timestamp in (1000.0, 1002.0):
+            writer.write('scan', f'first {timestamp}', timestamp=timestamp)
+    # Appended an hour later, and a file of an older version, which restarts at 0
+    with CaptureWriter(filename, clock=lambda: 4600.0) as writer:
+        for timestamp in (4600.0, 4601.0):
+            writer.write('scan', f'second {timestamp}', timestamp=timestamp)
+    with CaptureWriter(filename, clock=lambda: 0.0) as writer:
+        for timestamp in (0.0, 0.5):
+            writer.write('scan', f'third {timestamp}', timestamp=timestamp)
+
+    assert [record.source for record in read_capture(filename, sessions=True)].count('session') == 3
+
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    records = list(replay_capture(filename, speed=1.0, sleep=sleep, clock=lambda: now[0]))
+    assert [record.data.split()[0] for record in records] == ['first'] * 2 + ['second'] * 2 + ['third'] * 2
+    # Each session follows the previous one without the pause in between
+    assert sleeps == [2.0, 1.0, 0.5]
+
+
+def test_replay_scan(tmp_path):
+
+    filename = tmp_path / 'site.cap.gz'
+    with CaptureWriter(filename) as writer:
+        writer.write('scan', '\x1b[0;92m[NEW]\x1b[0m Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n')
+        writer.write('scan', '[CHG] Device 24:FC:E5:8F:AB:89 RSSI: -48\n')
+        writer.write('devices', 'Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n')
+        writer.write('info', py_bluetoothctl_scan.Samsung_Q70_info)
+
+    db = DeviceDatabase(tmp_path / 'dbase.sql')
+    data, infos = py_bluetoothctl_scan.replay_scan(filename, 0, db)
+
+    assert py_bluetoothctl_scan.get_mac_addresses(data) == ['24:FC:E5:8F:AB:89']
+    assert infos == [py_bluetoothctl_scan.Samsung_Q70_info]
+    assert py_bluetoothctl_scan.bt_devices['24:FC:E5:8F:AB:89'].rssi == -48
+    assert [rssi for _addr, _ts, rssi, _adapter in db.get_sightings('24:FC:E5:8F:AB:89')] == [-48]
+    db.close()
@@ -0,0 +1,58 @@
+# global imports
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from command import stream_command
+import py_bluetoothctl_scan
+
+# Without -u: the output is block buffered unless it goes to a terminal
+fake_bluetoothctl = f'{sys.executable} {os.path.join(os.path.dirname(__file__), "fake_bluetoothctl.py")}'
+
+
+def test_stream_tty_lines_arrive_while_running():
+
+    start = time.monotonic()
+    lines = stream_command(f'{fake_bluetoothctl} --timeout 30 scan on', tty=True)
+    first = next(lines)
+    assert first == 'Discovery started\n'
+    assert time.monotonic() - start < 10
+    lines.close()
+
+
+def test_stream_tty_until_exit():
+
+    lines = list(stream_command(f'{fake_bluetoothctl} devices', tty=True))
+    assert lines == ['Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n', 'Device D8:DD:6B:81:74:8B Hue Lamp\n']
+
+
+def test_stream_tty_split_reads(tmp_path):
+
+    # In raw mode the terminal passes the bytes unchanged: a character and a \r\n are split over two reads
+    script = tmp_path / 'split.py'
+    script.write_text(
+        'import os, time, tty\n'
+        'tty.setraw(1)\n'
+        'for part in (b"Caf\\xc3", b"\\xa9\\r", b"\\nnext\\r\\n"):\n'
+        '    os.write(1, part)\n'
+        '    time.sleep(0.2)\n'
+    )
+    assert list(stream_command(f'{sys.executable} {script}', tty=True)) == ['Café\n', 'next\n']
+
+
+def test_live_scan_events(monkeypatch):
+
+    monkeypatch.setattr(py_bluetoothctl_scan, 'stream_command',
+                        lambda cmd, **kwargs: stream_command(cmd.replace('bluetoothctl', fake_bluetoothctl, 1), **kwargs))
+    monkeypatch.setattr(py_bluetoothctl_scan, 'run_command', lambda cmd: '')
+
+    start = time.monotonic()
+    events = py_bluetoothctl_scan.live_scan_events(timeout=30)
+    event = next(events)
+    # The scan runs for 30 seconds, but its first event is there at once
+    assert event == py_bluetoothctl_scan.ScanEvent('NEW', 'D8:DD:6B:81:74:8B', 'Name', 'D8-DD-6B-81-74-8B')
+    assert time.monotonic() - start < 10
+    events.close()
@@ -1,6 +1,11 @@
 # global imports
 import pathlib
+import sqlite3
+import struct
 import sys
+import threading
+
+import pytest
 
 sys.path.insert(0, '../src')
 sys.path.insert(0, '../src/lib')
@@ -59,3 +64,196 @@ def test_dbase():
 
     # Delete the test database after the tests
     db.delete()
+
+
+def test_info_history(tmp_path):
+
+    db = device_dbase.DeviceDatabase(tmp_path / 'history.sqlite')
+
+    info1 = "Device aa:bb:cc:dd:ee:ff (random)\n\tRSSI: -60\n\tPaired: no"
+    info2 = "Device aa:bb:cc:dd:ee:ff (random)\n\tRSSI: -72\n\tPaired: no"
+    info3 = "Device aa:bb:cc:dd:ee:ff (random)\n\tRSSI: -72\n\tPaired: yes\n\tTxPower: 4"
+
+    assert db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', info1)
+    assert db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', info2)
+    assert not db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', info2)    # Unchanged, no new history
+    assert db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', info3)
+
+    history = db.get_info_history('aa:bb:cc:dd:ee:ff')
+    assert [info for _timestamp, info in history] == [info1, info2, info3]
+
+    # Only the current info is kept in the devices table
+    assert db.get_all_devices() == [('aa:bb:cc:dd:ee:ff', 'testname1', info3)]
+
+    db.delete()
+
+
+def test_ram_mode(tmp_path):
+
+    dbase_file = tmp_path / 'ram.sqlite'
+    db = device_dbase.DeviceDatabase(dbase_file, ramfile=':memory:', persist_interval=3600, max_unpersisted=4)
+    assert db.in_ram_mode()
+
+    db.add('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1')
+    assert db.unpersisted_changes() == 2     # The device and its first history entry
+    assert not dbase_file.is_file()
+
+    # Reaching max_unpersisted changes forces a persist on commit
+    db.add('11:22:33:44:55:66', 'testname2', 'testinfo2')
+    assert db.unpersisted_changes() == 0
+    assert dbase_file.is_file()
+
+    # A clean close persists the remaining changes
+    db.upsert('11:22:33:44:55:66', 'testname2', 'testinfo3')
+    db.close()
+
+    db = device_dbase.DeviceDatabase(dbase_file, ramfile=':memory:')
+    assert db.search('11:22:33:44:55:66') == ['11:22:33:44:55:66']
+    assert [info for _ts, info in db.get_info_history('11:22:33:44:55:66')] == ['testinfo2', 'testinfo3']
+    db.delete()
+
+
+def test_leftover_ramfile(tmp_path):
+
+    # A tmpfs file of a crashed run, without a file on disk
+    ramfile = tmp_path / 'ram.sqlite'
+    con = sqlite3.connect(ramfile)
+    con.execute(device_dbase.DB_CREATE)
+    con.close()
+
+    db = device_dbase.DeviceDatabase(tmp_path / 'disk.sqlite', ramfile=ramfile, persist_interval=3600)
+    assert db.add('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1')
+    db.close()
+
+
+def test_missing_info(tmp_path):
+
+    db = device_dbase.DeviceDatabase(tmp_path / 'history.sqlite')
+    assert db.add('aa:bb:cc:dd:ee:ff', 'testname1', None)
+    assert db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', None) is False
+    assert db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1') is True
+    assert db.upsert('aa:bb:cc:dd:ee:ff', 'testname1', None) is True
+    assert [info for _ts, info in db.get_info_history('aa:bb:cc:dd:ee:ff')] == ['', 'testinfo1', '']
+    db.close()
+
+
+def test_persist_waits_for_write(tmp_path):
+
+    dbase_file = tmp_path / 'ram.sqlite'
+    db = device_dbase.DeviceDatabase(dbase_file, ramfile=':memory:', persist_interval=3600)
+    add_history = db.add_history
+    persist_threads = []
+
+    def add_history_during_persist(*args):
+        # The persist thread wakes up between the device row and its history row
+        thread = threading.Thread(target=db.persist)
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        persist_threads.append(thread)
+        add_history(*args)
+
+    db.add_history = add_history_during_persist
+    db.add('aa:bb:cc:dd:ee:ff', 'testname1', 'testinfo1')
+    persist_threads[0].join()
+
+    disk = sqlite3.connect(dbase_file)
+    assert disk.execute('select count(*) from devices').fetchone()[0] == 1
+    assert disk.execute('select count(*) from history').fetchone()[0] == 1
+    disk.close()
+    db.close()
+
+
+def check_sightings(db):
+
+    db.add_sightings([
+        ('aa:bb:cc:dd:ee:ff', 100.0, -60, 0),
+        ('11:22:33:44:55:66', 101.0, -70, 1),
+        ('aa:bb:cc:dd:ee:ff', 102.0, -61, 0),
+    ])
+    db.add_sighting('AA:BB:CC:DD:EE:FF', 103.0, -62)
+
+    assert len(db.get_sightings()) == 4
+    assert db.get_sightings(addr='11:22:33:44:55:66') == [('11:22:33:44:55:66', 101.0, -70, 1)]
+    assert db.get_sightings(addr='aa:bb:cc:dd:ee:ff', start=101.0, end=103.0) == [
+        ('AA:BB:CC:DD:EE:FF', 102.0, -61, 0),
+        ('AA:BB:CC:DD:EE:FF', 103.0, -62, 0),
+    ]
+
+
+def test_sightings_sqlite(tmp_path):
+
+    db = device_dbase.DeviceDatabase(tmp_path / 'sightings.sqlite')
+    check_sightings(db)
+    db.delete()
+
+
+def test_sightings_log(tmp_path):
+
+    log = device_dbase.SightingLog(tmp_path / 'log', segment_records=3, index_every=2)
+    db = device_dbase.DeviceDatabase(tmp_path / 'devices.sqlite', sighting_store=log)
+    check_sightings(db)
+    assert len(log.segments) == 2
+    db.close()
+
+    # Reopen and rebuild the index from the segment files
+    log = device_dbase.SightingLog(tmp_path / 'log', segment_records=3, index_every=2)
+    assert log.index == [[[100.0, 101.0], [102.0, 102.0]], [[103.0, 103.0]]]
+    assert log.get_sightings(start=102.5) == [('AA:BB:CC:DD:EE:FF', 103.0, -62, 0)]
+    log.close()
+
+
+def test_sightings_log_bad_batch(tmp_path):
+
+    log = device_dbase.SightingLog(tmp_path / 'log', segment_records=3, index_every=2)
+    log.add_sightings([('AA:BB:CC:DD:EE:FF', 100.0, -60, 0)])
+
+    # Nothing of a batch with a bad address or an RSSI out of range is stored
+    with pytest.raises(ValueError):
+        log.add_sightings([('AA:BB:CC:DD:EE:FF', 101.0, -61, 0), ('not an address', 102.0, -62, 0)])
+    with pytest.raises(struct.error):
+        log.add_sightings([('AA:BB:CC:DD:EE:FF', 101.0, -61, 0), ('AA:BB:CC:DD:EE:FF', 102.0, 40000, 0)])
+    assert log.records_in_segment == 1
+    assert log.index == [[[100.0, 100.0]]]
+
+    # A batch over the end of a segment
+    log.add_sightings((f'AA:BB:CC:DD:EE:{i:02X}', 101.0 + i, -61, 0) for i in range(4))
+    assert log.index == [[[100.0, 101.0], [102.0, 102.0]], [[103.0, 104.0]]]
+    assert [sighting[1] for sighting in log.get_sightings(start=101.5)] == [102.0, 103.0, 104.0]
+    log.close()
+
+
+def test_rssi_history(tmp_path):
+
+    db = device_dbase.DeviceDatabase(tmp_path / 'rssi.sqlite')
+
+    timestamps = [1600000000.0 + i * 1.5 for i in range(100)]
+    rssis = [-60 - (i // 10) % 3 for i in range(100)]
+    db.add_rssi_history('aa:bb:cc:dd:ee:ff', timestamps, rssis, block_samples=16)
+    db.add_rssi_history('11:22:33:44:55:66', timestamps, rssis)
+
+    assert db.get_rssi_history('aa:bb:cc:dd:ee:ff') == (timestamps, rssis)
+    assert db.get_rssi_history('aa:bb:cc:dd:ee:ff', start=timestamps[20], end=timestamps[40]) == (timestamps[20:41], rssis[20:41])
+    assert db.get_rssi_history('00:00:00:00:00:00') == ([], [])
+
+    if device_dbase.rssi_codec.np is not None:
+        ts_array, rssi_array = db.get_rssi_history('aa:bb:cc:dd:ee:ff', start=timestamps[20], end=timestamps[40], as_arrays=True)
+        assert ts_array.tolist() == timestamps[20:41]
+        assert rssi_array.tolist() == rssis[20:41]
+
+    db.delete()
+
+
+def test_rssi_history_without_numpy(tmp_path, monkeypatch):
+
+    db = device_dbase.DeviceDatabase(tmp_path / 'rssi.sqlite')
+    db.add_rssi_history('aa:bb:cc:dd:ee:ff', [1600000000.0, 1600000001.0], [-60, -61])
+    monkeypatch.setattr(device_dbase.rssi_codec, 'np', None)
+
+    # The lists still work, the arrays need numpy
+    assert db.get_rssi_history('aa:bb:cc:dd:ee:ff') == ([1600000000.0, 1600000001.0], [-60, -61])
+    with pytest.raises(ImportError, match='numpy'):
+        db.get_rssi_history('aa:bb:cc:dd:ee:ff', as_arrays=True)
+    with pytest.raises(ImportError, match='numpy'):
+        device_dbase.rssi_codec.decode_block_numpy(b'')
+    db.delete()
@@ -0,0 +1,96 @@
+# global imports
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from device_registry import DeviceRegistry, format_ns
+import py_bluetoothctl_scan
+
+
+class FakeClock:
+    """Monotonic clock, advancing 1 ms per call"""
+    def __init__(self):
+        self.ns = 0
+
+    def __call__(self):
+        self.ns += 1000000
+        return self.ns
+
+
+def test_change_detection():
+
+    registry = DeviceRegistry(clock=FakeClock())
+    addr = 'D8:DD:6B:81:74:8B'
+    manufdata = {0x0075: b'\x42\x04\x01'}
+
+    change = registry.update(addr, name='Hue Lamp', rssi=-60, manufacturerdata=manufdata)
+    assert change.kind == 'new'
+    assert change.fields == {'name': 'Hue Lamp', 'rssi': -60, 'manufacturerdata': manufdata}
+
+    # Equal values are no change, even when they are other objects
+    assert registry.update(addr, name='Hue Lamp', rssi=-60, manufacturerdata={0x0075: b'\x42\x04\x01'}) is None
+
+    change = registry.update(addr, name='Hue Lamp', rssi=-55, txpower=-12)
+    assert change.kind == 'changed'
+    assert change.fields == {'rssi': -55, 'txpower': -12}
+
+    device = registry.get(addr)
+    assert (device.rssi, device.txpower, device.name) == (-55, -12, 'Hue Lamp')
+
+    with pytest.raises(ValueError):
+        registry.update(addr, colour='red')
+
+    assert registry.remove(addr).kind == 'deleted'
+    assert registry.remove(addr) is None
+    assert len(registry) == 0
+
+
+def test_first_last_seen():
+
+    registry = DeviceRegistry(clock=FakeClock())
+    registry.update('AA:BB:CC:DD:EE:01', name='first')
+    registry.update('AA:BB:CC:DD:EE:02', name='second')
+    registry.update('AA:BB:CC:DD:EE:01')
+
+    device = registry.get('AA:BB:CC:DD:EE:01')
+    assert device.first_seen == 1000000
+    assert device.last_seen == 3000000
+    assert registry.seen_since(2000000) == ['AA:BB:CC:DD:EE:01', 'AA:BB:CC:DD:EE:02']
+    assert registry.seen_since(2500000) == ['AA:BB:CC:DD:EE:01']
+
+    # Only formatted on output
+    assert device.timestamp == format_ns(device.last_seen)
+
+
+def test_process_devices():
+
+    devices = py_bluetoothctl_scan.process_devices(py_bluetoothctl_scan.sampleoutput_bluetoothctl_devices)
+
+    assert len(devices) == 12
+    assert devices['24:FC:E5:8F:AB:89'].name == '[TV] Samsung Q70 Series (49)'
+    first_seen = devices['24:FC:E5:8F:AB:89'].first_seen
+
+    py_bluetoothctl_scan.process_devices(py_bluetoothctl_scan.sampleoutput_bluetoothctl_devices)
+    assert devices['24:FC:E5:8F:AB:89'].first_seen == first_seen
+    assert devices['24:FC:E5:8F:AB:89'].last_seen >= first_seen
+
+
+def test_parse_device_list():
+
+    data = ('Agent registered\n'
+            '[bluetooth]# devices\n'
+            'Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n'
+            '\n'
+            'Device 5A:B5:65:89:46:37\n'
+            'Device d8:dd:6b:81:74:8b Hue Lamp')
+
+    assert py_bluetoothctl_scan.parse_device_list(data) == [
+        ('24:FC:E5:8F:AB:89', '[TV] Samsung Q70 Series (49)'),
+        ('5A:B5:65:89:46:37', ''),
+        ('d8:dd:6b:81:74:8b', 'Hue Lamp'),
+    ]
+    assert py_bluetoothctl_scan.get_mac_addresses(data) == ['24:FC:E5:8F:AB:89', '5A:B5:65:89:46:37', 'd8:dd:6b:81:74:8b']
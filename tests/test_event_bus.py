@@ -0,0 +1,122 @@
+# global imports
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from event_bus import EventBus
+
+
+def test_slow_subscriber_does_not_stall():
+
+    gate = threading.Event()
+    entered = threading.Event()
+    fast, slow = [], []
+
+    def slow_handler(event):
+        entered.set()
+        gate.wait()
+        slow.append(event)
+
+    with EventBus() as bus:
+        bus.subscribe(fast.append, 'fast', maxsize=10000)
+        slow_subscription = bus.subscribe(slow_handler, 'slow', maxsize=10, policy='drop_oldest')
+
+        bus.publish(0)
+        entered.wait()
+        start = time.perf_counter()
+        for event in range(1, 1000):
+            bus.publish(event)
+        assert time.perf_counter() - start < 1.0
+        assert slow_subscription.lag() == 10
+        gate.set()
+
+    assert fast == list(range(1000))
+    # The first event was taken before the queue filled up, and the latest ten were kept
+    assert slow == [0] + list(range(990, 1000))
+    stats = slow_subscription.stats()
+    assert stats['dropped'] == 989
+    assert stats['max_queued'] == 10
+    assert stats['max_latency_ms'] > 0
+
+
+def test_drop_newest_and_block():
+
+    newest, blocked = [], []
+    newest_gate, blocked_gate = threading.Event(), threading.Event()
+    entered = threading.Semaphore(0)
+
+    def wait_then(received, gate):
+        def handler(event):
+            entered.release()
+            gate.wait()
+            received.append(event)
+        return handler
+
+    bus = EventBus()
+    bus.subscribe(wait_then(newest, newest_gate), 'newest', maxsize=5, policy='drop_newest')
+    bus.subscribe(wait_then(blocked, blocked_gate), 'block', maxsize=5, policy='block')
+
+    # Both handlers hold the first event, before the queues fill up
+    bus.publish(0)
+    entered.acquire()
+    entered.acquire()
+    publisher = threading.Thread(target=lambda: [bus.publish(event) for event in range(1, 20)])
+    publisher.start()
+    publisher.join(0.2)
+    # Waiting for the blocking subscriber
+    assert publisher.is_alive()
+    blocked_gate.set()
+    publisher.join()
+    newest_gate.set()
+    bus.close()
+
+    assert newest == list(range(6))
+    assert blocked == list(range(20))
+    assert [stats['dropped'] for stats in bus.stats()] == [14, 0]
+
+
+def test_handler_errors_are_counted():
+
+    def handler(event):
+        if event % 2:
+            raise ValueError(event)
+
+    bus = EventBus()
+    subscription = bus.subscribe(handler)
+    for event in range(10):
+        bus.publish(event)
+    bus.close()
+
+    stats = subscription.stats()
+    assert stats['name'] == 'handler'
+    assert (stats['delivered'], stats['errors']) == (10, 5)
+
+
+def test_unknown_policy():
+
+    with pytest.raises(ValueError):
+        EventBus().subscribe(print, policy='drop_random')
+
+
+def test_timer_while_idle():
+
+    ticks, handled = [], []
+
+    def timer():
+        # Runs in the thread of the handler
+        ticks.append(threading.current_thread())
+
+    with EventBus() as bus:
+        subscription = bus.subscribe(handled.append, 'ticking', timer=timer, interval=0.1)
+        bus.publish(0)
+        time.sleep(0.55)
+
+    assert handled == [0]
+    assert 3 <= len(ticks) <= 6
+    assert set(ticks) == {subscription.thread}
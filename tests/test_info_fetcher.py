@@ -0,0 +1,85 @@
+# global imports
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+import info_fetcher
+from info_fetcher import InfoFetcher, SessionFetch
+
+fake_bluetoothctl = [sys.executable, '-u', os.path.join(os.path.dirname(__file__), 'fake_bluetoothctl.py')]
+
+
+def slow_fetch(addr, deadline):
+    """Every device answers after 0.1 s, a vanished one only at the deadline"""
+    if addr == '00:00:00:00:00:00':
+        time.sleep(deadline)
+        return ''
+    time.sleep(0.1)
+    return f'Device {addr} (random)\n\tRSSI: -60'
+
+
+def test_parallel_fetch():
+
+    addresses = [f'AA:BB:CC:DD:EE:{i:02X}' for i in range(40)] + ['00:00:00:00:00:00']
+    fetcher = InfoFetcher(workers=20, deadline=0.5, fetch=slow_fetch)
+
+    start = time.perf_counter()
+    results = list(fetcher.fetch_all(addresses))
+    elapsed = time.perf_counter() - start
+
+    # 41 devices of at least 0.1 s each, sequentially more than 4 s
+    assert elapsed < 1.5
+    assert len(results) == 41
+    # The vanished device finishes last, and is reported as failed
+    assert results[-1].addr == '00:00:00:00:00:00'
+    assert not results[-1].ok
+    assert all(result.ok for result in results[:-1])
+
+    stats = fetcher.stats()
+    assert stats['devices'] == 41
+    assert stats['failed'] == 1
+    assert stats['max'] >= 0.5
+
+
+def test_session_fetch():
+
+    with InfoFetcher(workers=2, fetch=SessionFetch(fake_bluetoothctl)) as fetcher:
+        results = {result.addr: result for result in fetcher.fetch_all(['24:FC:E5:8F:AB:89', 'D8:DD:6B:81:74:8B', '00:00:00:00:00:00'])}
+        # The sessions end with the fetch_all call
+        assert fetcher.fetch.sessions == []
+
+    assert results['24:FC:E5:8F:AB:89'].ok
+    assert results['24:FC:E5:8F:AB:89'].info.startswith('Device 24:FC:E5:8F:AB:89 (public)')
+    assert not results['00:00:00:00:00:00'].ok
+
+
+def test_session_startup_deadline(monkeypatch):
+
+    started = []
+
+    class Session(info_fetcher.BluetoothctlSession):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            started.append(self)
+
+    monkeypatch.setattr(info_fetcher, 'BluetoothctlSession', Session)
+
+    # A bluetoothctl which never shows its prompt
+    hanging = [sys.executable, '-c', 'import time; time.sleep(30)']
+    fetcher = InfoFetcher(workers=2, deadline=0.5, fetch=SessionFetch(hanging))
+
+    start = time.perf_counter()
+    results = list(fetcher.fetch_all(['24:FC:E5:8F:AB:89', 'D8:DD:6B:81:74:8B', 'AA:BB:CC:DD:EE:FF']))
+    elapsed = time.perf_counter() - start
+
+    assert len(results) == 3
+    assert not any(result.ok for result in results)
+    assert all(result.latency < 1.0 for result in results)
+    assert elapsed < 3.0
+    # Every worker started a new session after the one which timed out, and all were killed
+    assert len(started) == 3
+    assert all(session.process.poll() is not None for session in started)
+    assert fetcher.fetch.sessions == []
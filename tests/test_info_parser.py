@@ -0,0 +1,77 @@
+# global imports
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from info_parser import parse_info
+import py_bluetoothctl_scan
+
+
+def test_parse_manufdata():
+
+    info = parse_info(py_bluetoothctl_scan.test_info_manufdata)
+
+    assert info.addr == '24:FC:E5:8F:AB:89'
+    assert info.addr_type == 'public'
+    assert info.name == '[TV] Samsung Q70 Series (49)'
+    assert info.device_class == 0x000c043c
+    assert info.paired is False
+    assert info.uuids[0] == '0000110a-0000-1000-8000-00805f9b34fb'
+    assert len(info.uuids) == 5
+    assert info.modalias == 'bluetooth:v04E8p8080d0000'
+
+    # The same values as the list based get_manuf_data()
+    assert {f'0x{key:04x}': list(value) for key, value in info.manufacturer_data.items()} == \
+        py_bluetoothctl_scan.get_manuf_data(py_bluetoothctl_scan.test_info_manufdata)
+
+
+def test_parse_servicedata():
+
+    info = parse_info(py_bluetoothctl_scan.test_info_servicedata)
+
+    assert info.addr_type == 'random'
+    assert info.alias == '23-A0-64-00-3A-F1'
+    assert {key: list(value) for key, value in info.service_data.items()} == \
+        py_bluetoothctl_scan.get_service_data(py_bluetoothctl_scan.test_info_servicedata)
+
+
+def test_parse_rssi():
+
+    info = parse_info("Device 47:B6:7A:81:C4:BC (random)\n\tRSSI: 0xffffffc2 (-62)\n\tTxPower: 4\n"
+                      "\tAdvertisingFlags:\n  06                                               .\n\tWakeAllowed: no\n")
+    assert info.rssi == -62
+    assert info.txpower == 4
+    assert info.other == {'AdvertisingFlags': b'\x06', 'WakeAllowed': 'no'}
+
+
+def test_parse_bluez_hex_values():
+
+    # bluez 5.6x adds the decimal value to the Class and the ManufacturerData Key
+    info = parse_info("Device 24:FC:E5:8F:AB:89 (public)\n"
+                      "\tClass: 0x000c043c (787516)\n"
+                      "\tManufacturerData Key: 0x0075 (117)\n"
+                      "\tManufacturerData Value:\n"
+                      "  42 04 01 20                                      B.. \n"
+                      "\tRSSI: 0xffffffc2 (-62)\n")
+    assert info.device_class == 0x000c043c
+    assert info.manufacturer_data == {0x0075: b'\x42\x04\x01\x20'}
+    assert info.rssi == -62
+
+
+def test_parse_value_without_key():
+
+    # Each Value belongs to the Key line right before it, a Value without one is skipped
+    info = parse_info("Device 24:FC:E5:8F:AB:89 (public)\n"
+                      "\tManufacturerData Value:\n"
+                      "  01 02                                            .. \n"
+                      "\tManufacturerData Key: 0x0075 (117)\n"
+                      "\tManufacturerData Value:\n"
+                      "  42 04                                            B. \n"
+                      "\tServiceData Value:\n"
+                      "  03 04                                            .. \n"
+                      "\tManufacturerData Value:\n"
+                      "  05 06                                            .. \n")
+    assert info.manufacturer_data == {0x0075: b'\x42\x04'}
+    assert info.service_data == {}
@@ -0,0 +1,124 @@
+# global imports
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from info_refresh import RefreshScheduler
+
+
+def info(addr, name):
+    return f'Device {addr} (public)\n\tName: {name}\n\tRSSI: -60\n'
+
+
+def test_budget_and_priority():
+
+    scheduler = RefreshScheduler(budget=3, clock=lambda: 0.0)
+    strong = [f'AA:BB:CC:DD:EE:{i:02X}' for i in range(3)]
+    weak = [f'11:22:33:44:55:{i:02X}' for i in range(3)]
+    for addr in weak:
+        scheduler.add(addr, -95)
+    for addr in strong:
+        scheduler.add(addr, -45)
+
+    # New devices first, the strongest ones first, and never more than the budget
+    batch = scheduler.next_batch()
+    assert sorted(batch) == strong
+    for addr in batch:
+        assert scheduler.done(addr, info(addr, 'lamp'), now=0.0) is False
+
+    assert sorted(scheduler.next_batch()) == weak
+    assert scheduler.freshness(now=0.0)['never_refreshed'] == 3
+
+    # The weak devices are out of the heap until they are done
+    assert sorted(scheduler.next_batch()) == strong
+    assert scheduler.next_batch() == []
+
+
+def test_changing_devices_are_refreshed_more_often():
+
+    scheduler = RefreshScheduler(budget=1, base_interval=10.0, min_interval=1.0, clock=lambda: 0.0)
+    scheduler.add('AA:BB:CC:DD:EE:01', -60)
+    scheduler.add('AA:BB:CC:DD:EE:02', -60)
+
+    queries = {'AA:BB:CC:DD:EE:01': 0, 'AA:BB:CC:DD:EE:02': 0}
+    for second in range(1000):
+        for addr in scheduler.next_batch():
+            queries[addr] += 1
+            # Only the first device changes its name, the RSSI line does not count as a change
+            name = f'lamp {second}' if addr.endswith('01') else 'lamp'
+            scheduler.done(addr, info(addr, name), now=float(second))
+
+    assert queries['AA:BB:CC:DD:EE:01'] > 3 * queries['AA:BB:CC:DD:EE:02']
+    freshness = scheduler.freshness(now=1000.0)
+    assert freshness['queries'] == 1000
+    assert freshness['changes'] == queries['AA:BB:CC:DD:EE:01'] - 1
+    assert len(scheduler.heap) <= 2 * len(scheduler) + 64
+
+
+def test_failed_query_is_retried():
+
+    scheduler = RefreshScheduler(budget=2, min_interval=5.0, clock=lambda: 0.0)
+    scheduler.add('AA:BB:CC:DD:EE:01', -60)
+    scheduler.add('AA:BB:CC:DD:EE:02', -60)
+    scheduler.remove('AA:BB:CC:DD:EE:02')
+
+    assert scheduler.next_batch() == ['AA:BB:CC:DD:EE:01']
+    scheduler.done('AA:BB:CC:DD:EE:01', None, now=100.0)
+    assert scheduler.freshness(now=100.0)['never_refreshed'] == 1
+    assert scheduler.heap[0][0] == 105.0
+
+
+def test_history_between_runs(tmp_path):
+
+    filename = tmp_path / 'info_refresh.json'
+    addrs = [f'AA:BB:CC:DD:EE:{i:02X}' for i in range(4)]
+
+    # First run: no history, so every device is queried
+    first = RefreshScheduler(budget=2, clock=lambda: 1000.0)
+    assert first.load(filename) is False
+    for addr in addrs:
+        first.add(addr, None)
+    for addr in first.next_batch(len(addrs)):
+        first.done(addr, info(addr, 'lamp'))
+    first.save(filename)
+
+    # A later run continues with the history: the stable devices are not due yet,
+    # but a device which was not queried before is
+    later = RefreshScheduler(budget=2, clock=lambda: 1010.0)
+    assert later.load(filename) is True
+    assert later.devices[addrs[0]].refreshes == 1
+    later.add('11:22:33:44:55:66', None)
+    assert later.next_batch() == ['11:22:33:44:55:66', addrs[0]]
+
+
+def test_only_present_devices():
+
+    scheduler = RefreshScheduler(budget=2, clock=lambda: 0.0)
+    scheduler.add('AA:BB:CC:DD:EE:00', -40)
+    scheduler.add('AA:BB:CC:DD:EE:01', -90)
+    assert scheduler.next_batch(present={'AA:BB:CC:DD:EE:01'}) == ['AA:BB:CC:DD:EE:01']
+    # The absent device kept its place
+    assert scheduler.next_batch() == ['AA:BB:CC:DD:EE:00']
+
+
+def test_expired_history(tmp_path):
+
+    filename = tmp_path / 'info_refresh.json'
+    scheduler = RefreshScheduler(max_interval=100.0, retention=1000.0, clock=lambda: 0.0)
+    scheduler.add('AA:BB:CC:DD:EE:00', -60, now=0.0)
+    scheduler.done('AA:BB:CC:DD:EE:00', info('AA:BB:CC:DD:EE:00', 'lamp'), now=0.0)
+    scheduler.add('AA:BB:CC:DD:EE:01', -60, now=0.0)
+    scheduler.done('AA:BB:CC:DD:EE:01', info('AA:BB:CC:DD:EE:01', 'lamp'), now=900.0)
+
+    # A rotated away address is not refreshed anymore, and is left out
+    scheduler.save(filename, now=1500.0)
+    later = RefreshScheduler(max_interval=100.0, retention=1000.0, clock=lambda: 1500.0)
+    assert later.load(filename) is True
+    assert list(later.devices) == ['AA:BB:CC:DD:EE:01']
+
+    # Also when the file is loaded long after it was saved
+    much_later = RefreshScheduler(max_interval=100.0, retention=1000.0, clock=lambda: 5000.0)
+    much_later.load(filename)
+    assert len(much_later) == 0
@@ -0,0 +1,72 @@
+# global imports
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from capture import CaptureWriter, read_capture
+from multi_scan import MultiAdapterScanner, list_controllers
+import py_bluetoothctl_scan
+
+fake_bluetoothctl = [sys.executable, '-u', os.path.join(os.path.dirname(__file__), 'fake_bluetoothctl.py')]
+
+
+def test_list_controllers():
+
+    assert list_controllers(fake_bluetoothctl) == ['B8:27:EB:6D:21:BE', '00:1A:7D:DA:71:13']
+
+
+def test_merged_scan():
+
+    scanner = MultiAdapterScanner(program=fake_bluetoothctl, parse=py_bluetoothctl_scan.parse_scan_line)
+    events = list(scanner.scan(1.0))
+
+    # 24:FC:E5:8F:AB:89 is in range of both adapters, but only new once
+    new = sorted(event.addr for _adapter, event in events if event.kind == 'NEW')
+    assert new == ['24:FC:E5:8F:AB:89', '5A:B5:65:89:46:37', 'D8:DD:6B:81:74:8B']
+
+    # The RSSI of every adapter is kept, tagged with the adapter
+    rssi = sorted((adapter, event.addr, event.value) for adapter, event in events if event.key == 'RSSI')
+    assert rssi == [
+        (0, '24:FC:E5:8F:AB:89', -70), (0, 'D8:DD:6B:81:74:8B', -60),
+        (1, '24:FC:E5:8F:AB:89', -50), (1, '5A:B5:65:89:46:37', -80),
+    ]
+
+    assert scanner.coverage() == 3
+    stats = [stats.as_dict() for stats in scanner.stats]
+    assert [entry['devices'] for entry in stats] == [2, 2]
+    assert [entry['events'] for entry in stats] == [4, 4]
+    assert sum(entry['new_devices'] for entry in stats) == 3
+    assert all(entry['events_per_s'] > 0 for entry in stats)
+    assert scanner.seen_by['24:FC:E5:8F:AB:89'] == {0, 1}
+
+
+def test_record_all_adapters(tmp_path):
+
+    filename = tmp_path / 'site.cap.gz'
+    scanner = MultiAdapterScanner(program=fake_bluetoothctl, parse=py_bluetoothctl_scan.parse_scan_line)
+    with CaptureWriter(filename) as recorder:
+        list(scanner.scan(1.0, recorder))
+
+    sources = [record.source for record in read_capture(filename)]
+    assert sorted(set(sources)) == ['scan:0', 'scan:1']
+    assert len(sources) == sum(stats.lines for stats in scanner.stats)
+
+
+def test_stop_quiet_adapters():
+
+    # After the first lines the adapters stay quiet
+    scanner = MultiAdapterScanner(program=fake_bluetoothctl, parse=py_bluetoothctl_scan.parse_scan_line)
+    threading.Timer(1.0, scanner.stop.set).start()
+
+    start = time.monotonic()
+    events = list(scanner.scan(30))
+    assert time.monotonic() - start < 3.0
+    assert len([event for _adapter, event in events if event.kind == 'NEW']) == 3
+
+    start = time.monotonic()
+    list(scanner.scan(1.0))
+    assert time.monotonic() - start < 2.0
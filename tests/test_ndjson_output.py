@@ -0,0 +1,106 @@
+# global imports
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from capture import CaptureWriter
+from device_registry import DeviceRegistry
+from address_clusters import AddressClusters
+from ndjson_output import NdjsonWriter, jsonable
+import btle_scan
+import py_bluetoothctl_scan
+
+
+def test_batches():
+
+    now = [0.0]
+    stream = io.BytesIO()
+    writer = NdjsonWriter(stream, batch_size=3, flush_interval=1.0, clock=lambda: now[0])
+    for value in range(4):
+        writer.write({"type": "scan", "value": value})
+    assert (writer.written, writer.flushes) == (4, 1)
+    assert stream.getvalue().count(b"\n") == 3
+
+    # A record which waited longer than the flush interval ends the batch
+    now[0] = 1.5
+    writer.write({"type": "scan", "value": 4})
+    assert writer.flushes == 2
+    assert [json.loads(line)["value"] for line in stream.getvalue().splitlines()] == list(range(5))
+
+    writer.write({"type": "scan", "bytes": b"\x01\xff"})
+    writer.close()
+    assert json.loads(stream.getvalue().splitlines()[-1]) == {"type": "scan", "bytes": "01ff"}
+
+
+def test_text_stream():
+
+    stream = io.StringIO()
+    with NdjsonWriter(stream) as writer:
+        writer.write({"type": "device", "name": "Lampe Küche"})
+    assert json.loads(stream.getvalue()) == {"type": "device", "name": "Lampe Küche"}
+
+
+def test_broken_pipe():
+
+    class ClosedPipe(io.RawIOBase):
+        def writable(self):
+            return True
+
+        def write(self, data):
+            raise BrokenPipeError
+
+    writer = NdjsonWriter(ClosedPipe(), batch_size=1)
+    writer.write({"type": "scan"})
+    writer.write({"type": "scan"})
+    assert writer.broken
+    assert (writer.written, writer.flushes) == (1, 0)
+
+
+def test_jsonable():
+
+    record = py_bluetoothctl_scan.ScanEvent("CHG", "47:B6:7A:81:C4:BC", "RSSI", -62)
+    assert jsonable({"event": record, 0x75: bytearray(b"\x42")}) == {
+        "event": {"kind": "CHG", "addr": "47:B6:7A:81:C4:BC", "key": "RSSI", "value": -62}, "117": "42"}
+
+
+def test_replay_ndjson(tmp_path, monkeypatch, capsys):
+
+    monkeypatch.setattr(py_bluetoothctl_scan, 'registry', DeviceRegistry())
+    monkeypatch.setattr(py_bluetoothctl_scan, 'bt_devices', py_bluetoothctl_scan.registry.devices)
+    monkeypatch.setattr(py_bluetoothctl_scan, 'clusters', AddressClusters())
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'dbase').mkdir()
+
+    filename = tmp_path / 'site.cap.gz'
+    with CaptureWriter(filename) as writer:
+        writer.write('scan', '[NEW] Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n')
+        writer.write('scan', '[CHG] Device 24:FC:E5:8F:AB:89 RSSI: -48\n')
+        writer.write('devices', 'Device 24:FC:E5:8F:AB:89 [TV] Samsung Q70 Series (49)\n')
+        writer.write('info', py_bluetoothctl_scan.Samsung_Q70_info)
+        writer.write('info', py_bluetoothctl_scan.test_info_servicedata)
+
+    py_bluetoothctl_scan.main(['--replay', str(filename), '--speed', '0', '--format', 'ndjson'])
+    out, err = capsys.readouterr()
+
+    # Only records on stdout, the text went to stderr
+    records = [json.loads(line) for line in out.splitlines()]
+    assert 'DEVICES' in err
+    assert [record['type'] for record in records] == ['scan', 'scan', 'device', 'info', 'info']
+    assert records[1]['value'] == -48 and records[1]['fields'] == {'rssi': -48}
+    assert records[2]['rssi'] == -48
+    assert records[3]['manufacturerdata']['117'].startswith('4204')
+    assert records[4]['advertisements'][0]['format'] == 'ExposureNotification'
+
+
+def test_btle_scan_ndjson(monkeypatch, capsys):
+
+    monkeypatch.setattr(btle_scan.sys, 'platform', 'win32')
+    btle_scan.main(['--format', 'ndjson'])
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {record['addr']: record['name'] for record in records} == {
+        'F4:9A:7C:BE:5F:2A': 'Hue Lamp', 'E2:A0:D0:D9:58:1D': 'Hue Lamp',
+        '00:7C:2D:E5:BE:D9': '[TV] Samsung 7 Series (65)', 'FC:03:9F:5E:05:75': None}
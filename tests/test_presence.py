@@ -0,0 +1,97 @@
+# global imports
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from device_dbase import DeviceDatabase
+from presence import PresenceTracker, TimingWheel
+import py_bluetoothctl_scan
+
+
+def test_timing_wheel_random():
+
+    rng = random.Random(3)
+    wheel = TimingWheel(slots=8, levels=3)
+    expected = {}
+    now = 0
+    for _round in range(200):
+        # Timers within, at the edge of, and beyond the range of the wheel
+        for _timer in range(20):
+            tick = now + rng.choice([0, 1, 7, 8, 63, 64, 65, 511, 512, 2000, rng.randint(1, 3000)])
+            item = len(expected)
+            wheel.schedule(item, tick)
+            expected[item] = max(tick, now + 1)
+        target = now + rng.randint(1, 40)
+        expired = wheel.advance(target)
+        assert sorted(expired) == sorted(item for item, tick in expected.items() if now < tick <= target)
+        assert all(expected[item] <= target for item in expired)
+        now = target
+
+    expired = wheel.advance(now + 4000)
+    assert len(wheel) == 0
+
+
+def test_presence_hysteresis():
+
+    tracker = PresenceTracker(depart_after=30, arrive_sightings=3, clock=lambda: 1000.0)
+    addr = 'D8:DD:6B:81:74:8B'
+
+    # A single sighting is not an arrival, and is forgotten silently
+    assert tracker.sighting('5A:B5:65:89:46:37', now=1000.0) is None
+
+    events = []
+    for second in range(1000, 1100, 10):
+        events.append(tracker.sighting(addr, now=float(second)))
+        events.extend(tracker.tick(now=float(second)))
+    events = [event for event in events if event]
+    assert [(event.kind, event.time) for event in events] == [('arrive', 1020.0)]
+    assert tracker.present() == [addr]
+    assert '5A:B5:65:89:46:37' not in tracker.devices
+
+    # Gone for less than depart_after
+    assert tracker.tick(now=1110.0) == []
+    assert tracker.tick(now=1119.0) == []
+    departs = tracker.tick(now=1130.0)
+    assert [(event.kind, event.addr) for event in departs] == [('depart', addr)]
+    assert len(tracker) == 0
+    assert len(tracker.wheel) == 0
+
+
+def test_presence_many_devices():
+
+    tracker = PresenceTracker(depart_after=20, arrive_sightings=1, clock=lambda: 0.0)
+    addresses = [f'AA:BB:CC:DD:{i // 256:02X}:{i % 256:02X}' for i in range(5000)]
+
+    arrived = [tracker.sighting(addr, now=0.0) for addr in addresses]
+    assert all(event.kind == 'arrive' for event in arrived)
+
+    # Half of the devices stay
+    for second in range(1, 60):
+        for addr in addresses[::2]:
+            tracker.sighting(addr, now=float(second))
+        departs = tracker.tick(now=float(second))
+        if second == 20:
+            assert sorted(event.addr for event in departs) == sorted(addresses[1::2])
+        else:
+            assert departs == []
+    assert len(tracker.present()) == 2500
+
+
+def test_depart_without_sightings(tmp_path, capsys):
+
+    # The scan bus finds the departure while no other device is seen
+    tracker = PresenceTracker(depart_after=0.5, arrive_sightings=1, resolution=0.1)
+    db = DeviceDatabase(tmp_path / 'presence.sqlite')
+    scan = py_bluetoothctl_scan.ScanEvent('CHG', 'D8:DD:6B:81:74:8B', 'RSSI', -60)
+    with py_bluetoothctl_scan.make_scan_bus(db, presence=tracker) as bus:
+        bus.publish(py_bluetoothctl_scan.DeviceEvent(scan.addr, scan, None, [], 0, time.time()))
+        time.sleep(1.8)
+        assert tracker.present() == []
+
+    output = capsys.readouterr().out
+    assert "kind='arrive', addr='D8:DD:6B:81:74:8B'" in output
+    assert "kind='depart', addr='D8:DD:6B:81:74:8B'" in output
@@ -0,0 +1,76 @@
+# global imports
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+np = pytest.importorskip('numpy')
+
+# local imports
+from rssi_filter import RssiSmoother
+
+
+def reference(values, alpha=0.3, process_noise=0.5, measurement_noise=16.0):
+    """EMA and Kalman estimate of one device, value by value"""
+    ema = kalman = values[0]
+    variance = measurement_noise
+    for value in values[1:]:
+        ema += alpha * (value - ema)
+        variance += process_noise
+        gain = variance / (variance + measurement_noise)
+        kalman += gain * (value - kalman)
+        variance *= 1 - gain
+    return ema, kalman
+
+
+def test_batch_matches_sequential():
+
+    rng = np.random.default_rng(7)
+    addresses = [f'AA:BB:CC:DD:{i // 256:02X}:{i % 256:02X}' for i in range(3000)]
+    smoother = RssiSmoother(capacity=16)
+    history = {}
+
+    # Windows with several values for some devices, and none for others
+    for _window in range(5):
+        picks = rng.integers(0, len(addresses), 5000)
+        batch = [addresses[i] for i in picks]
+        rssis = rng.integers(-95, -40, len(batch)).tolist()
+        smoother.update(batch, rssis)
+        for addr, rssi in zip(batch, rssis):
+            history.setdefault(addr, []).append(rssi)
+
+    assert len(smoother) == len(history)
+    for addr, values in history.items():
+        ema, kalman, distance = smoother.get(addr)
+        assert (ema, kalman) == pytest.approx(reference(values))
+        assert distance is None
+
+
+def test_distance():
+
+    smoother = RssiSmoother()
+    smoother.update(['AA:BB:CC:DD:EE:01', 'AA:BB:CC:DD:EE:02'], [-53, -73])
+    smoother.set_txpower(['AA:BB:CC:DD:EE:01', 'AA:BB:CC:DD:EE:02'], [-12, -12])
+
+    # -12 dBm at 0 m is -53 dBm at 1 m. 20 dB more loss is 10 m, in free space.
+    assert smoother.get('AA:BB:CC:DD:EE:01')[2] == pytest.approx(1.0)
+    assert smoother.get('AA:BB:CC:DD:EE:02')[2] == pytest.approx(10.0)
+    assert smoother.get('00:00:00:00:00:00') == (None, None, None)
+
+
+def test_window():
+
+    now = [0.0]
+    smoother = RssiSmoother(window=1.0, clock=lambda: now[0])
+
+    smoother.add('AA:BB:CC:DD:EE:01', -60)
+    now[0] = 0.5
+    smoother.add('AA:BB:CC:DD:EE:01', -70)
+    assert smoother.get('AA:BB:CC:DD:EE:01') == (None, None, None)
+
+    now[0] = 1.0
+    smoother.add('AA:BB:CC:DD:EE:02', -50)
+    assert smoother.get('AA:BB:CC:DD:EE:01')[0] == pytest.approx(-63.0)
+    assert smoother.pending_addresses == []
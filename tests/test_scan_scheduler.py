@@ -0,0 +1,67 @@
+# global imports
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# local imports
+from bluetoothctl_session import BluetoothctlSession
+from scan_scheduler import DutyCycleScheduler
+import py_bluetoothctl_scan
+
+fake_bluetoothctl = [sys.executable, '-u', os.path.join(os.path.dirname(__file__), 'fake_bluetoothctl.py')]
+
+
+def test_adaptation():
+
+    scheduler = DutyCycleScheduler(transports=('le',), min_window=2, max_window=16, start_window=4, max_idle=20)
+
+    # Busy windows grow up to max_window, without idle gaps
+    for expected in (4, 8, 16, 16):
+        assert scheduler.next_window() == ('le', expected)
+        scheduler.report('le', expected, new_devices=5)
+        assert scheduler.idle_gap() == 0
+
+    # Quiet windows shrink down to min_window, and the idle gap grows up to max_idle
+    windows = []
+    gaps = []
+    for _round in range(6):
+        transport, window = scheduler.next_window()
+        scheduler.report(transport, window, new_devices=0)
+        windows.append(window)
+        gaps.append(scheduler.idle_gap())
+    assert windows == [16, 8, 4, 2, 2, 2]
+    assert gaps == [2, 4, 8, 16, 20, 20]
+
+    assert scheduler.scan_time == 4 + 8 + 16 + 16 + sum(windows)
+    assert scheduler.duty_cycle() == scheduler.scan_time / (scheduler.scan_time + sum(gaps))
+
+
+def test_interleaved_transports():
+
+    scheduler = DutyCycleScheduler(start_window=4)
+    transports = []
+    for _i in range(4):
+        transport, window = scheduler.next_window()
+        transports.append(transport)
+        scheduler.report(transport, window, new_devices=0)
+        gap = scheduler.idle_gap()
+        # The idle gap is only taken after both transports had their turn
+        assert (gap > 0) == (transport == 'bredr')
+    assert transports == ['le', 'bredr', 'le', 'bredr']
+
+
+def test_scheduled_scan_events():
+
+    scheduler = DutyCycleScheduler(min_window=0.1, max_window=0.4, start_window=0.2, max_idle=0.1)
+    with BluetoothctlSession(fake_bluetoothctl) as session:
+        events = []
+        for event in py_bluetoothctl_scan.scheduled_scan_events(1.5, scheduler, session=session):
+            py_bluetoothctl_scan.apply_scan_event(event)
+            events.append(event)
+
+    assert {(event.kind, event.addr) for event in events} == {('NEW', 'D8:DD:6B:81:74:8B'), ('NEW', '24:FC:E5:8F:AB:89')}
+    assert [window.transport for window in scheduler.history[:2]] == ['le', 'bredr']
+    # Only the first window of each transport found a new device
+    assert sum(window.new_devices for window in scheduler.history) <= 2
+    assert 0 < scheduler.duty_cycle() <= 1
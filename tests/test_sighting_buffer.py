@@ -0,0 +1,98 @@
+# global imports
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+np = pytest.importorskip('numpy')
+
+# local imports
+from device_dbase import DeviceDatabase
+from sighting_buffer import SightingBuffer
+
+
+def make_sightings(count, devices=50, seed=1):
+    rng = random.Random(seed)
+    return [(f'AA:BB:CC:DD:EE:{rng.randrange(devices):02X}', 1000.0 + i * 0.1, rng.randint(-100, -30), rng.randrange(2))
+            for i in range(count)]
+
+
+def test_same_as_reference():
+
+    sightings = make_sightings(5000)
+    single = SightingBuffer(chunk_size=256, chunk_seconds=30.0)
+    for sighting in sightings:
+        single.add_sighting(*sighting)
+    batch = SightingBuffer(chunk_size=256, chunk_seconds=30.0)
+    for first in range(0, len(sightings), 700):
+        batch.add_sightings(sightings[first:first + 700])
+
+    for buffer in (single, batch):
+        assert buffer.get_sightings() == sightings
+        assert buffer.get_sightings('AA:BB:CC:DD:EE:07', 1100.0, 1200.0) == [
+            s for s in sightings if s[0] == 'AA:BB:CC:DD:EE:07' and 1100.0 <= s[1] <= 1200.0]
+        assert buffer.get_sightings('00:00:00:00:00:00') == []
+        # No chunk spans more than chunk_seconds
+        assert all(chunk.t_max - chunk.t_min < 30.0 for chunk in buffer.chunks)
+
+
+def test_group_by():
+
+    sightings = make_sightings(3000)
+    buffer = SightingBuffer(chunk_size=1000)
+    buffer.add_sightings(sightings)
+
+    recent = [s for s in sightings if s[1] >= sightings[-1][1] - 60.0]
+    stats = buffer.group_by(seconds=60.0)
+    assert stats['count'].sum() == len(recent)
+    for row in stats:
+        rssis = [s[2] for s in recent if s[0] == buffer.addresses[row['addr_id']]]
+        assert row['count'] == len(rssis)
+        assert row['mean_rssi'] == pytest.approx(sum(rssis) / len(rssis))
+        assert (row['min_rssi'], row['max_rssi']) == (min(rssis), max(rssis))
+
+    # Filter with a mask first
+    rows = buffer.window(60.0)
+    strong = buffer.group_by(rows=rows[(rows['rssi'] > -50) & (rows['adapter'] == 1)])
+    assert strong['count'].sum() == sum(1 for s in recent if s[2] > -50 and s[3] == 1)
+
+
+def test_retention_reuses_chunks():
+
+    buffer = SightingBuffer(chunk_size=100, chunk_seconds=10.0, retention=60.0)
+    for second in range(600):
+        buffer.append([0, 1, 2], [float(second)] * 3, [-60, -70, -80])
+
+    # The chunks of the last minute, and the one being filled
+    assert len(buffer.chunks) <= 8
+    assert buffer.window()['ts'].min() >= 599.0 - 70.0
+    assert buffer.nbytes() <= 10 * 100 * 16
+    # 30 sightings per 10 s chunk: the closed chunks are shrunk to their sightings
+    assert all(len(chunk.data) == chunk.count == 30 for chunk in buffer.chunks[:-1])
+    assert buffer.views(start=595.0)[-1]['ts'][-1] == 599.0
+    assert buffer.views()[0].base is buffer.chunks[0].data
+
+
+def test_database_store(tmp_path):
+
+    sightings = make_sightings(500)
+    db = DeviceDatabase(tmp_path / 'dbase.sql', sighting_store=SightingBuffer(chunk_size=64))
+    db.add_sightings(sightings[:-1])
+    db.add_sighting(*sightings[-1])
+    assert db.get_sightings() == sightings
+    assert db.get_sightings('AA:BB:CC:DD:EE:01', start=1020.0) == [
+        s for s in sightings if s[0] == 'AA:BB:CC:DD:EE:01' and s[1] >= 1020.0]
+    db.close()
+
+
+def test_to_pandas():
+
+    pytest.importorskip('pandas')
+    buffer = SightingBuffer()
+    buffer.add_sightings(make_sightings(100))
+    frame = buffer.to_pandas()
+    assert list(frame.columns) == ['addr', 'ts', 'rssi', 'adapter']
+    assert len(frame) == 100